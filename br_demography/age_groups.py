@@ -0,0 +1,277 @@
+import numpy as np
+import pandas as pd
+import os
+from functools import lru_cache
+from scipy import sparse
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+
+### Age grouping engine shared by the standard_age_groups functions of every module. Each csv which maps ages to
+### age groups is read only once and compiled into NumPy lookup arrays, ages are mapped with integer indexing and
+### records are summed with np.bincount into a dense array over every combination of keys and age groups.
+### Tables kept at single-year ages (or the five-year labels of the 2022 census, the finest it has) are regrouped
+### in memory by regroup, which multiplies them by a sparse age to age group operator per registered scheme,
+### all schemes at once, so switching schemes never queries the data again.
+
+OUT_OF_SCOPE = 'Fora de Escopo'
+SOURCE_TAB = os.path.join(os.path.dirname(__file__), 'source', 'tab')
+
+# schemes that can be given by name instead of csv path, see register_scheme
+SCHEMES = {
+    'censo_2000_2010': os.path.join(SOURCE_TAB, 'faixas_etarias_censo_2000_2010.csv'),
+    'censo_2000_2010_65_anos_mais': os.path.join(SOURCE_TAB, 'faixas_etarias_censo_2000_2010_65_anos_mais.csv'),
+    'censo_2022': os.path.join(SOURCE_TAB, 'faixas_etarias_censo_2022.csv'),
+    'censo_2022_65_anos_mais': os.path.join(SOURCE_TAB, 'faixas_etarias_censo_2022_65_anos_mais.csv'),
+    'maes': os.path.join(SOURCE_TAB, 'faixas_etarias_maes.csv'),
+}
+
+
+class AgeGroupScheme(NamedTuple):
+    path: str
+    keys: np.ndarray # ages (or age labels, as in the 2022 census csv) found in the first column of the csv
+    labels: np.ndarray # ordered age groups, without 'Fora de Escopo'
+    key_codes: np.ndarray # position in labels of the age group of each key, -1 when out of scope
+    lookup: Optional[np.ndarray] # age group code indexed by integer age, None for label based schemes
+
+
+@lru_cache(maxsize=None)
+def _load_scheme(path: str) -> AgeGroupScheme:
+    df_age_group = pd.read_csv(path, sep=';') #loads csv which maps ages and age groups
+    keys = df_age_group.iloc[:, 0].to_numpy()
+    groups = df_age_group.iloc[:, 1].to_numpy()
+
+    labels = pd.unique(groups)
+    labels = labels[labels != OUT_OF_SCOPE]
+    key_codes = pd.Index(labels).get_indexer(groups)
+
+    lookup = None
+    if pd.api.types.is_integer_dtype(df_age_group.iloc[:, 0]):
+        if keys.min() < 0:
+            raise ValueError("Ages in the age group csv cannot be negative.")
+        lookup = np.full(keys.max() + 1, -1, dtype=np.int64)
+        lookup[keys] = key_codes
+
+    return AgeGroupScheme(path=path, keys=keys, labels=labels, key_codes=key_codes, lookup=lookup)
+
+
+def load_scheme(age_group_csv_path: str) -> AgeGroupScheme:
+    '''
+    Returns the compiled age group scheme of a csv which maps ages and age groups. Each csv is read only once per
+    session.
+
+    CSV columns must be separated by semi-colon.
+    '''
+
+    return _load_scheme(os.path.abspath(SCHEMES.get(age_group_csv_path, age_group_csv_path)))
+
+
+def register_scheme(name: str, age_group_csv_path: str) -> None:
+    '''
+    Registers a csv which maps ages and age groups under name, so it can be passed by name to load_scheme and
+    regroup.
+    '''
+
+    if not os.path.isfile(age_group_csv_path):
+        raise ValueError(f"{age_group_csv_path} is not a file.")
+    SCHEMES[name] = age_group_csv_path
+
+
+def age_group_codes(ages, scheme: AgeGroupScheme) -> np.ndarray:
+    '''
+    Returns, for each age, the position of its age group in scheme.labels. Missing ages, ages absent from the csv
+    and ages mapped to 'Fora de Escopo' receive -1.
+    '''
+
+    if scheme.lookup is None:
+        codes = pd.Categorical(np.asarray(ages, dtype=object), categories=scheme.keys).codes.astype(np.int64)
+        return np.where(codes >= 0, scheme.key_codes[np.maximum(codes, 0)], -1)
+
+    ages = pd.Series(ages)
+    if pd.api.types.is_integer_dtype(ages) and not ages.hasnans:
+        ages = ages.to_numpy(dtype=np.int64)
+        valid = (ages >= 0) & (ages < len(scheme.lookup))
+    else:
+        ages = pd.to_numeric(ages, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        valid = (ages >= 0) & (ages < len(scheme.lookup)) & (ages == np.floor(ages))
+        ages = np.where(valid, ages, 0).astype(np.int64)
+
+    codes = scheme.lookup[np.where(valid, ages, 0)]
+    codes[~valid] = -1
+
+    return codes
+
+
+def _factorize(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    # integer and categorical keys are coded without hashing, unused codes are dropped later by aggregate
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(dtype=np.int64), values.cat.categories.to_numpy()
+    if pd.api.types.is_integer_dtype(values) and not values.hasnans and len(values) > 0:
+        values = values.to_numpy(dtype=np.int64)
+        low, high = values.min(), values.max()
+        if high - low < max(len(values), 1024):
+            return values - low, np.arange(low, high + 1)
+
+    return pd.factorize(values, sort=True)
+
+
+def aggregate(df: pd.DataFrame, scheme: AgeGroupScheme, by: List[str], age_column: str = 'Idade',
+              value_column: Optional[str] = None) -> Tuple[List[np.ndarray], np.ndarray]:
+    '''
+    Sums value_column (or counts records, when value_column is None) by the columns in by and by age group.
+
+    Returns the sorted unique values of each column in by, and a dense array shaped (len(levels[0]), ...,
+    len(scheme.labels)) with the sums. Records with a missing key or with an age out of the scheme are ignored.
+    '''
+
+    codes = age_group_codes(df[age_column], scheme)
+    keep = codes >= 0
+
+    levels = list()
+    level_codes = list()
+    for column in by:
+        column_codes, uniques = _factorize(df[column])
+        keep &= column_codes >= 0
+        levels.append(np.asarray(uniques))
+        level_codes.append(column_codes)
+
+    shape = tuple(len(level) for level in levels) + (len(scheme.labels),)
+    if 0 in shape:
+        return levels, np.zeros(shape)
+
+    # records out of the scheme or with missing keys are sent to an extra bin, which is discarded
+    size = int(np.prod(shape))
+    flat_index = np.zeros(len(codes), dtype=np.int64)
+    for column_codes, n in zip(level_codes, shape[:-1]):
+        flat_index *= n
+        flat_index += column_codes
+    flat_index *= shape[-1]
+    flat_index += codes
+    flat_index[~keep] = size
+
+    counts = np.bincount(flat_index, minlength=size + 1)[:size].reshape(shape)
+    values = counts
+    if value_column is not None:
+        weights = df[value_column].to_numpy(dtype=float, na_value=0)
+        values = np.bincount(flat_index, weights=weights, minlength=size + 1)[:size].reshape(shape)
+
+    # keys only found in records out of the scheme are dropped from the levels
+    for axis in range(len(levels)):
+        used = counts.sum(axis=tuple(i for i in range(counts.ndim) if i != axis)) > 0
+        if not used.all():
+            levels[axis] = levels[axis][used]
+            counts = counts.compress(used, axis=axis)
+            values = values.compress(used, axis=axis)
+
+    return levels, values
+
+
+def group_ages(df: pd.DataFrame, age_group_csv_path: str, by: List[str], value_column: Optional[str] = None,
+               value_name: Optional[str] = None, age_column: str = 'Idade') -> pd.DataFrame:
+    '''
+    Takes a DataFrame with an age column and returns a long DataFrame with the columns in by, Faixa Etária, as an
+    ordered categorical, and value_name, holding the sum of value_column (or the number of records, when
+    value_column is None) for every combination of the values in by and the age groups of the csv, with 0 where
+    there are no records.
+
+    CSV columns must be separated by semi-colon.
+    '''
+
+    scheme = load_scheme(age_group_csv_path)
+    levels, values = aggregate(df=df, scheme=scheme, by=by, age_column=age_column, value_column=value_column)
+
+    index = pd.MultiIndex.from_product(
+        levels + [pd.CategoricalIndex(scheme.labels, categories=scheme.labels, ordered=True)],
+        names=by + ['Faixa Etária']
+        )
+    value_name = value_name or value_column or 'Contagem'
+
+    return pd.DataFrame({value_name: values.ravel()}, index=index).reset_index()
+
+
+@lru_cache(maxsize=None)
+def _operator(path: str, ages: tuple) -> sparse.csr_matrix:
+    scheme = _load_scheme(path)
+    codes = age_group_codes(pd.Series(ages, dtype=object if any(isinstance(age, str) for age in ages) else None), scheme)
+    columns = np.flatnonzero(codes >= 0)
+
+    return sparse.csr_matrix(
+        (np.ones(len(columns)), (codes[columns], columns)), shape=(len(scheme.labels), len(ages))
+        )
+
+
+def aggregation_operator(scheme: Union[str, AgeGroupScheme], ages: Sequence) -> sparse.csr_matrix:
+    '''
+    Returns the sparse (age group, age) matrix which sums values at the given ages (or age labels) into the age
+    groups of scheme, a scheme name, a csv path or a loaded scheme. Ages out of the scheme have an empty column.
+    Operators are built once per scheme and ages.
+    '''
+
+    path = scheme.path if isinstance(scheme, AgeGroupScheme) else load_scheme(scheme).path
+
+    return _operator(path, tuple(ages))
+
+
+def regroup(df: pd.DataFrame, schemes: Sequence[Union[str, AgeGroupScheme]], by: List[str],
+            value_column: Optional[str] = None, value_name: Optional[str] = None,
+            age_column: str = 'Idade') -> Dict[str, pd.DataFrame]:
+    '''
+    Takes a table at its finest age resolution, e.g. single-year ages, and returns, for each scheme (names, csv
+    paths or loaded schemes), the long DataFrame group_ages would return for it. The table is summed by the columns
+    in by and age once, and every scheme is then a block of a single sparse product.
+
+    Results are keyed by the schemes as given. Sums of integer columns (and counts) are integers. Records with a
+    missing age or key are ignored.
+    '''
+
+    levels, codes = list(), list()
+    for column in by + [age_column]:
+        column_codes, uniques = _factorize(df[column])
+        levels.append(np.asarray(uniques))
+        codes.append(column_codes)
+    keep = np.all([column_codes >= 0 for column_codes in codes], axis=0) if len(df) else np.zeros(0, dtype=bool)
+
+    shape = tuple(len(level) for level in levels)
+    rows = np.zeros(len(df), dtype=np.int64)
+    for column_codes, n in zip(codes[:-1], shape[:-1]):
+        rows = rows * n + column_codes
+    combinations, rows = np.unique(rows[keep], return_inverse=True) # only combinations of keys found in df
+    rows = rows.ravel()
+
+    def matrix(weights):
+        # (combination of keys, age) table, duplicated keys are summed
+        return sparse.csr_matrix((weights[keep], (rows, codes[-1][keep])), shape=(len(combinations), shape[-1]))
+
+    loaded = [scheme if isinstance(scheme, AgeGroupScheme) else load_scheme(scheme) for scheme in schemes]
+    operator = sparse.vstack([aggregation_operator(scheme, levels[-1]) for scheme in loaded]).T.tocsr()
+    counts = (matrix(np.ones(len(df))) @ operator).toarray()
+    values = counts if value_column is None else \
+        (matrix(df[value_column].to_numpy(dtype=float, na_value=0)) @ operator).toarray()
+    if value_column is None or pd.api.types.is_integer_dtype(df[value_column]):
+        values = values.round().astype(np.int64)
+    key_codes = np.unravel_index(combinations, shape[:-1])
+
+    value_name = value_name or value_column or 'Contagem'
+    results, start = dict(), 0
+    for name, scheme in zip(schemes, loaded):
+        block = slice(start, start + len(scheme.labels))
+        start += len(scheme.labels)
+        found = counts[:, block].sum(axis=1) > 0 # combinations with records in the scheme
+
+        # keys only found in records out of the scheme are dropped from the levels, as in aggregate
+        scheme_levels, position = list(), np.zeros(found.sum(), dtype=np.int64)
+        for level, level_codes in zip(levels[:-1], key_codes):
+            used = np.unique(level_codes[found])
+            scheme_levels.append(level[used])
+            position = position * len(used) + np.searchsorted(used, level_codes[found])
+
+        scheme_values = np.zeros((int(np.prod([len(level) for level in scheme_levels])), len(scheme.labels)), dtype=values.dtype)
+        scheme_values[position] = values[found, block]
+
+        index = pd.MultiIndex.from_product(
+            scheme_levels + [pd.CategoricalIndex(scheme.labels, categories=scheme.labels, ordered=True)],
+            names=by + ['Faixa Etária']
+            )
+        key = name.path if isinstance(name, AgeGroupScheme) else name
+        results[key] = pd.DataFrame({value_name: scheme_values.ravel()}, index=index).reset_index()
+
+    return results
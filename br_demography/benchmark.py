@@ -0,0 +1,278 @@
+from . import age_groups, interpolation, migration_matrix, municipality_births, municipality_deaths, \
+    municipality_pop_pyramid, projection, stochastic, synthetic, trend_models
+import numpy as np
+import pandas as pd
+import argparse
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+
+### Times and memory-profiles the processing functions on synthetic data (see synthetic.py) at several sizes.
+### scale multiplies the number of records of every synthetic source, 1.0 being the size of the whole country.
+### Results are appended to BENCHMARK_FILE with the commit they were measured on, so a slower commit shows up in
+### compare_results. Timings only compare on the same machine, so BENCHMARK_FILE is local and not versioned.
+### Run with: python -m br_demography.benchmark --scales 0.01 0.1 --record
+
+BENCHMARK_FILE = os.path.join(os.path.dirname(__file__), 'results', 'benchmarks.csv')
+SOURCE_TAB = os.path.join(os.path.dirname(__file__), 'source', 'tab')
+AGE_GROUPS_2000_2010 = os.path.join(SOURCE_TAB, 'faixas_etarias_censo_2000_2010.csv')
+AGE_GROUPS_2022 = os.path.join(SOURCE_TAB, 'faixas_etarias_censo_2022.csv')
+AGE_GROUPS_MOTHERS = os.path.join(SOURCE_TAB, 'faixas_etarias_maes.csv')
+
+
+def _n_municipalities(scale: float) -> int:
+    return max(2, int(round(synthetic.N_MUNICIPALITIES * min(scale, 1.0))))
+
+
+def _largest_municipality(seed: int) -> int:
+    population = synthetic.municipality_population(synthetic.municipality_ids(seed=seed), seed=seed)
+
+    return int(population.idxmax())
+
+
+# each setup takes scale and seed and returns the function to time, without arguments, and the number of input rows
+
+def _setup_aggregate_deaths(scale: float, seed: int) -> Tuple[Callable, int]:
+    df = synthetic.deaths_microdata(scale=scale, seed=seed)
+    scheme = age_groups.load_scheme(AGE_GROUPS_2000_2010)
+
+    return (lambda: age_groups.aggregate(df, scheme, by=['mun_id', 'Ano', 'Sexo'])), len(df)
+
+
+def _setup_deaths_standard_age_groups(scale: float, seed: int) -> Tuple[Callable, int]:
+    mun_id = _largest_municipality(seed)
+    df = synthetic.deaths_microdata(mun_ids=[mun_id], scale=scale * 100, seed=seed).drop(columns='mun_id')
+
+    return (lambda: municipality_deaths.standard_age_groups(df, AGE_GROUPS_2000_2010)), len(df)
+
+
+def _setup_births_standard_age_groups(scale: float, seed: int) -> Tuple[Callable, int]:
+    mun_id = _largest_municipality(seed)
+    df = synthetic.births_microdata(mun_ids=[mun_id], scale=scale * 100, seed=seed).drop(columns='mun_id')
+
+    return (lambda: municipality_births.standard_age_groups(df, AGE_GROUPS_MOTHERS)), len(df)
+
+
+def _census_pyramid(scale: float, seed: int) -> pd.DataFrame:
+    # same layout as query_total_pop_by_sex_age_2010_batch
+    df = synthetic.census_microdata(2010, scale=scale, seed=seed)
+    df = df.groupby(['mun_id', 'Sexo', 'Idade'], as_index=False)['Peso'].sum()
+    df['Sexo'] = df['Sexo'].map({'1': 'Masculino', '2': 'Feminino'})
+
+    return df
+
+
+def _setup_pyramid_standard_age_groups(scale: float, seed: int) -> Tuple[Callable, int]:
+    df = synthetic.census_microdata(2010, mun_ids=[_largest_municipality(seed)], scale=scale * 100, seed=seed)
+    df['Sexo'] = df['Sexo'].map({'1': 'Masculino', '2': 'Feminino'})
+
+    return (lambda: municipality_pop_pyramid.standard_age_groups(df, AGE_GROUPS_2000_2010, 2010)), len(df)
+
+
+def _setup_pyramid_batch(scale: float, seed: int) -> Tuple[Callable, int]:
+    df_2010 = _census_pyramid(scale, seed)
+    df_2022 = synthetic.census_2022_population(seed=seed)
+
+    def run():
+        dfs = [
+            municipality_pop_pyramid.standard_age_groups_batch(df_2022, AGE_GROUPS_2022, 2022),
+            municipality_pop_pyramid.standard_age_groups_batch(df_2010, AGE_GROUPS_2000_2010, 2010),
+        ]
+        return municipality_pop_pyramid.concatenate_treated_dfs_batch(dfs)
+
+    return run, len(df_2010) + len(df_2022)
+
+
+def _population_table(scale: float, seed: int) -> pd.DataFrame:
+    # municipality x sex x age group table with one column per census, as concatenate_treated_dfs_batch returns
+    rng = np.random.default_rng(seed)
+    mun_ids = synthetic.municipality_ids(seed=seed)[:_n_municipalities(scale)]
+    index = pd.MultiIndex.from_product([mun_ids, projection.SEXES, range(9)], names=['mun_id', 'Sexo', 'Faixa Etária'])
+    base = rng.lognormal(7, 1.5, len(index))
+
+    return pd.DataFrame({
+        2000: (base * rng.uniform(0.7, 1.1, len(index))).astype(np.int64),
+        2010: (base * rng.uniform(0.85, 1.1, len(index))).astype(np.int64),
+        2022: base.astype(np.int64),
+        }, index=index)
+
+
+def _setup_interpolation(scale: float, seed: int) -> Tuple[Callable, int]:
+    df = _population_table(scale, seed)
+
+    return (lambda: interpolation.interpolate_population(df)), len(df)
+
+
+def _setup_projection(scale: float, seed: int) -> Tuple[Callable, int]:
+    rng = np.random.default_rng(seed)
+    n = _n_municipalities(scale)
+    population = rng.lognormal(7, 1.5, (n, 2, 9))
+    survival = 1 - rng.uniform(0.0005, 0.05, (n, 2, 9, 20))
+    fertility = np.zeros((n, 9, 20))
+    fertility[:, 1:5] = rng.uniform(10, 90, (n, 4, 20))
+
+    return (lambda: projection.project_population(population, survival, fertility)), population.size
+
+
+def _setup_trend_models(scale: float, seed: int) -> Tuple[Callable, int]:
+    rng = np.random.default_rng(seed)
+    n = _n_municipalities(scale) * 2 * 9
+    years = np.arange(2000, 2023)
+    rates = rng.uniform(1, 50, (n, 1)) * np.exp(-rng.uniform(0, 0.05, (n, 1)) * (years - 2000)) * \
+        rng.lognormal(0, 0.1, (n, len(years)))
+    df = pd.DataFrame(rates, columns=years)
+
+    return (lambda: trend_models.fit_trend_models(df, models=['Exponencial', 'Linear'])), len(df)
+
+
+def _setup_migration_matrix(scale: float, seed: int) -> Tuple[Callable, int]:
+    df = synthetic.census_microdata(2010, scale=scale, seed=seed)
+    df = df[df['Migrante']]
+    df = df.assign(Destino=df['mun_id'].astype(str), Imigrantes=df['Peso'])
+    df = df.groupby(['Origem', 'Destino', 'Sexo', 'Idade'], dropna=False, as_index=False)[['Peso', 'Imigrantes']].sum()
+
+    def run():
+        matrix = migration_matrix.MigrationMatrix.from_flows(df, 2010, AGE_GROUPS_2000_2010)
+        return matrix.net_migration()
+
+    return run, len(df)
+
+
+def _setup_stochastic(scale: float, seed: int) -> Tuple[Callable, int]:
+    rng = np.random.default_rng(seed)
+    population = _population_table(scale, seed)[2022]
+    years = np.arange(2000, 2020)
+    mortality = pd.DataFrame(rng.uniform(1, 80, (len(population), 1)) * np.exp(-0.02 * (years - 2000)) *
+                             rng.lognormal(0, 0.05, (len(population), len(years))), index=population.index, columns=years)
+    women = population.xs('Feminino', level='Sexo').index
+    births = pd.DataFrame(rng.uniform(0, 90, (len(women), 1)) * rng.lognormal(0, 0.05, (len(women), len(years))),
+                          index=women, columns=years)
+
+    return (lambda: stochastic.stochastic_projection(population, mortality, births, n_draws=100, seed=seed)), len(population)
+
+
+BENCHMARKS: Dict[str, Callable[[float, int], Tuple[Callable, int]]] = {
+    'age_groups.aggregate (national deaths)': _setup_aggregate_deaths,
+    'municipality_deaths.standard_age_groups': _setup_deaths_standard_age_groups,
+    'municipality_births.standard_age_groups': _setup_births_standard_age_groups,
+    'municipality_pop_pyramid.standard_age_groups': _setup_pyramid_standard_age_groups,
+    'municipality_pop_pyramid batch (2010 + 2022)': _setup_pyramid_batch,
+    'interpolation.interpolate_population': _setup_interpolation,
+    'projection.project_population': _setup_projection,
+    'trend_models.fit_trend_models (closed form)': _setup_trend_models,
+    'migration_matrix net migration': _setup_migration_matrix,
+    'stochastic.stochastic_projection (100 draws)': _setup_stochastic,
+}
+
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__), capture_output=True, text=True,
+            timeout=10
+            ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+
+    return {
+        'timestamp': pd.Timestamp.now().isoformat(timespec='seconds'), 'commit': commit,
+        'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+    }
+
+
+def run_benchmarks(scales: Sequence[float] = (0.01, 0.1), names: Optional[Sequence[str]] = None, repeat: int = 3,
+                   seed: int = 0) -> pd.DataFrame:
+    '''
+    Runs the benchmarks in BENCHMARKS (or only those in names) at each scale and returns a DataFrame with the input
+    rows, the number of timed runs (repeat), the best and median wall time in seconds over them and the peak
+    memory in MB traced in one extra run, plus the commit and library versions.
+    '''
+
+    names = list(BENCHMARKS) if names is None else list(names)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {unknown}.")
+
+    environment = _environment()
+    results = list()
+    for name in names:
+        for scale in scales:
+            function, rows = BENCHMARKS[name](scale, seed)
+            times = list()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function()
+                times.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results.append({
+                'benchmark': name, 'scale': scale, 'rows': rows, 'repeat': repeat, 'best': min(times), 'median': float(np.median(times)),
+                'peak_memory_mb': peak / 1024 ** 2, **environment,
+            })
+
+    return pd.DataFrame(results)
+
+
+def record_results(df: pd.DataFrame, path: str = BENCHMARK_FILE) -> None:
+    '''
+    Appends benchmark results to a semicolon separated csv, creating it when needed.
+    '''
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, sep=';', index=False, mode='a', header=not os.path.exists(path))
+
+
+def compare_results(df: pd.DataFrame, path: str = BENCHMARK_FILE, tolerance: float = 1.25,
+                    min_seconds: float = 0.05, min_repeat: int = 3) -> pd.DataFrame:
+    '''
+    Compares results with the last recorded results of another commit for the same benchmark and scale, and
+    returns them with the baseline time, the ratio between both and a regression flag, True when the best time
+    grew more than tolerance times. Timings shorter than min_seconds, or taken over fewer than min_repeat runs, are
+    too noisy to tell and are never flagged.
+    '''
+
+    if not os.path.exists(path):
+        return df.assign(baseline=np.nan, ratio=np.nan, regression=False)
+
+    history = pd.read_csv(path, sep=';', dtype={'commit': str})
+    commits = df['commit'].dropna().unique()
+    history = history[~history['commit'].isin(commits)]
+    baseline = history.groupby(['benchmark', 'scale'])['best'].last().rename('baseline')
+
+    df = df.join(baseline, on=['benchmark', 'scale'])
+    df['ratio'] = df['best'] / df['baseline']
+    df['regression'] = (df['ratio'] > tolerance) & (df['best'] >= min_seconds) & (df['repeat'] >= min_repeat)
+
+    return df
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Benchmarks br_demography processing functions on synthetic data.')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.01, 0.1])
+    parser.add_argument('--names', nargs='+', default=None, help='benchmarks to run, all by default')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=1.25, help='slowdown ratio flagged as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='shortest best time flagged as a regression')
+    parser.add_argument('--record', action='store_true', help=f'append results to {BENCHMARK_FILE}')
+    args = parser.parse_args(argv)
+
+    df = compare_results(
+        run_benchmarks(scales=args.scales, names=args.names, repeat=args.repeat), tolerance=args.tolerance,
+        min_seconds=args.min_seconds
+        )
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(df[['benchmark', 'scale', 'rows', 'repeat', 'best', 'median', 'peak_memory_mb', 'baseline', 'ratio', 'regression']])
+    if args.record:
+        record_results(df.drop(columns=['baseline', 'ratio', 'regression']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+from . import instrumentation, migration_matrix, municipality_pop_pyramid, query_backend, query_cache
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+
+
+### Every aggregate the municipality queries take from the census person microdata, from a single scan per census
+### and any number of municipalities. query_total_population, query_total_pop_by_sex_age_*, query_immigration_*,
+### query_emigration_* and query_household_residents_2010 each scan microdados_pessoa again; here one query groups
+### the people by municipality of residence and previous municipality (each kept only when it is one of the
+### municipalities asked for), sex and age, with the immigrants as a conditional sum, and split_census_aggregates
+### turns the result into the tables those functions return, with a mun_id column.
+
+# people who arrived in the municipality in the five years before the census, as in query_immigration_by_sex_age*
+# and MigrationMatrix.immigration
+IMMIGRANTS = {year: columns['immigrant'] for year, columns in migration_matrix.CENSUS_COLUMNS.items()}
+# tables of split_census_aggregates, household residents only in 2010
+METRICS = ['populacao_total', 'populacao', 'imigracao', 'emigracao', 'moradores']
+
+
+@instrumentation.track
+def query_census_aggregates(year: int, mun_ids: List[int], project_id: str) -> pd.DataFrame:
+    '''
+    Returns a Pandas Dataframe with the sum of sample weights of the census (Peso), and of the immigrants among them
+    (Imigrantes), grouped by municipality of residence (mun_id), previous municipality (Origem), sex and age. mun_id
+    and Origem are None when they are not in mun_ids, so people living elsewhere only appear as emigrants of their
+    previous municipality.
+
+    Requires year, 2000 or 2010, project_id, the Google Cloud project id for billing, and mun_ids, a list of
+    seven-figures municipality ids.
+    '''
+
+    if year not in IMMIGRANTS:
+        raise ValueError(f"year should be one of {list(IMMIGRANTS)}.")
+    municipality_pop_pyramid.check_mun_ids(mun_ids)
+    columns = migration_matrix.CENSUS_COLUMNS[year]
+
+    mun_id_str = ", ".join([f"'{id}'" for id in mun_ids])
+
+    query = f"""
+                SELECT
+                        CASE WHEN id_municipio IN ({mun_id_str}) THEN id_municipio END AS mun_id,
+                        CASE WHEN {columns['origin']} IN ({mun_id_str}) THEN {columns['origin']} END AS Origem,
+                        {columns['sex']} AS Sexo,
+                        {columns['age']} AS Idade,
+                        SUM({columns['weight']}) AS Peso,
+                        SUM(CASE WHEN {IMMIGRANTS[year]} THEN {columns['weight']} ELSE 0 END) AS Imigrantes
+                FROM
+                        {query_backend.table(columns['table'])}
+                WHERE
+                        id_municipio IN ({mun_id_str}) OR {columns['origin']} IN ({mun_id_str})
+                GROUP BY
+                        mun_id, Origem, Sexo, Idade
+                """
+
+    return query_cache.read_sql(query=query, billing_project_id=project_id)
+
+
+def _by_sex_age(df: pd.DataFrame, key: str, value: str) -> pd.DataFrame:
+    # sums of value by municipality in key, sex and age, ordered as the ORDER BY of the municipality queries
+    df = df[df[key].notna()]
+    df = df.groupby([key, 'Sexo', 'Idade'], sort=True, dropna=False)[value].sum().reset_index()
+    df = df.rename(columns={key: 'mun_id', value: 'Peso'})[['mun_id', 'Sexo', 'Idade', 'Peso']]
+    df['mun_id'] = df['mun_id'].astype(np.int64)
+
+    return df
+
+
+def split_census_aggregates(df: pd.DataFrame, year: int) -> Dict[str, pd.DataFrame]:
+    '''
+    Splits the output of query_census_aggregates into one table per metric in METRICS, each with a mun_id column:
+        -> populacao_total, total population (Peso), as query_total_population (2010);
+        -> populacao, population by sex and age, as query_total_pop_by_sex_age_*_batch, sexes named;
+        -> imigracao and emigracao, immigrants and emigrants by sex and age, as query_immigration_by_sex_age* and
+           query_emigration_by_sex_age*, sexes as census codes;
+        -> moradores, household residents (Peso), as query_household_residents_2010, only for 2010.
+    '''
+
+    population = _by_sex_age(df, 'mun_id', 'Peso')
+    totals = population.groupby('mun_id', sort=True)[['Peso']].sum().reset_index()
+    immigrants = _by_sex_age(df, 'mun_id', 'Imigrantes')
+
+    tables = {
+        'populacao_total': totals,
+        'populacao': population.assign(Sexo=population['Sexo'].map({'1': 'Masculino', '2': 'Feminino'})),
+        'imigracao': immigrants[immigrants['Peso'] > 0].reset_index(drop=True)[['mun_id', 'Peso', 'Sexo', 'Idade']],
+        'emigracao': _by_sex_age(df, 'Origem', 'Peso')[['mun_id', 'Peso', 'Sexo', 'Idade']],
+    }
+    if year == 2010:
+        tables['moradores'] = totals.copy() # every person of the microdata lives in a household, as in the 2010 query
+
+    return tables
+
+
+def extract_census(year: int, mun_ids: List[int], project_id: str) -> Dict[str, pd.DataFrame]:
+    '''
+    Returns the tables of split_census_aggregates for the municipalities in mun_ids, from a single scan of the
+    microdata of the census of year, 2000 or 2010.
+    '''
+
+    return split_census_aggregates(query_census_aggregates(year, mun_ids, project_id), year)
+
+
+def municipality_tables(tables: Dict[str, pd.DataFrame], mun_id: int) -> Dict[str, pd.DataFrame]:
+    '''
+    Returns the rows of a municipality in the tables of extract_census, without the mun_id column, in the shape the
+    single municipality query functions return, e.g. municipality_tables(tables, 4106902)['emigracao'] in place of
+    query_emigration_by_sex_age(4106902, project_id).
+    '''
+
+    return {
+        metric: df[df['mun_id'] == int(mun_id)].drop(columns='mun_id').reset_index(drop=True)
+        for metric, df in tables.items()
+        }
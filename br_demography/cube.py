@@ -0,0 +1,274 @@
+from . import projection, result_store
+import numpy as np
+import pandas as pd
+from typing import Optional, Sequence, Union
+
+
+### PopulationCube keeps a population (or deaths, births, rates) table as one dense NumPy array shaped
+### (municipality, sex, age group, year) with its labels, instead of a MultiIndex DataFrame. Selecting contiguous
+### labels returns views of the same array, arithmetic between cubes with the same labels works on the arrays with
+### no index alignment, and conversion from and to the wide tables of the package (mun_id, Sexo and Faixa Etária
+### in the index, years in the columns) or long tables happens once, at the edges.
+
+AXES = ('mun_id', 'Sexo', 'Faixa Etária', 'Ano')
+TOTAL = 'Total' # label of an axis summed over, or absent from the table a cube is built from
+
+
+def _labels(values: pd.Index, axis: str) -> np.ndarray:
+    # sexes in projection.SEXES order, age groups by their first age, others sorted
+    if axis == 'Sexo':
+        order = {sex: i for i, sex in enumerate(projection.SEXES)}
+        return np.array(sorted(values.unique(), key=lambda sex: (order.get(sex, len(order)), str(sex))), dtype=object)
+    if axis == 'Faixa Etária':
+        if isinstance(values.dtype, pd.CategoricalDtype) and values.dtype.ordered:
+            return np.asarray(values.categories[values.categories.isin(values.unique())], dtype=object)
+        return np.asarray(result_store.age_group_dtype(values.astype(str)).categories, dtype=object)
+
+    return np.sort(values.unique().to_numpy())
+
+
+class PopulationCube:
+    '''
+    A table of values by municipality, sex, age group and year, backed by values, a NumPy array shaped
+    (len(mun_ids), len(sexes), len(age_groups), len(years)). Axes are given by position or by their names in AXES,
+    e.g. cube.sum('Sexo'), and selected by label with sel, e.g. cube.sel(mun_ids=[4106902]).
+    '''
+
+    def __init__(self, values: np.ndarray, mun_ids: Sequence, sexes: Sequence[str], age_groups: Sequence[str],
+                 years: Sequence[int]):
+        self.values = np.asarray(values)
+        self.mun_ids = np.asarray(mun_ids)
+        self.sexes = np.asarray(sexes, dtype=object)
+        self.age_groups = np.asarray(age_groups, dtype=object)
+        self.years = np.asarray(years)
+
+        shape = (len(self.mun_ids), len(self.sexes), len(self.age_groups), len(self.years))
+        if self.values.shape != shape:
+            raise ValueError(f"values are shaped {self.values.shape}, labels are shaped {shape}.")
+
+    @property
+    def labels(self) -> tuple:
+        return (self.mun_ids, self.sexes, self.age_groups, self.years)
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    def __repr__(self) -> str:
+        return (f"PopulationCube({len(self.mun_ids)} municipalities, sexes {self.sexes.tolist()}, "
+                f"{len(self.age_groups)} age groups, years {self.years.tolist()})")
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
+    def _replace(self, values: np.ndarray, **labels) -> 'PopulationCube':
+        # a cube with other values and, for the axes given, other labels, sharing the rest
+        current = dict(zip(['mun_ids', 'sexes', 'age_groups', 'years'], self.labels))
+        current.update(labels)
+
+        return PopulationCube(values, **current)
+
+    @staticmethod
+    def _axis(axis: Union[int, str]) -> int:
+        if isinstance(axis, str):
+            if axis not in AXES:
+                raise ValueError(f"axis should be one of {AXES}.")
+            return AXES.index(axis)
+
+        return axis
+
+    # conversion
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, value_column: Optional[str] = None) -> 'PopulationCube':
+        '''
+        Builds a cube from a wide table, indexed by mun_id (or Município), Sexo and Faixa Etária with one column
+        per year, or, when value_column is given, from a long table with those columns (or index levels), Ano and
+        value_column. Axes missing from the table have the single label Total. Combinations missing from the table
+        receive 0, repeated ones are summed.
+        '''
+
+        df = df.rename(columns={'Município': 'mun_id'}).rename_axis(index={'Município': 'mun_id'})
+        if value_column is None:
+            keys, values, axes = df.index.to_frame(index=False), df.to_numpy(dtype=float), AXES[:3]
+        else:
+            df = df.reset_index() if any(name is not None for name in df.index.names) else df
+            keys, values, axes = df, df[[value_column]].to_numpy(dtype=float), AXES
+
+        labels, codes = list(), list()
+        for axis in axes:
+            if axis not in keys.columns:
+                labels.append(np.array([TOTAL], dtype=object))
+                codes.append(np.zeros(len(keys), dtype=np.int64))
+                continue
+            level = pd.Index(keys[axis])
+            labels.append(_labels(level, axis))
+            codes.append(pd.Index(labels[-1]).get_indexer(np.asarray(level, dtype=object)))
+        if value_column is None:
+            labels.append(np.asarray(df.columns))
+
+        shape = tuple(len(level) for level in labels)
+        found = np.all([code >= 0 for code in codes], axis=0)
+        rows = np.ravel_multi_index(tuple(code[found] for code in codes), shape[:len(codes)])
+        cube = np.zeros((int(np.prod(shape[:len(codes)])), values.shape[1]))
+        if len(np.unique(rows)) == len(rows):
+            cube[rows] = values[found]
+        else:
+            np.add.at(cube, rows, values[found])
+
+        return cls(cube.reshape(shape), *labels)
+
+    @classmethod
+    def from_projection(cls, result: np.ndarray, mun_ids: Sequence, age_groups: Sequence, base_year: int = 2022,
+                        step: int = 10, sexes: Sequence[str] = projection.SEXES) -> 'PopulationCube':
+        '''
+        Wraps the array returned by projection.project_population, without copying it.
+        '''
+
+        return cls(result, mun_ids, sexes, age_groups, base_year + step * np.arange(result.shape[-1]))
+
+    def _index(self, axes: Sequence[str]) -> pd.MultiIndex:
+        levels = list()
+        for axis in axes:
+            labels = self.labels[AXES.index(axis)]
+            if axis == 'Faixa Etária':
+                labels = pd.CategoricalIndex(labels, categories=labels, ordered=True)
+            levels.append(labels)
+
+        return pd.MultiIndex.from_product(levels, names=list(axes))
+
+    def to_frame(self) -> pd.DataFrame:
+        '''
+        Returns the wide table, indexed by mun_id, Sexo and Faixa Etária (ordered categorical), one column per year.
+        '''
+
+        values = self.values.reshape(-1, len(self.years))
+
+        return pd.DataFrame(values, index=self._index(AXES[:3]), columns=list(self.years))
+
+    def to_long(self, value_name: str = 'População') -> pd.DataFrame:
+        '''
+        Returns the long table, with columns mun_id, Sexo, Faixa Etária, Ano and value_name.
+        '''
+
+        return pd.DataFrame({value_name: self.values.ravel()}, index=self._index(AXES)).reset_index()
+
+    # selection
+
+    def isel(self, mun_ids=None, sexes=None, age_groups=None, years=None) -> 'PopulationCube':
+        '''
+        Selects by position on each axis, with an int, a slice or a list of positions. Ints, slices and lists of
+        contiguous positions return a view of values, other lists a copy. Axes keep their dimension.
+        '''
+
+        keys = [mun_ids, sexes, age_groups, years]
+        values, labels = self.values, list(self.labels)
+        for axis, key in enumerate(keys):
+            if key is None:
+                continue
+            if not isinstance(key, slice):
+                key = np.atleast_1d(np.asarray(key, dtype=np.int64))
+                key = np.where(key < 0, key + values.shape[axis], key) # negative positions count from the end
+                if np.any((key < 0) | (key >= values.shape[axis])):
+                    raise ValueError(f"Positions out of the {values.shape[axis]} labels of {AXES[axis]}.")
+                # an int and contiguous positions are taken as a slice, so the result is still a view
+                if len(key) and np.array_equal(key, np.arange(key[0], key[0] + len(key))):
+                    key = slice(int(key[0]), int(key[0]) + len(key))
+            values = values[(slice(None),) * axis + (key,)]
+            labels[axis] = labels[axis][key]
+
+        return PopulationCube(values, *labels)
+
+    def sel(self, mun_ids=None, sexes=None, age_groups=None, years=None) -> 'PopulationCube':
+        '''
+        Selects by label on each axis, with a label or a list of labels, e.g. cube.sel(sexes='Feminino',
+        years=[2022, 2032]). Labels next to each other return a view, see isel.
+        '''
+
+        keys = [mun_ids, sexes, age_groups, years]
+        positions = dict()
+        for axis, key in enumerate(keys):
+            if key is None:
+                continue
+            wanted = [key] if np.ndim(key) == 0 else list(key)
+            indices = pd.Index(self.labels[axis]).get_indexer(wanted)
+            if np.any(indices < 0):
+                raise ValueError(f"Labels {[label for label, i in zip(wanted, indices) if i < 0]} not in {AXES[axis]}.")
+            positions[axis] = indices
+
+        return self.isel(*[positions.get(axis) for axis in range(len(AXES))])
+
+    def __getitem__(self, key) -> 'PopulationCube':
+        key = key if isinstance(key, tuple) else (key,)
+
+        return self.isel(*key)
+
+    # arithmetic
+
+    def sum(self, axis: Union[int, str]) -> 'PopulationCube':
+        '''
+        Sums over an axis, which keeps a single label, Total, so the result broadcasts against the cube. Only Total
+        broadcasts: cubes with any other different labels on an axis cannot be combined.
+        '''
+
+        axis = self._axis(axis)
+        labels = list(self.labels)
+        labels[axis] = np.array([TOTAL], dtype=object)
+
+        return PopulationCube(self.values.sum(axis=axis, keepdims=True), *labels)
+
+    def _operand(self, other):
+        if not isinstance(other, PopulationCube):
+            return other, self.labels
+
+        labels = list()
+        for axis, (mine, theirs) in enumerate(zip(self.labels, other.labels)):
+            if mine is theirs or (len(mine) == len(theirs) and np.array_equal(mine, theirs)):
+                labels.append(mine)
+            elif len(theirs) == 1 and theirs[0] == TOTAL:
+                labels.append(mine) # a sum over the axis broadcasts against every label
+            elif len(mine) == 1 and mine[0] == TOTAL:
+                labels.append(theirs)
+            else:
+                raise ValueError(f"Cubes have different labels on {AXES[axis]}, select the same labels first.")
+
+        return other.values, labels
+
+    def _apply(self, other, operation) -> 'PopulationCube':
+        values, labels = self._operand(other)
+
+        return PopulationCube(operation(self.values, values), *labels)
+
+    def __add__(self, other):
+        return self._apply(other, np.add)
+
+    def __radd__(self, other):
+        return self._apply(other, lambda a, b: np.add(b, a))
+
+    def __sub__(self, other):
+        return self._apply(other, np.subtract)
+
+    def __rsub__(self, other):
+        return self._apply(other, lambda a, b: np.subtract(b, a))
+
+    def __mul__(self, other):
+        return self._apply(other, np.multiply)
+
+    def __rmul__(self, other):
+        return self._apply(other, lambda a, b: np.multiply(b, a))
+
+    def __truediv__(self, other):
+        def divide(a, b):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.divide(a, b)
+
+        return self._apply(other, divide)
+
+    def __neg__(self):
+        return self._replace(-self.values)
+
+    def round(self, decimals: int = 0) -> 'PopulationCube':
+        return self._replace(np.round(self.values, decimals))
+
+    def astype(self, dtype) -> 'PopulationCube':
+        return self._replace(self.values.astype(dtype))
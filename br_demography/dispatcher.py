@@ -0,0 +1,128 @@
+import pandas as pd
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+
+### Runs many independent query functions (e.g. immigration and emigration for 2000 and 2010, pyramids for three
+### censuses, for every municipality of a region) concurrently on a thread pool. Queries spend their time waiting
+### for BigQuery, so threads are enough, and the wall time of a run is set by the slowest queries instead of the sum
+### of all of them. Each call is retried with exponential backoff, and results are returned in the order of the tasks,
+### keyed by (function name, mun_id, year).
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class QueryTask(NamedTuple):
+    function: Callable[..., pd.DataFrame]
+    mun_id: Hashable
+    year: Optional[int]
+    kwargs: dict
+
+    @property
+    def key(self) -> Tuple[str, Hashable, Optional[int]]:
+        return (self.function.__name__, self.mun_id, self.year)
+
+
+class DispatchError(RuntimeError):
+    '''
+    Raised by dispatch when some tasks still fail after every retry. errors maps the key of each failed task to its
+    last exception and results holds the tasks which succeeded.
+    '''
+
+    def __init__(self, errors: Dict[tuple, BaseException], results: Dict[tuple, pd.DataFrame]):
+        self.errors = errors
+        self.results = results
+        keys = ', '.join(str(key) for key in list(errors)[:5])
+        super().__init__(f"{len(errors)} of {len(errors) + len(results)} tasks failed: {keys}")
+
+
+def _year_from_name(function: Callable) -> Optional[int]:
+    # census query functions carry their year in the name, e.g. query_total_pop_by_sex_age_2010
+    match = re.search(r'_(\d{4})(?:_batch)?$', function.__name__)
+
+    return int(match.group(1)) if match else None
+
+
+def task(function: Callable[..., pd.DataFrame], mun_id: Hashable, year: Optional[int] = None, **kwargs) -> QueryTask:
+    '''
+    Returns a task calling function(mun_id=mun_id, **kwargs), e.g. task(mm.query_immigration_by_sex_age_2000,
+    mun_id=4106902, project_id=project_id). When year is not given, it is read from the end of the function name.
+    Pass mun_id=None for functions which take no mun_id.
+    '''
+
+    if year is None:
+        year = _year_from_name(function)
+
+    return QueryTask(function=function, mun_id=mun_id, year=year, kwargs=kwargs)
+
+
+def expand_tasks(functions: Iterable[Callable[..., pd.DataFrame]], mun_ids: Iterable[Hashable], **kwargs) -> List[QueryTask]:
+    '''
+    Returns a task for every function and municipality, with the same keyword arguments (e.g. project_id).
+    '''
+
+    mun_ids = list(mun_ids)
+
+    return [task(function, mun_id, **kwargs) for function in functions for mun_id in mun_ids]
+
+
+def _run(task: QueryTask, retries: int, backoff: float, max_backoff: float, retry_on: Tuple[type, ...]) -> pd.DataFrame:
+    kwargs = dict(task.kwargs)
+    if task.mun_id is not None:
+        kwargs['mun_id'] = task.mun_id
+
+    for attempt in range(retries + 1):
+        try:
+            result = task.function(**kwargs)
+            if result is None:
+                raise RuntimeError(f"{task.function.__name__} returned None for mun_id {task.mun_id}.")
+            return result
+        except retry_on:
+            if attempt == retries:
+                raise
+            delay = min(backoff * 2 ** attempt, max_backoff)
+            time.sleep(delay + random.uniform(0, delay / 2))
+
+
+def dispatch(tasks: Iterable[QueryTask], max_workers: int = DEFAULT_MAX_WORKERS, retries: int = 3,
+             backoff: float = 1.0, max_backoff: float = 30.0, retry_on: Tuple[type, ...] = (Exception,),
+             raise_errors: bool = True) -> Dict[tuple, pd.DataFrame]:
+    '''
+    Runs the tasks concurrently and returns a dict mapping the key of each task, (function name, mun_id, year), to
+    its result, in the order of the tasks.
+
+    Requires:
+        -> tasks, built with task or expand_tasks;
+        -> max_workers, the maximum number of queries running at the same time;
+        -> retries, how many times a failed call is repeated, a None result counts as a failure;
+        -> backoff and max_backoff, in seconds, the wait before retry n is backoff * 2 ** n (at most max_backoff),
+           plus a random jitter of up to half of it;
+        -> retry_on, the exception types which are retried, others fail the task at once;
+        -> raise_errors, if True, DispatchError is raised when any task fails, otherwise failed tasks map to None.
+    '''
+
+    tasks = list(tasks)
+    keys = [task.key for task in tasks]
+    if len(set(keys)) != len(keys):
+        raise ValueError("Tasks should have distinct (function, mun_id, year) keys.")
+    if max_workers < 1:
+        raise ValueError("max_workers should be at least 1.")
+
+    results = dict()
+    errors = dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_run, task, retries, backoff, max_backoff, retry_on) for task in tasks]
+        for key, future in zip(keys, futures):
+            try:
+                results[key] = future.result()
+            except Exception as error:
+                errors[key] = error
+                results[key] = None
+
+    if errors and raise_errors:
+        raise DispatchError(errors, {key: df for key, df in results.items() if key not in errors})
+
+    return results
@@ -0,0 +1,210 @@
+import pandas as pd
+import hashlib
+import os
+import threading
+import unicodedata
+from functools import lru_cache
+from typing import Optional, Sequence
+
+
+### Municipal boundaries for mapping. A shapefile is read with geopandas only once: build_geometry_cache converts
+### it to GeoParquet under GEOMETRY_DIR, indexed by the seven-figures IBGE municipality id (mun_id) used by every
+### other module, with the geometries already simplified at each of TOLERANCES stored as extra geometry columns.
+### load_geometries then reads just the column of the tolerance asked for, and join_geometries attaches it to any
+### result table by mun_id, so a choropleth is a join and a plot. Caches are named after the content of the
+### shapefile, so editing it rebuilds the cache. Requires geopandas.
+
+GEOMETRY_DIR = os.getenv('BR_DEMOGRAPHY_GEOMETRY_DIR', os.path.join(os.path.dirname(__file__), 'results', 'geometry'))
+SOURCE_TAB = os.path.join(os.path.dirname(__file__), 'source', 'tab')
+TOLERANCES = (100, 500, 2000) # in meters, 0 stands for the original geometries
+METRIC_CRS = 'EPSG:5880' # SIRGAS 2000 / Brazil Polyconic, for simplifying geometries in geographic coordinates
+
+# boundary shapefiles that can be given by name, see register_layer
+LAYERS = {
+    'rmc': os.path.join(os.path.dirname(__file__), 'source', 'shp', 'pdui', 'limites_municipais.shp'),
+}
+# attribute columns holding the municipality id in IBGE and PDUI shapefiles
+CODE_COLUMNS = ['geocodigo', 'CD_MUN', 'CD_GEOCMU', 'cd_mun', 'code_muni', 'id_municipio']
+NAME_COLUMNS = ['nome', 'NM_MUN', 'NM_MUNICIP', 'name_muni']
+
+_lock = threading.Lock()
+_loaded = dict()
+
+
+def register_layer(name: str, shapefile_path: str) -> None:
+    '''
+    Registers a boundary shapefile under name, so it can be passed by name to the functions of this module, e.g.
+    register_layer('brasil', 'BR_Municipios_2022.shp').
+    '''
+
+    if not os.path.isfile(shapefile_path):
+        raise ValueError(f"{shapefile_path} is not a file.")
+    LAYERS[name] = shapefile_path
+
+
+def _layer_path(layer: str) -> str:
+    return os.path.abspath(LAYERS.get(layer, layer))
+
+
+@lru_cache(maxsize=None)
+def _digest(shapefile_path: str, modified: tuple) -> str:
+    # geometries and attributes, the two files a cache depends on, hashed again only when they are modified
+    digest = hashlib.sha256()
+    for path in [shapefile_path, os.path.splitext(shapefile_path)[0] + '.dbf']:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+
+    return digest.hexdigest()[:16]
+
+
+def cache_path(layer: str, root: Optional[str] = None) -> str:
+    '''
+    Returns the GeoParquet file caching a layer, a name in LAYERS or a shapefile path.
+    '''
+
+    path = _layer_path(layer)
+    name = os.path.splitext(os.path.basename(path))[0]
+    modified = tuple(os.stat(file).st_mtime_ns for file in [path, os.path.splitext(path)[0] + '.dbf'])
+
+    return os.path.join(root or GEOMETRY_DIR, f'{name}-{_digest(path, modified)}.parquet')
+
+
+def _normalize(names: pd.Series) -> pd.Series:
+    # names compared without accents, case and surrounding spaces
+    return names.astype(str).map(
+        lambda name: unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().strip().lower()
+        )
+
+
+def _mun_ids(gdf, code_column: Optional[str], municipalities: str) -> pd.Series:
+    code_column = code_column or next((column for column in CODE_COLUMNS if column in gdf.columns), None)
+    if code_column is not None:
+        return pd.to_numeric(gdf[code_column], errors='coerce').astype('Int64')
+
+    # shapefiles without codes are matched by name against a municipality csv such as cod_mun.csv
+    name_column = next((column for column in NAME_COLUMNS if column in gdf.columns), None)
+    if name_column is None:
+        raise ValueError(f"The shapefile has none of the code columns {CODE_COLUMNS} nor of the name columns "
+                         f"{NAME_COLUMNS}. Pass code_column.")
+    codes = pd.read_csv(municipalities, sep=';', encoding='utf-8-sig')
+    codes = pd.Series(codes['mun_id'].to_numpy(), index=_normalize(codes.iloc[:, 1]))
+
+    return _normalize(gdf[name_column]).map(codes).astype('Int64')
+
+
+def build_geometry_cache(layer: str = 'rmc', tolerances: Sequence[float] = TOLERANCES,
+                         code_column: Optional[str] = None, root: Optional[str] = None,
+                         municipalities: str = os.path.join(SOURCE_TAB, 'cod_mun.csv')) -> str:
+    '''
+    Reads a boundary shapefile and writes it as GeoParquet indexed by mun_id, with the municipality name (nome),
+    the original geometries and one column of simplified geometries per tolerance, named geometry_<tolerance>.
+    Returns the path written.
+
+    Requires:
+        -> layer, a name in LAYERS or a shapefile path;
+        -> tolerances, in meters, the maximum distance between a simplified boundary and the original one;
+        -> code_column, the column with the municipality ids, looked for in CODE_COLUMNS by default. When the
+           shapefile has no code column, municipalities are matched by name against the municipalities csv;
+        -> root, the cache directory, GEOMETRY_DIR by default.
+    '''
+
+    import geopandas as gpd
+
+    path = _layer_path(layer)
+    gdf = gpd.read_file(path)
+
+    mun_ids = _mun_ids(gdf, code_column, municipalities)
+    if mun_ids.isna().any():
+        raise ValueError(f"Municipalities without id in {path}: {list(gdf.index[mun_ids.isna()])}.")
+    if mun_ids.duplicated().any():
+        raise ValueError(f"Duplicated municipality ids in {path}: {sorted(mun_ids[mun_ids.duplicated()].unique())}.")
+
+    name_column = next((column for column in NAME_COLUMNS if column in gdf.columns), None)
+    result = gpd.GeoDataFrame(
+        {'nome': gdf[name_column].to_numpy() if name_column else None},
+        geometry=gdf.geometry.to_numpy(), crs=gdf.crs, index=pd.Index(mun_ids.astype('int64').to_numpy(), name='mun_id')
+        )
+
+    # tolerances are in meters, so geographic coordinates are simplified in a metric projection
+    metric = result.geometry if result.crs is None or result.crs.is_projected else result.geometry.to_crs(METRIC_CRS)
+    for tolerance in tolerances:
+        if tolerance <= 0:
+            continue
+        simplified = metric.simplify(tolerance, preserve_topology=True)
+        result[f'geometry_{tolerance:g}'] = simplified if simplified.crs == result.crs else simplified.to_crs(result.crs)
+
+    result = result.sort_index()
+    target = cache_path(layer, root)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = target + '.tmp'
+    result.to_parquet(tmp_path, index=True)
+    os.replace(tmp_path, target)
+
+    return target
+
+
+def load_geometries(layer: str = 'rmc', tolerance: float = 0, mun_ids: Optional[Sequence] = None,
+                    root: Optional[str] = None):
+    '''
+    Returns a GeoDataFrame indexed by mun_id with the municipality name and its boundary simplified at tolerance
+    (0 for the original), building the cache on first use. Only the geometry column asked for is read.
+
+    Requires layer, a name in LAYERS or a shapefile path, accepts tolerance, one of 0 and TOLERANCES, and mun_ids,
+    to keep only some municipalities.
+    '''
+
+    import geopandas as gpd
+
+    column = 'geometry' if tolerance <= 0 else f'geometry_{tolerance:g}'
+    path = cache_path(layer, root)
+    with _lock:
+        if not os.path.isfile(path):
+            build_geometry_cache(layer, root=root)
+        key = (path, column)
+        if key not in _loaded:
+            import pyarrow.parquet as pq
+
+            names = pq.read_schema(path).names
+            if column not in names:
+                raise ValueError(f"No geometries simplified at {tolerance} in {path}. Tolerances are "
+                                 f"{', '.join(['0'] + [name.split('_', 1)[1] for name in names if name.startswith('geometry_')])}.")
+            gdf = gpd.read_parquet(path, columns=['nome', column]) # mun_id comes back as the index
+            _loaded[key] = gdf.set_geometry(column).rename_geometry('geometry') if column != 'geometry' else gdf
+        gdf = _loaded[key]
+
+    if mun_ids is not None:
+        gdf = gdf[gdf.index.isin([int(mun_id) for mun_id in mun_ids])]
+
+    return gdf.copy()
+
+
+def join_geometries(df: pd.DataFrame, layer: str = 'rmc', tolerance: float = 0, on: str = 'mun_id',
+                    how: str = 'inner', root: Optional[str] = None):
+    '''
+    Takes a result table with the municipality id in column or index level on and returns it as a GeoDataFrame,
+    one boundary per row, ready for plotting, e.g. join_geometries(df, tolerance=500).plot(column=2042).
+
+    how is 'inner', to keep the municipalities found in both, or 'left', to keep every row of df.
+    '''
+
+    import geopandas as gpd
+
+    if how not in ['inner', 'left']:
+        raise ValueError("how should be 'inner' or 'left'.")
+    if on not in df.columns:
+        if on not in df.index.names:
+            raise ValueError(f"{on} is neither a column nor an index level of df.")
+        df = df.reset_index()
+
+    gdf = load_geometries(layer, tolerance, root=root)
+    codes = pd.to_numeric(df[on], errors='coerce')
+    positions = gdf.index.get_indexer(codes)
+    if how == 'inner':
+        df, positions = df[positions >= 0], positions[positions >= 0]
+
+    geometry = gdf.geometry.to_numpy()[positions]
+    if how == 'left':
+        geometry[positions < 0] = None
+
+    return gpd.GeoDataFrame(df.reset_index(drop=True), geometry=geometry, crs=gdf.crs)
@@ -0,0 +1,128 @@
+from . import trend_models
+import numpy as np
+import pandas as pd
+import os
+from typing import Optional, Sequence
+
+
+### Household size (residents per occupied permanent private household, MDPPO) projection for every municipality
+### at once. It replaces the per municipality np.polyfit loop of
+### notebooks/pdui/6_Regressao_demanda_terra_urbana_pdui.ipynb: the AVG MDPPO series of moradores_dppo.csv are
+### fitted with trend_models, projected to any year and divided into projected population to get DPPO.
+
+HOUSEHOLD_CSV = os.path.join(os.path.dirname(__file__), 'source', 'tab', 'moradores_dppo.csv')
+MIN_HOUSEHOLD_SIZE = 1.0 # a household has at least one resident, projections are floored here
+
+
+def load_household_table(path: str = HOUSEHOLD_CSV) -> pd.DataFrame:
+    '''
+    Reads moradores_dppo.csv, indexed by cod_mun. The 2000 columns, written 'AVG MPPO 2000' and 'MPPO 2000' in the
+    csv, are renamed to 'AVG MDPPO 2000' and 'MDPPO 2000' as in the other years.
+    '''
+
+    df = pd.read_csv(path, sep=';', decimal=',', encoding='utf-8-sig', index_col='cod_mun')
+
+    return df.rename(columns=lambda column: column.replace('MPPO', 'MDPPO') if 'MDPPO' not in column else column)
+
+
+def household_size_series(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Takes the table returned by load_household_table and returns the AVG MDPPO columns with integer years as column
+    names.
+    '''
+
+    columns = [column for column in df.columns if column.startswith('AVG MDPPO ')]
+    series = df[columns].astype(float)
+    series.columns = [int(column[-4:]) for column in columns]
+
+    return series.sort_index(axis=1)
+
+
+def fit_household_size(series: pd.DataFrame, models: Sequence[str] = ('Linear', 'Exponencial'),
+                       criterion: str = 'rmse') -> pd.DataFrame:
+    '''
+    Fits household size trend models to every municipality and returns the parameter table of
+    trend_models.fit_trend_models, selected by criterion, plus R2, the coefficient of determination of the selected
+    model as reported in the notebook. With models=('Linear',) the projections are those of the notebook.
+    '''
+
+    params = trend_models.fit_trend_models(series, models=models, criterion=criterion)
+
+    fitted = trend_models.project_rates(params, series.columns).to_numpy()
+    observed = series.to_numpy(dtype=float)
+    valid = np.isfinite(observed) & (observed > 0)
+    mean = np.nanmean(np.where(valid, observed, np.nan), axis=1, keepdims=True)
+    ss_res = np.where(valid, (observed - fitted) ** 2, 0).sum(axis=1)
+    ss_tot = np.where(valid, (observed - mean) ** 2, 0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        params['R2'] = 1 - ss_res / ss_tot
+
+    return params
+
+
+def project_household_size(params: pd.DataFrame, years: Sequence[int],
+                           min_household_size: float = MIN_HOUSEHOLD_SIZE) -> pd.DataFrame:
+    '''
+    Takes the DataFrame returned by fit_household_size and returns the projected AVG MDPPO of every municipality,
+    with one column per year, floored at min_household_size.
+    '''
+
+    return trend_models.project_rates(params, years).clip(lower=min_household_size)
+
+
+def population_by_municipality(population: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Returns total population by municipality with one column per year. Accepts a table already in that layout or the
+    long output of projection.projection_to_frame (columns Município, Ano and População), which is summed over sex
+    and age group.
+    '''
+
+    if {'Município', 'Ano', 'População'}.issubset(population.columns):
+        return population.pivot_table(index='Município', columns='Ano', values='População', aggfunc='sum')
+
+    return population
+
+
+def project_households(population: pd.DataFrame, household_size: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Returns projected DPPO, the number of occupied permanent private households, as population divided by AVG MDPPO
+    and truncated to integers, as in the notebook, for the municipalities and years found in both tables.
+    '''
+
+    population = population_by_municipality(population).rename(columns=int)
+    years = household_size.columns.intersection(population.columns)
+    mun_ids = household_size.index.intersection(population.index)
+
+    households = population.loc[mun_ids, years] / household_size.loc[mun_ids, years]
+
+    return households.fillna(0).astype(np.int64)
+
+
+def household_projection(population: Optional[pd.DataFrame], years: Sequence[int], path: str = HOUSEHOLD_CSV,
+                         models: Sequence[str] = ('Linear', 'Exponencial'), criterion: str = 'rmse') -> pd.DataFrame:
+    '''
+    Runs the whole household projection for every municipality in moradores_dppo.csv.
+
+    Requires:
+        -> population, projected population by municipality (see population_by_municipality), or None to project
+           household size only;
+        -> years, the years to project;
+        -> path, the household csv;
+        -> models and criterion, as in fit_household_size.
+
+    Returns a DataFrame indexed by cod_mun with mun, Tipo de Modelo, R2 and, for each year, 'AVG MDPPO <year>' and,
+    when population is given, 'DPPO <year>', as in projecao_domicilios_2032.csv.
+    '''
+
+    df = load_household_table(path)
+    params = fit_household_size(household_size_series(df), models=models, criterion=criterion)
+    household_size = project_household_size(params, years)
+
+    result = df[['mun']].join(params[['Tipo de Modelo', 'R2']])
+    result = result.join(household_size.round(2).rename(columns=lambda year: f'AVG MDPPO {year}'))
+    if population is not None:
+        households = project_households(population, household_size.round(2))
+        households = households.rename(columns=lambda year: f'DPPO {year}')
+        result = result.join(households).astype({column: 'Int64' for column in households.columns})
+
+    return result
@@ -0,0 +1,278 @@
+from . import instrumentation, query_backend, query_cache, result_store
+import numpy as np
+import pandas as pd
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence
+
+
+### Incremental refresh of the SIM (deaths) and SINASC (births) series. Instead of downloading the whole
+### start_year..end_year range again every year, counts by municipality, year, sex and age are kept locally in
+### series_dir()/<source>.parquet, a directory per query backend under the result store, and watermarks.json
+### records, for each source and municipality, the first and last years loaded. refresh_series then fetches only
+### the years after the watermark, plus the last REVISION_YEARS years already loaded, which DATASUS publishes as
+### preliminary and revises, and merges them into the series.
+
+REVISION_YEARS = 2
+
+# table, columns kept besides municipality and year, record filter and name of the counts, by data source
+SOURCES = {
+    'br_ms_sim': {
+        'table': 'br_ms_sim.microdados', 'columns': {'sexo': 'Sexo', 'idade': 'Idade'}, 'where': "tipo_obito = '2'",
+        'value_name': 'Óbitos',
+    },
+    'br_ms_sinasc': {
+        'table': 'br_ms_sinasc.microdados', 'columns': {'idade_mae': 'Idade'}, 'where': None,
+        'value_name': 'Nascimentos',
+    },
+}
+
+_lock = threading.Lock()
+
+
+def _source(source: str) -> dict:
+    if source not in SOURCES:
+        raise ValueError(f"source should be one of {list(SOURCES)}.")
+
+    return SOURCES[source]
+
+
+def series_dir(store_root: Optional[str] = None) -> str:
+    '''
+    Returns the directory of the series of the active backend in a result store (result_store.STORE_DIR by
+    default), one per backend identity, so series loaded from local extracts are never taken for BigQuery data.
+    BR_DEMOGRAPHY_SERIES_DIR, when set, is used instead.
+    '''
+
+    if os.getenv('BR_DEMOGRAPHY_SERIES_DIR'):
+        return os.getenv('BR_DEMOGRAPHY_SERIES_DIR')
+    backend = hashlib.sha256(query_backend.identity().encode('utf-8')).hexdigest()[:12]
+
+    return os.path.join(store_root or result_store.STORE_DIR, 'series', backend)
+
+
+def _series_path(source: str, root: Optional[str]) -> str:
+    return os.path.join(root or series_dir(), f'{source}.parquet')
+
+
+def _watermarks_path(root: Optional[str]) -> str:
+    return os.path.join(root or series_dir(), 'watermarks.json')
+
+
+def load_watermarks(root: Optional[str] = None) -> Dict[str, Dict[str, dict]]:
+    '''
+    Returns the watermarks, a dict by source of dicts by municipality id with the first_year and last_year loaded.
+    '''
+
+    try:
+        with open(_watermarks_path(root), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return dict()
+
+
+def _save_watermarks(watermarks: dict, root: Optional[str]) -> None:
+    os.makedirs(root or series_dir(), exist_ok=True)
+    tmp_path = _watermarks_path(root) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(watermarks, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, _watermarks_path(root))
+
+
+def _load_series(source: str, root: Optional[str]) -> Optional[pd.DataFrame]:
+    try:
+        return pd.read_parquet(_series_path(source, root))
+    except FileNotFoundError:
+        return None
+
+
+def _save_series(df: pd.DataFrame, source: str, root: Optional[str]) -> None:
+    os.makedirs(root or series_dir(), exist_ok=True)
+    tmp_path = _series_path(source, root) + '.tmp'
+    df.to_parquet(tmp_path, index=False, engine='pyarrow')
+    os.replace(tmp_path, _series_path(source, root))
+
+
+@instrumentation.track
+def query_series(source: str, mun_ids: List[str], project_id: str, start_year: int,
+                 end_year: Optional[int] = None, use_cache: bool = True) -> pd.DataFrame:
+    '''
+    Returns a Pandas DataFrame with the records of a source counted by mun_id, Ano, Sexo (deaths only) and Idade,
+    records without age included, for the years from start_year to end_year (the last year published by default).
+
+    Requires:
+        -> source, 'br_ms_sim' for deaths or 'br_ms_sinasc' for births;
+        -> mun_ids, the seven-figures municipality ids, as strings;
+        -> project_id, the Google Cloud project id for billing;
+        -> start_year and end_year, the first and last years of the series;
+        -> use_cache, False to query the backend even when query_cache holds the result.
+    '''
+
+    settings = _source(source)
+    mun_id_str = ", ".join([f"'{id}'" for id in mun_ids])
+    years = f"ano >= {start_year}" if end_year is None else f"ano BETWEEN {start_year} AND {end_year}"
+    where = f"\n                AND\n                ({settings['where']})" if settings['where'] else ""
+    columns = ",\n                ".join(f"{column} as {alias}" for column, alias in settings['columns'].items())
+    group_by = ", ".join(settings['columns'])
+
+    query = f"""
+            SELECT
+                id_municipio_residencia as mun_id,
+                ano as Ano,
+                {columns},
+                COUNT(*) as contagem
+            FROM
+                {query_backend.table(settings['table'])}
+            WHERE
+                (id_municipio_residencia IN ({mun_id_str}))
+                AND
+                ({years}){where}
+            GROUP BY
+                id_municipio_residencia, ano, {group_by}
+            """
+
+    df = query_cache.read_sql(query=query, billing_project_id=project_id, use_cache=use_cache)
+
+    return df.rename(columns={'contagem': settings['value_name']})
+
+
+def _fetch_plan(watermarks: dict, mun_ids: List[str], start_year: int, revision_years: int) -> Dict[int, List[str]]:
+    # municipalities grouped by the first year to fetch, so each group is a single query
+    plan = dict()
+    for mun_id in mun_ids:
+        mark = watermarks.get(mun_id)
+        if mark is None or start_year < mark['first_year']:
+            from_year = start_year
+        else:
+            from_year = max(start_year, mark['last_year'] - revision_years + 1)
+        plan.setdefault(from_year, list()).append(mun_id)
+
+    return plan
+
+
+def refresh_series(source: str, mun_ids: Sequence, project_id: str, start_year: int = 2000,
+                   end_year: Optional[int] = None, revision_years: int = REVISION_YEARS,
+                   root: Optional[str] = None) -> pd.DataFrame:
+    '''
+    Brings the local series of a source up to date for mun_ids and returns a DataFrame with, for each first year
+    fetched, the number of municipalities and of rows downloaded.
+
+    Municipalities never loaded, or loaded from a later year than start_year, are fetched from start_year. The
+    others are fetched from the last year loaded minus revision_years - 1, and the years fetched replace those in the
+    series. The queries bypass the query_cache entries, which may be up to the source time to live old, so the
+    records published since the last refresh are always fetched; the fresh results replace the cached ones.
+
+    Requires:
+        -> source, 'br_ms_sim' or 'br_ms_sinasc';
+        -> mun_ids, the seven-figures municipality ids;
+        -> project_id, the Google Cloud project id for billing;
+        -> start_year, the first year of the series;
+        -> end_year, the last year to fetch, the last year published by default;
+        -> revision_years, the number of years already loaded which are fetched again;
+        -> root, the series directory, series_dir() by default.
+    '''
+
+    settings = _source(source)
+    if not isinstance(revision_years, int) or revision_years < 0:
+        raise ValueError("revision_years should be a non-negative integer.")
+    if end_year is not None and start_year > end_year:
+        raise ValueError("start_year cannot be greater than end_year.")
+
+    mun_ids = list(dict.fromkeys(str(mun_id) for mun_id in mun_ids))
+    summary = list()
+    with _lock:
+        watermarks = load_watermarks(root)
+        marks = watermarks.setdefault(source, dict())
+        series = _load_series(source, root)
+
+        for from_year, group in sorted(_fetch_plan(marks, mun_ids, start_year, revision_years).items()):
+            if end_year is not None and from_year > end_year:
+                summary.append({'Ano Inicial': from_year, 'Municípios': len(group), 'Linhas': 0})
+                continue
+
+            df = query_series(
+                source=source, mun_ids=group, project_id=project_id, start_year=from_year, end_year=end_year,
+                use_cache=False
+                )
+            df = df.astype({'mun_id': str, 'Ano': np.int64, settings['value_name']: np.int64})
+            summary.append({'Ano Inicial': from_year, 'Municípios': len(group), 'Linhas': len(df)})
+
+            if series is not None:
+                replaced = series['mun_id'].isin(group) & (series['Ano'] >= from_year)
+                if end_year is not None:
+                    replaced &= series['Ano'] <= end_year
+                series = pd.concat([series[~replaced], df], ignore_index=True)
+            else:
+                series = df
+
+            last_year = int(df['Ano'].max()) if len(df) else None
+            for mun_id in group:
+                mark = marks.get(mun_id)
+                first_year = from_year if mark is None else min(mark['first_year'], from_year)
+                years = [year for year in [last_year, mark and mark['last_year']] if year is not None]
+                if years: # municipalities without any record are fetched again from start_year next time
+                    marks[mun_id] = {'first_year': first_year, 'last_year': max(years)}
+
+        if series is not None:
+            series = series.sort_values(['mun_id', 'Ano'] + list(settings['columns'].values())).reset_index(drop=True)
+            _save_series(series, source, root)
+        _save_watermarks(watermarks, root)
+
+    return pd.DataFrame(summary, columns=['Ano Inicial', 'Municípios', 'Linhas'])
+
+
+def read_series(source: str, mun_ids: Optional[Sequence] = None, start_year: Optional[int] = None,
+                end_year: Optional[int] = None, root: Optional[str] = None) -> pd.DataFrame:
+    '''
+    Returns the local series of a source, with columns mun_id, Ano, Sexo (deaths only), Idade and Óbitos or
+    Nascimentos, for mun_ids (all by default) and the years between start_year and end_year.
+    '''
+
+    _source(source)
+    series = _load_series(source, root)
+    if series is None:
+        raise FileNotFoundError(f"The {source} series was not loaded yet, run refresh_series first.")
+
+    keep = np.ones(len(series), dtype=bool)
+    if mun_ids is not None:
+        keep &= series['mun_id'].isin([str(mun_id) for mun_id in mun_ids]).to_numpy()
+    if start_year is not None:
+        keep &= (series['Ano'] >= start_year).to_numpy()
+    if end_year is not None:
+        keep &= (series['Ano'] <= end_year).to_numpy()
+
+    return series[keep].reset_index(drop=True)
+
+
+def impute_missing_ages(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    '''
+    Takes a series as returned by read_series and returns it with the records without age of each municipality at
+    the mean age of its records in the period, truncated, as the standard_age_groups functions do.
+    '''
+
+    value_name = _source(source)['value_name']
+    known = df['Idade'].notna()
+    weights = df[value_name].where(known, 0).astype(float)
+    totals = weights.groupby(df['mun_id']).transform('sum')
+    age_sums = (df['Idade'].where(known, 0).astype(float) * weights).groupby(df['mun_id']).transform('sum')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_age = np.floor(age_sums / totals) # NaN for municipalities without any age
+
+    return df.assign(Idade=df['Idade'].fillna(mean_age))
+
+
+def municipality_series(source: str, mun_id: int, start_year: int = 2002, end_year: int = 2022,
+                        root: Optional[str] = None) -> pd.DataFrame:
+    '''
+    Returns the local series of one municipality in the layout of query_deaths or query_births with aggregate=True,
+    so it can be passed to their standard_age_groups: one row per year, (sex) and age, records without age
+    receiving the mean age of the period, truncated.
+    '''
+
+    settings = _source(source)
+    df = impute_missing_ages(read_series(source, [mun_id], start_year, end_year, root), source).drop(columns='mun_id')
+    keys = ['Ano'] + list(settings['columns'].values())
+
+    return df.groupby(keys, as_index=False, dropna=False)[settings['value_name']].sum()
@@ -0,0 +1,338 @@
+from . import cube, projection
+import numpy as np
+import pandas as pd
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+### Demographic indicators for every municipality, sex and year at once, from the tables of the pipeline (or of the
+### standard_age_groups functions): population, deaths and births by age group, indexed by mun_id (Sexo and Faixa
+### Etária) with one column per year. Tables are turned into cube.PopulationCube arrays with the same labels, and
+### abridged life tables, fertility and dependency ratios are computed with array operations over the age group
+### axis, never one municipality or one year at a time. indicator_panel returns them all in a single table indexed
+### by mun_id and Ano. Rates are per 1,000, as in the rest of the package, dependency ratios per 100.
+
+RADIX = 100000 # survivors at age 0 of the life tables
+LIFE_TABLE_COLUMNS = ['nMx', 'nax', 'nqx', 'lx', 'ndx', 'nLx', 'Tx', 'ex']
+DEPENDENCY_RATIOS = ['Total', 'Jovens', 'Idosos']
+# share of the deaths of a first age group wider than a year, e.g. '0 a 9 anos', which are infant deaths
+INFANT_DEATH_SHARE = 0.8
+
+
+def age_bounds(labels: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns the first age and the width, in years, of each age group label, e.g. '10 a 19 anos' -> (10, 10),
+    '80 anos ou mais' -> (80, inf), 'até 64 anos' -> (0, 65), '1 ano' -> (1, 1).
+    '''
+
+    starts, widths = list(), list()
+    for label in labels:
+        numbers = [int(number) for number in re.findall(r'\d+', str(label))]
+        if not numbers:
+            raise ValueError(f"Cannot read the ages of the age group {label}.")
+        if 'mais' in str(label):
+            start, end = numbers[0], np.inf
+        elif 'até' in str(label).lower():
+            start, end = 0, numbers[0] + 1
+        elif 'menos' in str(label).lower():
+            start, end = 0, numbers[0]
+        else:
+            start, end = numbers[0], numbers[-1] + 1
+        starts.append(start)
+        widths.append(end - start)
+
+    return np.asarray(starts, dtype=float), np.asarray(widths, dtype=float)
+
+
+def _cubes(*frames: pd.DataFrame) -> List[cube.PopulationCube]:
+    # the tables as cubes with the same labels: the years found in all of them and the rows of the first one
+    years = [year for year in frames[0].columns if all(year in df.columns for df in frames[1:])]
+    if not years:
+        raise ValueError("The tables have no year in common.")
+
+    def labelled(df):
+        if 'Faixa Etária' not in df.index.names:
+            return df
+        return df.rename(index=str, level='Faixa Etária')
+
+    first = labelled(frames[0])[years]
+    tables = [first] + [labelled(df)[years].reindex(first.index, fill_value=0) for df in frames[1:]]
+
+    return [cube.PopulationCube.from_frame(df) for df in tables]
+
+
+def _rates(events: np.ndarray, exposure: np.ndarray) -> np.ndarray:
+    # events per person, 0 without events nor exposure, nan with events and no exposure
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.divide(events, exposure)
+
+    return np.where((exposure == 0) & (events == 0), 0, np.where(exposure > 0, rates, np.nan))
+
+
+def _male_share(sexes: np.ndarray) -> np.ndarray:
+    # 1 for men, 0 for women, the share of boys at birth for both sexes together
+    return np.select([sexes == 'Masculino', sexes == 'Feminino'], [1.0, 0.0], projection.MALE_SHARE_AT_BIRTH)
+
+
+def _infant_separation(m0: np.ndarray, male: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Coale-Demeny 1a0 and 4a1 of the infant death rate m0, weighted by the share of men
+    high = m0 >= 0.107
+    a0 = male * np.where(high, 0.330, 0.045 + 2.684 * m0) + (1 - male) * np.where(high, 0.350, 0.053 + 2.800 * m0)
+    a1 = male * np.where(high, 1.352, 1.651 - 3.013 * m0) + (1 - male) * np.where(high, 1.361, 1.522 - 1.518 * m0)
+
+    return a0, a1
+
+
+def _life_table(rates: np.ndarray, starts: np.ndarray, widths: np.ndarray, male: np.ndarray,
+                radix: float = RADIX) -> Dict[str, np.ndarray]:
+    '''
+    Abridged life table columns of central death rates shaped (..., age groups), the last group open. nax is half
+    the width of the group, but for the open group, where it is 1 / nMx, and for the first group when it starts at
+    age 0, which gets the Coale-Demeny separation factors weighted by male, the share of men broadcast against rates
+    without the age axis. A first group wider than a year is split into infants, with INFANT_DEATH_SHARE of its
+    deaths and a fraction 1 / n of its exposure, and older children, whose 4a1 is stretched to the rest of the
+    group. Life tables whose open group has no deaths have no life expectancy (nan).
+    '''
+
+    n = np.where(np.isfinite(widths), widths, 0)
+    a = np.broadcast_to(n / 2, rates.shape).copy()
+    if starts[0] == 0 and widths[0] == 1:
+        a[..., 0] = _infant_separation(rates[..., 0], male)[0]
+    elif starts[0] == 0 and np.isfinite(widths[0]):
+        a0, a1 = _infant_separation(INFANT_DEATH_SHARE * n[0] * rates[..., 0], male)
+        children = 1 + a1 * (n[0] - 1) / 4
+        a[..., 0] = INFANT_DEATH_SHARE * a0 + (1 - INFANT_DEATH_SHARE) * children
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q = np.clip(n * rates / (1 + (n - a) * rates), 0, 1)
+        q[..., -1] = 1
+        a[..., -1] = 1 / rates[..., -1]
+
+        survivors = np.cumprod(1 - q, axis=-1)
+        l = radix * np.concatenate([np.ones(rates.shape[:-1] + (1,)), survivors[..., :-1]], axis=-1)
+        d = l * q
+        L = n * (l - d) + a * d
+        L[..., -1] = l[..., -1] * a[..., -1]
+        T = np.flip(np.cumsum(np.flip(L, axis=-1), axis=-1), axis=-1)
+        e = T / l
+
+    e[~np.isfinite(e)] = np.nan
+    a[~np.isfinite(a)] = np.nan
+
+    return dict(zip(LIFE_TABLE_COLUMNS, [rates, a, q, l, d, L, T, e]))
+
+
+def _with_both_sexes(population: cube.PopulationCube, deaths: cube.PopulationCube) -> tuple:
+    # each sex and their sum, labelled Total
+    both = [population.sum('Sexo'), deaths.sum('Sexo')]
+    sexes = np.append(population.sexes, cube.TOTAL)
+
+    return tuple(
+        cube.PopulationCube(np.concatenate([table.values, total.values], axis=1), table.mun_ids, sexes,
+                            table.age_groups, table.years)
+        for table, total in zip([population, deaths], both)
+        )
+
+
+def _life_tables(population: cube.PopulationCube, deaths: cube.PopulationCube,
+                 radix: float = RADIX) -> Dict[str, np.ndarray]:
+    # life table columns shaped (municipality, sex, year, age group)
+    starts, widths = age_bounds(population.age_groups)
+    rates = np.moveaxis(_rates(deaths.values, population.values), 2, -1)
+    male = _male_share(population.sexes)[np.newaxis, :, np.newaxis]
+
+    return _life_table(rates, starts, widths, male, radix=radix)
+
+
+def life_tables(population: pd.DataFrame, deaths: pd.DataFrame, both_sexes: bool = False,
+                radix: float = RADIX) -> pd.DataFrame:
+    '''
+    Returns the abridged life table of every municipality, sex and year, indexed by mun_id, Sexo, Ano and Faixa
+    Etária, with the columns of LIFE_TABLE_COLUMNS: nMx, deaths per person of the age group, nax, years lived in
+    the group by those who die in it, nqx, the probability of dying in it, lx survivors to its first age out of
+    radix, ndx deaths, nLx and Tx, years lived in the group and after its first age, and ex, life expectancy at
+    its first age. ex is nan in the life tables whose open group has no deaths, common in small municipalities,
+    as the years lived in it are unknown; a wider open group, or pooled years, avoids them.
+
+    Requires population and deaths (e.g. the populacao and obitos stages), indexed by mun_id, Sexo and Faixa Etária
+    with one column per year, in the same age groups, the last one open, e.g. '80 anos ou mais'. With both_sexes,
+    the life tables of both sexes together are added with Sexo Total.
+    '''
+
+    population, deaths = _cubes(population, deaths)
+    if both_sexes:
+        population, deaths = _with_both_sexes(population, deaths)
+    table = _life_tables(population, deaths, radix=radix)
+
+    index = pd.MultiIndex.from_product(
+        [population.mun_ids, population.sexes, population.years,
+         pd.CategoricalIndex(population.age_groups, categories=population.age_groups, ordered=True)],
+        names=['mun_id', 'Sexo', 'Ano', 'Faixa Etária']
+        )
+
+    return pd.DataFrame({column: values.ravel() for column, values in table.items()}, index=index)
+
+
+def life_expectancy(population: pd.DataFrame, deaths: pd.DataFrame, both_sexes: bool = True) -> pd.DataFrame:
+    '''
+    Returns life expectancy at birth (at the first age of the first age group) indexed by mun_id and Sexo, with
+    one column per year, for each sex and, with both_sexes, both sexes together (Sexo Total). See life_tables.
+    '''
+
+    population, deaths = _cubes(population, deaths)
+    if both_sexes:
+        population, deaths = _with_both_sexes(population, deaths)
+    e0 = _life_tables(population, deaths)['ex'][..., 0]
+
+    index = pd.MultiIndex.from_product([population.mun_ids, population.sexes], names=['mun_id', 'Sexo'])
+
+    return pd.DataFrame(e0.reshape(-1, len(population.years)), index=index, columns=list(population.years))
+
+
+def infant_mortality(deaths: pd.DataFrame, births: pd.DataFrame, deaths_column: str = 'Óbitos',
+                     births_column: str = 'Nascimentos') -> pd.DataFrame:
+    '''
+    Returns deaths under 1 year of age per 1,000 live births, indexed by mun_id with one column per year, as in
+    3_cluster_municipios_mortalidade.ipynb.
+
+    Requires deaths and births at single-year ages (the obitos_idade_simples and nascimentos_idade_simples stages),
+    with mun_id, Ano and, for deaths, Idade as columns or index levels.
+    '''
+
+    deaths = deaths.reset_index() if any(name is not None for name in deaths.index.names) else deaths
+    births = births.reset_index() if any(name is not None for name in births.index.names) else births
+
+    infants = deaths[pd.to_numeric(deaths['Idade'], errors='coerce').to_numpy() < 1]
+    infants = infants.groupby(['mun_id', 'Ano'])[deaths_column].sum().unstack('Ano')
+    born = births.groupby(['mun_id', 'Ano'])[births_column].sum().unstack('Ano')
+    infants = infants.reindex(index=born.index, columns=born.columns, fill_value=0).fillna(0)
+
+    rates = _rates(infants.to_numpy(dtype=float), born.to_numpy(dtype=float)) * 1000
+    result = pd.DataFrame(rates, index=born.index.astype(np.int64), columns=list(born.columns))
+
+    return result.rename_axis(index='mun_id')
+
+
+def fertility_rates(births: pd.DataFrame, population: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Returns age-specific fertility rates, births per 1,000 women, indexed by mun_id and Faixa Etária of the
+    mothers, with one column per year.
+
+    Requires births (the nascimentos stage), indexed by mun_id and Faixa Etária, and population (the populacao
+    stage), indexed by mun_id, Sexo and Faixa Etária, with women in the same age groups as the mothers.
+    '''
+
+    births, women = _cubes(births, population.xs('Feminino', level='Sexo'))
+    rates = _rates(births.values, women.values) * 1000
+    index = pd.MultiIndex.from_product(
+        [births.mun_ids, pd.CategoricalIndex(births.age_groups, categories=births.age_groups, ordered=True)],
+        names=['mun_id', 'Faixa Etária']
+        )
+
+    return pd.DataFrame(rates.reshape(-1, len(births.years)), index=index, columns=list(births.years))
+
+
+def _total_fertility(births: cube.PopulationCube, women: cube.PopulationCube) -> np.ndarray:
+    # children per woman, shaped (municipality, year)
+    _, widths = age_bounds(births.age_groups)
+    if not np.all(np.isfinite(widths)):
+        raise ValueError("Age groups of the mothers cannot be open to compute the total fertility rate.")
+    rates = _rates(births.values, women.values)[:, 0]
+
+    return np.einsum('mgy,g->my', rates, widths)
+
+
+def total_fertility(births: pd.DataFrame, population: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Returns the total fertility rate, children per woman, the age-specific fertility rates times the width of the
+    age groups of the mothers, summed, indexed by mun_id with one column per year. See fertility_rates.
+    '''
+
+    births, women = _cubes(births, population.xs('Feminino', level='Sexo'))
+    result = _total_fertility(births, women)
+
+    return pd.DataFrame(result, index=pd.Index(births.mun_ids, name='mun_id'), columns=list(births.years))
+
+
+def _dependency_weights(age_groups: Sequence[str], young: int, old: int) -> np.ndarray:
+    # share of each age group under young, from young to old and from old on, shaped (3, age groups), with ages
+    # spread evenly in the groups that cross a limit and the open group where its first age falls
+    starts, widths = age_bounds(age_groups)
+    ends = starts + widths
+
+    def share(low, high):
+        overlap = np.clip(np.minimum(ends, high) - np.maximum(starts, low), 0, None)
+        with np.errstate(invalid='ignore'):
+            return np.where(np.isfinite(widths), overlap / widths, (starts >= low) & (starts < high))
+
+    return np.vstack([share(0, young), share(young, old), share(old, np.inf)]).astype(float)
+
+
+def _dependency_ratios(population: cube.PopulationCube, young: int, old: int) -> np.ndarray:
+    # total, young and old dependency ratios shaped (municipality, ratio, year)
+    weights = _dependency_weights(population.age_groups, young, old)
+    children, adults, elderly = np.einsum('msgy,kg->kmy', population.values, weights)
+
+    return np.stack([_rates(children + elderly, adults), _rates(children, adults), _rates(elderly, adults)],
+                    axis=1) * 100
+
+
+def dependency_ratios(population: pd.DataFrame, young: int = 15, old: int = 65) -> pd.DataFrame:
+    '''
+    Returns the dependency ratios, people under young and from old on (Total), under young (Jovens) and from old on
+    (Idosos) per 100 people from young to old, indexed by mun_id and Razão with one column per year. Age groups that
+    cross a limit, such as '10 a 19 anos' for 15, are split assuming ages spread evenly in the group.
+    '''
+
+    population = _cubes(population)[0]
+    ratios = _dependency_ratios(population, young, old)
+    index = pd.MultiIndex.from_product([population.mun_ids, DEPENDENCY_RATIOS], names=['mun_id', 'Razão'])
+
+    return pd.DataFrame(ratios.reshape(-1, len(population.years)), index=index, columns=list(population.years))
+
+
+def indicator_panel(population: pd.DataFrame, deaths: pd.DataFrame, births: pd.DataFrame,
+                    single_age_deaths: Optional[pd.DataFrame] = None, single_age_births: Optional[pd.DataFrame] = None,
+                    young: int = 15, old: int = 65) -> pd.DataFrame:
+    '''
+    Returns the indicators of every municipality and year found in population, deaths and births, indexed by mun_id
+    and Ano: life expectancy at birth for both sexes and each sex, crude death and birth rates per 1,000
+    inhabitants, the total fertility rate, the dependency ratios and, when the single-year ages tables are given,
+    infant mortality. Life expectancy is nan where the open age group has no deaths, see life_tables.
+
+    Requires the tables of the populacao, obitos and nascimentos stages and accepts the tables of the
+    obitos_idade_simples and nascimentos_idade_simples stages, see life_tables, total_fertility and
+    infant_mortality.
+    '''
+
+    years = [year for year in population.columns if year in deaths.columns and year in births.columns]
+    population_cube, deaths_cube = _cubes(population[years], deaths[years])
+    births_cube, women = _cubes(births[years], population[years].xs('Feminino', level='Sexo'))
+    mun_ids = population_cube.mun_ids
+
+    both, both_deaths = _with_both_sexes(population_cube, deaths_cube)
+    e0 = _life_tables(both, both_deaths)['ex'][..., 0] # (municipality, sex, year)
+    inhabitants = population_cube.values.sum(axis=(1, 2))
+
+    # births of municipalities with population but no births are 0
+    positions = pd.Index(births_cube.mun_ids).get_indexer(mun_ids)
+    fertility = np.where(positions[:, np.newaxis] >= 0, _total_fertility(births_cube, women)[positions], np.nan)
+    born = np.where(positions[:, np.newaxis] >= 0, births_cube.values.sum(axis=(1, 2))[positions], 0)
+
+    columns = {
+        'Esperança de Vida ao Nascer': e0[:, -1],
+        **{f'Esperança de Vida ao Nascer {sex}': e0[:, i] for i, sex in enumerate(population_cube.sexes)},
+        'Taxa Bruta de Mortalidade': _rates(deaths_cube.values.sum(axis=(1, 2)), inhabitants) * 1000,
+        'Taxa Bruta de Natalidade': _rates(born, inhabitants) * 1000,
+        'Taxa de Fecundidade Total': fertility,
+    }
+    ratios = _dependency_ratios(population_cube, young, old)
+    names = ['Razão de Dependência', 'Razão de Dependência Jovem', 'Razão de Dependência Idosa']
+    columns.update({name: ratios[:, i] for i, name in enumerate(names)})
+    if single_age_deaths is not None and single_age_births is not None:
+        rates = infant_mortality(single_age_deaths, single_age_births)
+        columns['Mortalidade Infantil'] = rates.reindex(index=mun_ids, columns=years).to_numpy(dtype=float)
+
+    index = pd.MultiIndex.from_product([mun_ids, population_cube.years], names=['mun_id', 'Ano'])
+
+    return pd.DataFrame({name: values.ravel() for name, values in columns.items()}, index=index)
@@ -0,0 +1,235 @@
+import pandas as pd
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+import warnings
+from typing import Callable, Optional
+
+
+### Cost and latency records for every query. query_cache.read_sql reports each query here: cache hits are only
+### timed, queries sent to the backend are first estimated with a dry run, checked against the byte budget of the
+### current run and then timed. Query functions decorated with track add their name and municipality to the
+### records, so a run can be summarized by function and municipality.
+
+DRY_RUN = os.getenv('BR_DEMOGRAPHY_DRY_RUN', '1') == '1'
+BYTE_BUDGET = int(os.getenv('BR_DEMOGRAPHY_BYTE_BUDGET')) if os.getenv('BR_DEMOGRAPHY_BYTE_BUDGET') else None
+
+_lock = threading.Lock()
+_records = list()
+_run = {'label': None, 'started': time.time(), 'budget': BYTE_BUDGET, 'bytes_estimated': 0}
+_caller = contextvars.ContextVar('br_demography_caller', default=(None, None))
+
+
+class BudgetExceededError(RuntimeError):
+    '''
+    Raised before a query whose estimated bytes would take the current run over its byte budget.
+    '''
+
+
+def configure(dry_run: Optional[bool] = None) -> None:
+    '''
+    Changes instrumentation settings for the current session. If dry_run is False, queries are not estimated
+    before running, which also disables the byte budget check.
+    '''
+
+    global DRY_RUN
+
+    if dry_run is not None:
+        DRY_RUN = dry_run
+
+
+def start_run(byte_budget: Optional[int] = BYTE_BUDGET, label: Optional[str] = None) -> None:
+    '''
+    Starts a new run: clears the records and sets the maximum number of bytes that queries sent to the backend may
+    process, as estimated by dry runs, from now on. byte_budget None means no limit.
+    '''
+
+    if byte_budget is not None and (not isinstance(byte_budget, int) or byte_budget < 0):
+        raise ValueError("byte_budget should be a non-negative integer or None.")
+
+    with _lock:
+        _records.clear()
+        _run.update({'label': label, 'started': time.time(), 'budget': byte_budget, 'bytes_estimated': 0})
+
+
+def run_status() -> dict:
+    '''
+    Returns the label, start time, byte budget and bytes estimated so far in the current run.
+    '''
+
+    with _lock:
+        status = dict(_run)
+    status['bytes_remaining'] = None if status['budget'] is None else status['budget'] - status['bytes_estimated']
+
+    return status
+
+
+def track(function: Callable) -> Callable:
+    '''
+    Decorator for query functions: queries run inside function are recorded with its name and the mun_id (or
+    mun_ids, or year) it was called with.
+    '''
+
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind_partial(*args, **kwargs).arguments
+        target = arguments.get('mun_id', arguments.get('mun_ids', arguments.get('year')))
+        if isinstance(target, (list, tuple)):
+            target = f'{len(target)} municipalities'
+        token = _caller.set((function.__name__, target))
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _caller.reset(token)
+
+    return wrapper
+
+
+def _record(query: str, backend: str, cached: bool, estimated_bytes: Optional[int], seconds: float,
+            rows: Optional[int], result_memory_bytes: Optional[int], error: Optional[BaseException] = None) -> None:
+    function, mun_id = _caller.get()
+    record = {
+        'timestamp': time.time(),
+        'run': _run['label'],
+        'function': function,
+        'mun_id': mun_id,
+        'backend': backend,
+        'cached': cached,
+        'estimated_bytes': estimated_bytes,
+        'wall_time': seconds,
+        'rows': rows,
+        'result_memory_bytes': result_memory_bytes,
+        'error': None if error is None else f'{type(error).__name__}: {error}',
+        'query': query,
+    }
+    with _lock:
+        _records.append(record)
+
+
+def _frame_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def record_cache_hit(query: str, backend: str, df: pd.DataFrame, seconds: float) -> None:
+    '''
+    Records a query answered by the cache, which processes no bytes in the backend.
+    '''
+
+    _record(query=query, backend=backend, cached=True, estimated_bytes=0, seconds=seconds, rows=len(df),
+            result_memory_bytes=_frame_bytes(df))
+
+
+def record_query(query: str, backend: str, estimated_bytes: Optional[int], seconds: float, rows: Optional[int],
+                 result_memory_bytes: Optional[int], error: Optional[BaseException] = None) -> None:
+    '''
+    Records a query run outside execute, e.g. a streamed query, after check_budget was called for it.
+    '''
+
+    _record(query=query, backend=backend, cached=False, estimated_bytes=estimated_bytes, seconds=seconds, rows=rows,
+            result_memory_bytes=result_memory_bytes, error=error)
+
+
+def _estimate(backend, query: str, billing_project_id: str) -> Optional[int]:
+    estimate = getattr(backend, 'estimate_bytes', None)
+    if not DRY_RUN or estimate is None:
+        return None
+    try:
+        return estimate(query=query, billing_project_id=billing_project_id)
+    except Exception as e:
+        warnings.warn(f'Dry run failed, the query runs without a byte estimate: {e}')
+        return None
+
+
+def check_budget(backend, query: str, billing_project_id: str) -> Optional[int]:
+    '''
+    Estimates the bytes query processes and adds them to the bytes used by the current run, returning the estimate
+    (None when it is unknown). Raises BudgetExceededError, and records the refused query, when the estimate would
+    take the run over its byte budget.
+    '''
+
+    estimated_bytes = _estimate(backend, query, billing_project_id)
+    if estimated_bytes is None:
+        return None
+
+    with _lock:
+        budget, spent = _run['budget'], _run['bytes_estimated']
+        if budget is not None and spent + estimated_bytes > budget:
+            error = BudgetExceededError(
+                f"Query would process {estimated_bytes:,} bytes, {spent:,} of the {budget:,} bytes budget are already used."
+                )
+        else:
+            error = None
+            _run['bytes_estimated'] += estimated_bytes
+    if error is not None:
+        record_query(query=query, backend=backend.name, estimated_bytes=estimated_bytes, seconds=0.0, rows=None,
+                     result_memory_bytes=None, error=error)
+        raise error
+
+    return estimated_bytes
+
+
+def execute(backend, query: str, billing_project_id: str) -> pd.DataFrame:
+    '''
+    Runs a query on backend after estimating the bytes it processes and checking them against the byte budget of
+    the current run, and records its cost and latency. Raises BudgetExceededError without running the query when
+    the budget would be exceeded.
+    '''
+
+    estimated_bytes = check_budget(backend, query, billing_project_id)
+
+    start = time.perf_counter()
+    try:
+        df = backend.read_sql(query=query, billing_project_id=billing_project_id)
+    except Exception as e:
+        record_query(query=query, backend=backend.name, estimated_bytes=estimated_bytes,
+                     seconds=time.perf_counter() - start, rows=None, result_memory_bytes=None, error=e)
+        raise
+    record_query(query=query, backend=backend.name, estimated_bytes=estimated_bytes,
+                 seconds=time.perf_counter() - start, rows=len(df), result_memory_bytes=_frame_bytes(df))
+
+    return df
+
+
+def records() -> pd.DataFrame:
+    '''
+    Returns a DataFrame with one row per query of the current run: function, mun_id, backend, whether it was a cache
+    hit, estimated bytes processed, wall time in seconds, rows and in-memory bytes returned, error and query.
+    '''
+
+    with _lock:
+        df = pd.DataFrame(list(_records), columns=[
+            'timestamp', 'run', 'function', 'mun_id', 'backend', 'cached', 'estimated_bytes', 'wall_time', 'rows',
+            'result_memory_bytes', 'error', 'query'
+            ])
+
+    return df.astype({'estimated_bytes': 'Int64', 'rows': 'Int64', 'result_memory_bytes': 'Int64'})
+
+
+def summary() -> pd.DataFrame:
+    '''
+    Returns the records of the current run summed by function: number of queries, cache hits, errors, estimated
+    bytes, wall time, rows and in-memory size of the results, which is not what the backend bills.
+    '''
+
+    df = records()
+    df['function'] = df['function'].fillna('(untracked)')
+    df['errors'] = df['error'].notna()
+
+    return df.groupby('function').agg(
+        queries=('query', 'size'), cache_hits=('cached', 'sum'), errors=('errors', 'sum'),
+        estimated_bytes=('estimated_bytes', 'sum'), wall_time=('wall_time', 'sum'), rows=('rows', 'sum'),
+        result_memory_bytes=('result_memory_bytes', 'sum')
+        )
+
+
+def export_log(path: str) -> None:
+    '''
+    Writes the records of the current run to path as JSON lines.
+    '''
+
+    records().to_json(path, orient='records', lines=True, force_ascii=False)
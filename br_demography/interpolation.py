@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+from typing import Optional, Sequence
+
+
+### Intercensal estimates for every series of a population table at once. It replaces the loop of
+### notebooks/pdui/1_interpolação_patamares_populacionais.ipynb: the table returned by concatenate_treated_dfs or
+### concatenate_treated_dfs_batch (one row per sex and age group, or per municipality, sex and age group, and one
+### column per census year) is turned into an array and every target year is computed in the same operation.
+
+METHODS = ['linear', 'geometric', 'exponential']
+
+
+def _census_values(df: pd.DataFrame):
+    census_years = df.columns.astype(int).to_numpy()
+    if len(census_years) < 2:
+        raise ValueError("df should have at least two census year columns.")
+    order = np.argsort(census_years)
+
+    return census_years[order], df.to_numpy(dtype=float)[:, order]
+
+
+def growth_rates(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Takes a table with one column per census year and returns the annual geometric growth rate of each row in each
+    intercensal period, with columns named as in the interpolation notebook, e.g. '2000 a 2010'.
+    '''
+
+    census_years, values = _census_values(df)
+    periods = np.diff(census_years)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = (values[:, 1:] / values[:, :-1]) ** (1 / periods) - 1
+    columns = [f'{start} a {end}' for start, end in zip(census_years[:-1], census_years[1:])]
+
+    return pd.DataFrame(rates, index=df.index, columns=columns)
+
+
+def interpolate_population(df: pd.DataFrame, years: Optional[Sequence[int]] = None, method: str = 'geometric',
+                           as_int: bool = True) -> pd.DataFrame:
+    '''
+    Estimates the population of every row of a census table for the target years.
+
+    Requires:
+        -> df, a table with one column per census year, e.g. the output of concatenate_treated_dfs or
+           concatenate_treated_dfs_batch;
+        -> years, the target years, every year from the first to the last census by default. Years out of the
+           census range are extrapolated with the first or last intercensal period;
+        -> method, one of:
+            'linear', constant annual increase between consecutive censuses;
+            'geometric', constant annual growth rate between consecutive censuses, as in the interpolation notebook;
+            'exponential', a single exponential curve fitted to all censuses of each row by log-linear least
+            squares, rows with a census equal to 0 fall back to 'geometric';
+        -> as_int, if True, estimates are truncated to integers, as in
+           pop_municipios_rmc_2000_2022_estimativa_intercensitaria.csv.
+
+    Returns a DataFrame with the same index as df and one column per target year. Census years keep the census
+    values, except with method 'exponential', and estimates that cannot be computed (e.g. geometric growth from 0)
+    receive 0, as do negative linear extrapolations.
+    '''
+
+    if method not in METHODS:
+        raise ValueError(f"method should be one of {METHODS}.")
+
+    census_years, values = _census_values(df)
+    if years is None:
+        years = np.arange(census_years[0], census_years[-1] + 1)
+    years = np.asarray(years, dtype=int)
+
+    # consecutive censuses around each target year, the first or last period for years out of range
+    start = np.clip(np.searchsorted(census_years, years, side='right') - 1, 0, len(census_years) - 2)
+    v0, v1 = values[:, start], values[:, start + 1]
+    elapsed = years - census_years[start]
+    length = census_years[start + 1] - census_years[start]
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if method == 'linear':
+            result = v0 + (v1 - v0) * elapsed / length
+        else:
+            result = v0 * ((v1 / v0) ** (1 / length)) ** elapsed
+
+        if method == 'exponential':
+            x = census_years - census_years[0]
+            positive = np.all(values > 0, axis=1)
+            logs = np.log(np.where(positive[:, np.newaxis], values, 1.0))
+            slope, intercept = np.polyfit(x, logs.T, 1)
+            fitted = np.exp(intercept[:, np.newaxis] + slope[:, np.newaxis] * (years - census_years[0]))
+            result = np.where(positive[:, np.newaxis], fitted, result)
+
+    if method != 'exponential':
+        in_census = np.isin(years, census_years)
+        result[:, in_census] = values[:, np.searchsorted(census_years, years[in_census])]
+
+    result = np.maximum(np.nan_to_num(result, nan=0.0, posinf=0.0, neginf=0.0), 0) # linear extrapolation may go below 0
+    if as_int:
+        result = result.astype(np.int64)
+
+    return pd.DataFrame(result, index=df.index, columns=list(years))
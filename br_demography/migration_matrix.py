@@ -0,0 +1,194 @@
+from . import age_groups, instrumentation, query_backend, query_cache
+import numpy as np
+import pandas as pd
+import os
+from scipy import sparse
+from typing import Dict, Optional, Sequence
+
+
+### Origin-destination migration flows for every municipality from a single scan of each census. The per
+### municipality queries of municipality_migration scan microdados_pessoa once per municipality and direction;
+### here one query groups all migrants by origin, destination, sex and age, and immigration, emigration and net
+### migration of any set of municipalities are row and column sums of sparse matrices.
+
+SEXES = ['Feminino', 'Masculino'] # same sex order as projection.SEXES
+UNKNOWN_ORIGIN = 'Ignorado' # last row of every matrix, migrants whose previous municipality was not recorded
+
+# origin, destination, sex, age, weight, migrant filter and immigrants of each census, as in the
+# municipality_migration queries: in 2000 emigrants are counted by v4250 and immigrants by v0424
+CENSUS_COLUMNS = {
+    2000: {
+        'table': 'br_ibge_censo_demografico.microdados_pessoa_2000', 'origin': 'v4250', 'sex': 'v0401',
+        'age': 'v4752', 'weight': 'p001', 'where': "v4250 IS NOT NULL OR v0424 IN ('3','4')",
+        'immigrant': "v0424 IN ('3','4')",
+    },
+    2010: {
+        'table': 'br_ibge_censo_demografico.microdados_pessoa_2010', 'origin': 'v6264', 'sex': 'v0601',
+        'age': 'v6036', 'weight': 'peso_amostral', 'where': 'v6264 IS NOT NULL',
+        'immigrant': 'v6264 IS NOT NULL',
+    },
+}
+
+
+@instrumentation.track
+def query_migration_flows(year: int, project_id: str) -> pd.DataFrame:
+    '''
+    Returns a Pandas Dataframe with the sum of sample weights of the people who lived in another municipality five
+    years before the census (Peso), and of the immigrants among them as counted by the municipality immigration
+    queries (Imigrantes), grouped by origin, destination, sex and age, for the whole country. Origin is None when
+    the previous municipality was not recorded.
+
+    Requires year, 2000 or 2010, and project_id, the Google Cloud project id for billing.
+    '''
+
+    if year not in CENSUS_COLUMNS:
+        raise ValueError(f"year should be one of {list(CENSUS_COLUMNS)}.")
+    columns = CENSUS_COLUMNS[year]
+
+    query = f"""
+                SELECT
+                        {columns['origin']} AS Origem,
+                        id_municipio AS Destino,
+                        {columns['sex']} AS Sexo,
+                        {columns['age']} AS Idade,
+                        SUM({columns['weight']}) AS Peso,
+                        SUM(CASE WHEN {columns['immigrant']} THEN {columns['weight']} ELSE 0 END) AS Imigrantes
+                FROM
+                        {query_backend.table(columns['table'])}
+                WHERE
+                        {columns['where']}
+                GROUP BY
+                        {columns['origin']}, id_municipio, {columns['sex']}, {columns['age']}
+                """
+
+    return query_cache.read_sql(query=query, billing_project_id=project_id)
+
+
+class MigrationMatrix:
+    '''
+    Migration flows of a census stored as one sparse matrix per sex and age group, with rows for origins and columns
+    for destinations. codes lists the municipality ids of rows and columns, the extra last row holds migrants of
+    unknown origin. immigrants holds, in the same layout, the part of the flows counted as immigration, the whole
+    flows when not given.
+    '''
+
+    def __init__(self, year: int, codes: Sequence[str], age_groups: Sequence[str],
+                 flows: Dict[tuple, sparse.csr_matrix], immigrants: Optional[Dict[tuple, sparse.csr_matrix]] = None):
+        self.year = year
+        self.codes = np.asarray(codes, dtype=object)
+        self.sexes = list(SEXES)
+        self.age_groups = list(age_groups)
+        self.flows = flows
+        self.immigrants = flows if immigrants is None else immigrants
+        self._positions = pd.Index(self.codes)
+
+    @classmethod
+    def from_flows(cls, df: pd.DataFrame, year: int, age_group_csv_path: str) -> 'MigrationMatrix':
+        '''
+        Builds the matrices from the output of query_migration_flows, grouping ages according to a csv which maps
+        ages and age groups. Records with a sex or an age out of the csv are ignored. Immigration is built from the
+        Imigrantes column.
+        '''
+
+        scheme = age_groups.load_scheme(age_group_csv_path)
+        age_codes = age_groups.age_group_codes(df['Idade'], scheme)
+        sex_codes = pd.Index(SEXES).get_indexer(df['Sexo'].astype(str).map({'1': 'Masculino', '2': 'Feminino'}))
+
+        origin = df['Origem'].astype('string')
+        destination = df['Destino'].astype('string')
+        codes = pd.Index(pd.concat([origin, destination]).dropna().unique()).sort_values()
+        rows = codes.get_indexer(origin)
+        rows[origin.isna().to_numpy()] = len(codes)
+        cols = codes.get_indexer(destination)
+
+        keep = (age_codes >= 0) & (sex_codes >= 0) & (cols >= 0)
+        weights = df['Peso'].to_numpy(dtype=float, na_value=0)
+        immigrant_weights = df['Imigrantes'].to_numpy(dtype=float, na_value=0)
+
+        flows, immigrants = dict(), dict()
+        for s, sex in enumerate(SEXES):
+            for a, age_group in enumerate(scheme.labels):
+                cell = keep & (sex_codes == s) & (age_codes == a)
+                for matrices, values in [(flows, weights), (immigrants, immigrant_weights)]:
+                    matrices[(sex, age_group)] = sparse.coo_matrix(
+                        (values[cell], (rows[cell], cols[cell])), shape=(len(codes) + 1, len(codes))
+                        ).tocsr() # duplicated origin-destination pairs are summed
+
+        return cls(year=year, codes=codes.to_numpy(), age_groups=scheme.labels, flows=flows, immigrants=immigrants)
+
+    def _indices(self, mun_ids: Optional[Sequence]) -> np.ndarray:
+        if mun_ids is None:
+            return np.arange(len(self.codes))
+        indices = self._positions.get_indexer([str(mun_id) for mun_id in mun_ids])
+        if np.any(indices < 0):
+            missing = [mun_id for mun_id, i in zip(mun_ids, indices) if i < 0]
+            raise ValueError(f"Municipalities {missing[:5]} have no migration records in {self.year}.")
+
+        return indices
+
+    def _totals(self, mun_ids: Optional[Sequence], direction: str, as_region: bool) -> pd.DataFrame:
+        indices = self._indices(mun_ids)
+        values = list()
+        for matrix in (self.flows if direction == 'out' else self.immigrants).values():
+            if as_region:
+                # flows between municipalities of the region are internal and do not count
+                internal = matrix[indices][:, indices].sum()
+                total = matrix[indices].sum() if direction == 'out' else matrix[:, indices].sum()
+                values.append([total - internal])
+            elif direction == 'out':
+                values.append(np.asarray(matrix[indices].sum(axis=1)).ravel())
+            else:
+                values.append(np.asarray(matrix[:, indices].sum(axis=0)).ravel())
+        values = np.array(values) # (sex x age group, municipality)
+
+        age_group_index = pd.CategoricalIndex(self.age_groups, categories=self.age_groups, ordered=True)
+        if as_region:
+            index = pd.MultiIndex.from_product([self.sexes, age_group_index], names=['Sexo', 'Faixa Etária'])
+            return pd.DataFrame({'Peso': values[:, 0]}, index=index)
+
+        index = pd.MultiIndex.from_product(
+            [self.codes[indices].astype(int), self.sexes, age_group_index], names=['mun_id', 'Sexo', 'Faixa Etária']
+            )
+
+        return pd.DataFrame({'Peso': values.T.ravel()}, index=index)
+
+    def immigration(self, mun_ids: Optional[Sequence] = None, as_region: bool = False) -> pd.DataFrame:
+        '''
+        Returns the immigrants of each municipality in mun_ids (every municipality by default) indexed by mun_id,
+        Sexo and Faixa Etária, with the weights in column Peso. If as_region is True, mun_ids are taken as a single
+        region, indexed by Sexo and Faixa Etária, and migrants between its municipalities are left out.
+        '''
+
+        return self._totals(mun_ids, 'in', as_region)
+
+    def emigration(self, mun_ids: Optional[Sequence] = None, as_region: bool = False) -> pd.DataFrame:
+        '''
+        Returns the emigrants of each municipality in mun_ids, in the same layout as immigration.
+        '''
+
+        return self._totals(mun_ids, 'out', as_region)
+
+    def net_migration(self, mun_ids: Optional[Sequence] = None, as_region: bool = False) -> pd.DataFrame:
+        '''
+        Returns immigrants minus emigrants of each municipality in mun_ids, in the same layout as immigration.
+        '''
+
+        return self.immigration(mun_ids, as_region) - self.emigration(mun_ids, as_region)
+
+
+def build_migration_matrix(year: int, project_id: str, age_group_csv_path: Optional[str] = None) -> MigrationMatrix:
+    '''
+    Runs query_migration_flows for a census year (2000 or 2010) and returns its MigrationMatrix. Ages are grouped by
+    source/tab/faixas_etarias_censo_2000_2010.csv unless another csv is given.
+
+    Flows match the per municipality queries of municipality_migration: emigration of a municipality is the sum of
+    its row, as in query_emigration_by_sex_age(_2000), and immigration is the sum of its column of immigrants, as in
+    query_immigration_by_sex_age(_2000).
+    '''
+
+    if age_group_csv_path is None:
+        age_group_csv_path = os.path.join(os.path.dirname(__file__), 'source/tab/faixas_etarias_censo_2000_2010.csv')
+
+    df = query_migration_flows(year=year, project_id=project_id)
+
+    return MigrationMatrix.from_flows(df=df, year=year, age_group_csv_path=age_group_csv_path)
@@ -1,8 +1,9 @@
-import basedosdados as bd
+from . import age_groups, instrumentation, query_backend, query_cache
 import pandas as pd
 
 
-def query_births(mun_id: int, project_id: str, start_year=2002, end_year=2022) -> pd.DataFrame:
+@instrumentation.track
+def query_births(mun_id: int, project_id: str, start_year=2002, end_year=2022, aggregate=False) -> pd.DataFrame:
     '''
     Returns a Pandas Dataframe with births microdata from SNASC.
 
@@ -11,6 +12,9 @@ def query_births(mun_id: int, project_id: str, start_year=2002, end_year=2022) -
         -> mun_id, the seven-figures municipality id;
         -> start_year, the first year for the beginning of the series
         -> end_year, the last year for the beginning of the series
+        -> aggregate, if True, births are counted in the database and one row is returned per year and mother's age, 
+           with the number of births in the Nascimentos column. Births without mother's age receive the mean age, as in 
+           standard_age_groups.
     '''
 
     if not isinstance(mun_id, int):
@@ -21,23 +25,56 @@ def query_births(mun_id: int, project_id: str, start_year=2002, end_year=2022) -
         raise ValueError("start_year cannot be greater than end_year.")
 
 
-    query = f"""
+    if aggregate:
+        query = f"""
+            WITH nascimentos AS (
+                SELECT 
+                    ano,
+                    idade_mae
+                FROM 
+                    {query_backend.table('br_ms_sinasc.microdados')}
+                WHERE
+                    (id_municipio_residencia = '{mun_id}')
+                    AND
+                    (ano BETWEEN {start_year} AND {end_year})
+            ),
+            idade_media AS (
+                SELECT CAST(TRUNC(AVG(idade_mae)) AS INTEGER) AS idade_mae FROM nascimentos
+            )
             SELECT 
-                ano as Ano,
-                idade_mae as Idade,
-
+                nascimentos.ano as Ano,
+                COALESCE(nascimentos.idade_mae, idade_media.idade_mae) as Idade,
+                COUNT(*) as nascimentos
             FROM 
-                `basedosdados.br_ms_sinasc.microdados`
-            WHERE
-                (id_municipio_residencia = '{mun_id}')
-                AND
-                (ano BETWEEN {start_year} AND {end_year})
-                
+                nascimentos CROSS JOIN idade_media
+            GROUP BY
+                nascimentos.ano, COALESCE(nascimentos.idade_mae, idade_media.idade_mae)
             ORDER BY
-                ano, idade_mae;
+                Ano, Idade;
             """
+    else:
+        query = f"""
+                SELECT 
+                    ano as Ano,
+                    idade_mae as Idade,
+
+                FROM 
+                    {query_backend.table('br_ms_sinasc.microdados')}
+                WHERE
+                    (id_municipio_residencia = '{mun_id}')
+                    AND
+                    (ano BETWEEN {start_year} AND {end_year})
+                
+                ORDER BY
+                    ano, idade_mae;
+                """
     try:
-        return bd.read_sql(query=query,billing_project_id=project_id)
+        df = query_cache.read_sql(query=query,billing_project_id=project_id)
+        if aggregate:
+            df = df.rename(columns={'nascimentos':'Nascimentos'})
+        return df
+    except query_cache.PROPAGATED_ERRORS:
+        raise
     except Exception as e:
         print(f'Something went wrong! {e}')
 
@@ -46,31 +83,19 @@ def query_births(mun_id: int, project_id: str, start_year=2002, end_year=2022) -
 def standard_age_groups(df: pd.DataFrame, age_group_csv_path: str) -> pd.DataFrame:
     '''
     Takes the resulting DataFrame from migration queries and returns standardized age groups according to a given csv which maps 
-    ages and age groups.
+    ages and age groups. Ages mapped to 'Fora de Escopo' are left out. Accepts both microdata and the counts returned by
+    query_births with aggregate=True.
 
     CSV columns must be separated by semi-colon.   
     '''
 
-    df_age_group = pd.read_csv(age_group_csv_path, sep=';') #loads csv which maps ages and age groups
-    dict_age_group = {tup[1]:tup[2] for tup in df_age_group.itertuples()} # generates dictionary that maps age to age group 
-    df_age_group = df_age_group[df_age_group['Faixa Etária'] != 'Fora de Escopo']
-    all_age_groups = df_age_group['Faixa Etária'].unique()
-    
-
-    df.Idade.fillna(value=int(df.Idade.mean()), inplace=True)
-    
-    df['Faixa Etária'] = df.Idade.map(dict_age_group) #retrieves specific age group for each age record in the dataframe
-    df = df[df['Faixa Etária'] != 'Fora de Escopo']
-
-    df['Nascimentos'] = 1
+    value_column = None
+    if 'Nascimentos' in df.columns:
+        value_column = 'Nascimentos' # births already counted in the database
+    else:
+        df = df.assign(Idade=df.Idade.fillna(value=int(df.Idade.mean()))) # records without mother's age receive the mean age
 
-    df = df.drop(columns='Idade').groupby(by=['Ano', 'Faixa Etária'], as_index=False).sum() #groups data by sex and age group
-    df.set_index(['Ano', 'Faixa Etária'], inplace=True) #sets index
-    new_index = pd.MultiIndex.from_product([df.index.levels[0], all_age_groups], names=['Ano', 'Faixa Etária']) #generates standardized index
-    df = df.reindex(new_index) #expands index with possible missing categories
-    df['Nascimentos'].fillna(0, inplace=True) #fills nan values in the weight column with 0
-    df.reset_index(inplace=True) # reset index
-    df['Faixa Etária'] = pd.Categorical(df['Faixa Etária'], categories=all_age_groups, ordered=True) # makes Faixa Etária become ordered categorical
-    df = df.set_index(['Ano', 'Faixa Etária']).sort_index().astype(int) # sort sex and age group and usem them as final index
+    df = age_groups.group_ages(df=df, age_group_csv_path=age_group_csv_path, by=['Ano'], value_column=value_column, value_name='Nascimentos') #counts births by year and age group, with 0 for missing categories
+    df = df.set_index(['Ano', 'Faixa Etária']).astype(int) # year and age group come sorted and are used as final index
 
-    return df
\ No newline at end of file
+    return df
@@ -1,8 +1,9 @@
-import basedosdados as bd
+from . import age_groups, cube, instrumentation, query_backend, query_cache
 import pandas as pd
 
 
-def query_deaths(mun_id: int, project_id: str, start_year=2002, end_year=2022) -> pd.DataFrame:
+@instrumentation.track
+def query_deaths(mun_id: int, project_id: str, start_year=2002, end_year=2022, aggregate=False) -> pd.DataFrame:
     '''
     Returns a Pandas Dataframe with deaths microdata from "Ministério da Saúde".
 
@@ -11,6 +12,8 @@ def query_deaths(mun_id: int, project_id: str, start_year=2002, end_year=2022) -
         -> mun_id, the seven-figures municipality id;
         -> start_year, the first year for the beginning of the series
         -> end_year, the last year for the beginning of the series
+        -> aggregate, if True, deaths are counted in the database and one row is returned per year, sex and age, with
+           the number of deaths in the Óbitos column. Deaths without age receive the mean age, as in standard_age_groups.
     '''
 
     if not isinstance(mun_id, int):
@@ -21,57 +24,87 @@ def query_deaths(mun_id: int, project_id: str, start_year=2002, end_year=2022) -
         raise ValueError("start_year cannot be greater than end_year.")
 
 
-    query = f"""
+    if aggregate:
+        query = f"""
+            WITH obitos AS (
+                SELECT 
+                    ano,
+                    sexo,
+                    idade
+                FROM 
+                    {query_backend.table('br_ms_sim.microdados')}
+                WHERE
+                    (id_municipio_residencia = '{mun_id}')
+                    AND
+                    (ano BETWEEN {start_year} AND {end_year})
+                    AND
+                    (tipo_obito = '2')
+            ),
+            idade_media AS (
+                SELECT CAST(TRUNC(AVG(idade)) AS INTEGER) AS idade FROM obitos
+            )
             SELECT 
-                ano as Ano,
-                sexo as Sexo,
-                idade as Idade,
+                obitos.ano as Ano,
+                obitos.sexo as Sexo,
+                COALESCE(obitos.idade, idade_media.idade) as Idade,
+                COUNT(*) as obitos
             FROM 
-                `basedosdados.br_ms_sim.microdados`
-            WHERE
-                (id_municipio_residencia = '{mun_id}')
-                AND
-                (ano BETWEEN {start_year} AND {end_year})
-                AND
-                (tipo_obito = '2')
-                
+                obitos CROSS JOIN idade_media
+            GROUP BY
+                obitos.ano, obitos.sexo, COALESCE(obitos.idade, idade_media.idade)
             ORDER BY
-                ano, sexo, idade;
+                Ano, Sexo, Idade;
             """
+    else:
+        query = f"""
+                SELECT 
+                    ano as Ano,
+                    sexo as Sexo,
+                    idade as Idade,
+                FROM 
+                    {query_backend.table('br_ms_sim.microdados')}
+                WHERE
+                    (id_municipio_residencia = '{mun_id}')
+                    AND
+                    (ano BETWEEN {start_year} AND {end_year})
+                    AND
+                    (tipo_obito = '2')
+                
+                ORDER BY
+                    ano, sexo, idade;
+                """
     try:
-        return bd.read_sql(query=query,billing_project_id=project_id)
+        df = query_cache.read_sql(query=query,billing_project_id=project_id)
+        if aggregate:
+            df = df.rename(columns={'obitos':'Óbitos'})
+        return df
+    except query_cache.PROPAGATED_ERRORS:
+        raise
     except Exception as e:
         print(f'Something went wrong! {e}')
 
 
 #def standard_age_groups(age_group_csv_path: str) -> pd.DataFrame:
-def standard_age_groups(df: pd.DataFrame, age_group_csv_path: str) -> pd.DataFrame:
+def standard_age_groups(df: pd.DataFrame, age_group_csv_path: str, as_cube: bool = False):
     '''
     Takes the resulting DataFrame from deaths queries and returns standardized age groups according to a given csv which maps 
-    ages and age groups.
+    ages and age groups. Accepts both microdata and the counts returned by query_deaths with aggregate=True.
+    With as_cube, returns a cube.PopulationCube (municipality Total) instead of the pivoted table.
 
     CSV columns must be separated by semi-colon.   
     '''
 
-    df_age_group = pd.read_csv(age_group_csv_path, sep=';') #loads csv which maps ages and age groups
-    dict_age_group = {tup[1]:tup[2] for tup in df_age_group.itertuples()} # generates dictionary that maps age to age group 
-    all_age_groups = df_age_group['Faixa Etária'].unique()
-    
-
-    df.Idade.fillna(value=int(df.Idade.mean()), inplace=True)
-    
-    df['Faixa Etária'] = df.Idade.map(dict_age_group) #retrieves specific age group for each age record in the dataframe
-
-    df['Óbitos'] = 1
+    value_column = None
+    if 'Óbitos' in df.columns:
+        value_column = 'Óbitos' # deaths already counted in the database
+    else:
+        df = df.assign(Idade=df.Idade.fillna(value=int(df.Idade.mean()))) # records without age receive the mean age
 
-    df = df.drop(columns='Idade').groupby(by=['Ano', 'Sexo', 'Faixa Etária'], as_index=True).sum() #groups data by sex and age group
-    new_index = pd.MultiIndex.from_product([df.index.levels[0], df.index.levels[1], all_age_groups], names=['Ano', 'Sexo', 'Faixa Etária']) #generates standardized index
-    df = df.reindex(new_index) #expands index with possible missing categories
-    df['Óbitos'].fillna(0, inplace=True) #fills nan values in the weight column with 0
-    df.reset_index(inplace=True) # reset index
-    df['Faixa Etária'] = pd.Categorical(df['Faixa Etária'], categories=all_age_groups, ordered=True) # makes Faixa Etária become ordered categorical
+    df = age_groups.group_ages(df=df, age_group_csv_path=age_group_csv_path, by=['Ano', 'Sexo'], value_column=value_column, value_name='Óbitos') #counts deaths by year, sex and age group, with 0 for missing categories
     df['Sexo'] = df.Sexo.map({'1':'Masculino', '2':'Feminino'})
-    df = df.set_index(['Ano', 'Sexo', 'Faixa Etária']).sort_index().astype(int) # sort sex and age group and usem them as final index
-    df = df.reset_index().pivot_table(columns=['Ano'], index=['Sexo', 'Faixa Etária'], values='Óbitos')
+    df = df.dropna(subset=['Sexo']).astype({'Óbitos': float})
+    if as_cube:
+        return cube.PopulationCube.from_frame(df, value_column='Óbitos')
+    df = df.pivot(columns='Ano', index=['Sexo', 'Faixa Etária'], values='Óbitos').sort_index() # sex and age group as index, years as columns
 
-    return df
\ No newline at end of file
+    return df
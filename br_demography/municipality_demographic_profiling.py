@@ -1,21 +1,9 @@
-import basedosdados as bd
+from . import age_groups, instrumentation, query_backend, query_cache, streaming
 import pandas as pd
-from typing import List
+from typing import List, Optional
 
 
-def query_interest_vars(mun_ids: List[int], project_id: str, start_year=2002, end_year=2022) -> pd.DataFrame:
-    '''
-    Returns a Pandas DataFrame with deaths microdata from "Ministério da Saúde", filtered for individuals either 
-    under or equal to 1 year old or 65 years and older, suitable for later process of demographic profiling.
-    
-
-    Requires:
-        -> project_id, the Google Cloud project id for billing;
-        -> mun_id, the seven-figures municipality id;
-        -> start_year, the first year for the beginning of the series
-        -> end_year, the last year for the beginning of the series
-    '''
-
+def _check_arguments(mun_ids: List[str], start_year: int, end_year: int) -> None:
     if not isinstance(mun_ids, list):
         raise ValueError("mun_id should be a list of integers.")
     if not all(isinstance(id, str) for id in mun_ids):
@@ -25,16 +13,19 @@ def query_interest_vars(mun_ids: List[int], project_id: str, start_year=2002, en
     if start_year > end_year:
         raise ValueError("start_year cannot be greater than end_year.")
 
+
+def _interest_vars_query(mun_ids: List[str], start_year: int, end_year: int, order: bool = True) -> str:
     # Convert list of mun_id to a format suitable for SQL IN clause
     mun_id_str = ", ".join([f"'{id}'" for id in mun_ids])
+    order_by = "ORDER BY\n                ano, idade" if order else ""
 
-    query = f"""
+    return f"""
             SELECT 
                 id_municipio_residencia as mun_id,
                 ano as Ano,
                 idade as Idade
             FROM 
-                `basedosdados.br_ms_sim.microdados`
+                {query_backend.table('br_ms_sim.microdados')}
             WHERE
                 (id_municipio_residencia IN ({mun_id_str}))
                 AND
@@ -44,17 +35,58 @@ def query_interest_vars(mun_ids: List[int], project_id: str, start_year=2002, en
                 AND
                 ((idade < 1) OR (idade >=65))
                 
-            ORDER BY
-                ano, idade;
+            {order_by};
+            """
+
+
+def _births_query(mun_ids: List[str], start_year: int, end_year: int, order: bool = True) -> str:
+    mun_id_str = ", ".join([f"'{id}'" for id in mun_ids])
+    order_by = "ORDER BY\n                ano, id_municipio_residencia" if order else ""
+
+    return f"""
+            SELECT
+                id_municipio_residencia as mun_id, 
+                ano as Ano
+
+            FROM 
+                {query_backend.table('br_ms_sinasc.microdados')}
+            WHERE
+                (id_municipio_residencia  IN ({mun_id_str}))
+                AND
+                (ano BETWEEN {start_year} AND {end_year})
+                
+            {order_by};
             """
+
+
+@instrumentation.track
+def query_interest_vars(mun_ids: List[int], project_id: str, start_year=2002, end_year=2022) -> pd.DataFrame:
+    '''
+    Returns a Pandas DataFrame with deaths microdata from "Ministério da Saúde", filtered for individuals either 
+    under or equal to 1 year old or 65 years and older, suitable for later process of demographic profiling.
+    
+
+    Requires:
+        -> project_id, the Google Cloud project id for billing;
+        -> mun_id, the seven-figures municipality id;
+        -> start_year, the first year for the beginning of the series
+        -> end_year, the last year for the beginning of the series
+    '''
+
+    _check_arguments(mun_ids, start_year, end_year)
+
+    query = _interest_vars_query(mun_ids, start_year, end_year)
     try:
-        return bd.read_sql(query=query,billing_project_id=project_id)
+        return query_cache.read_sql(query=query,billing_project_id=project_id)
+    except query_cache.PROPAGATED_ERRORS:
+        raise
     except Exception as e:
         print(f'Something went wrong! {e}')
 
 
 
 
+@instrumentation.track
 def query_births(mun_ids: List[int], project_id: str, start_year=2000, end_year=2021) -> pd.DataFrame:
     '''
     Returns a Pandas Dataframe with births microdata from SNASC.
@@ -66,38 +98,90 @@ def query_births(mun_ids: List[int], project_id: str, start_year=2000, end_year=
         -> end_year, the last year for the beginning of the series
     '''
 
-    if not isinstance(mun_ids, list):
-        raise ValueError("mun_id should be a list of integers.")
-    if not all(isinstance(id, str) for id in mun_ids):
-        raise ValueError("All elements in mun_id should be strings.")
-    if not isinstance(start_year, int) or not isinstance(end_year, int):
-        raise ValueError("start_year and end_year should be integers.")
-    if start_year > end_year:
-        raise ValueError("start_year cannot be greater than end_year.")
+    _check_arguments(mun_ids, start_year, end_year)
 
-    mun_id_str = ", ".join([f"'{id}'" for id in mun_ids])
-
-    query = f"""
-            SELECT
-                id_municipio_residencia as mun_id, 
-                ano as Ano
-
-            FROM 
-                `basedosdados.br_ms_sinasc.microdados`
-            WHERE
-                (id_municipio_residencia  IN ({mun_id_str}))
-                AND
-                (ano BETWEEN {start_year} AND {end_year})
-                
-            ORDER BY
-                ano, id_municipio_residencia;
-            """
+    query = _births_query(mun_ids, start_year, end_year)
     try:
-        return bd.read_sql(query=query,billing_project_id=project_id)
+        return query_cache.read_sql(query=query,billing_project_id=project_id)
+    except query_cache.PROPAGATED_ERRORS:
+        raise
     except Exception as e:
         print(f'Something went wrong! {e}')
 
 
+# Streaming versions of the queries above. Rows are read in batches and only their counts are kept (see
+# streaming.py), so the whole country can be pulled without holding the microdata in memory.
+
+@instrumentation.track
+def stream_interest_vars(mun_ids: List[str], project_id: str, start_year=2002, end_year=2022,
+                         age_group_csv_path: Optional[str] = None,
+                         batch_size: int = streaming.DEFAULT_BATCH_SIZE) -> pd.DataFrame:
+    '''
+    Returns the deaths of query_interest_vars counted by mun_id, Ano and Idade, or by mun_id, Ano and Faixa Etária
+    when age_group_csv_path is given, in column Óbitos.
+
+    Requires:
+        -> project_id, the Google Cloud project id for billing;
+        -> mun_ids, the seven-figures municipality ids, as strings;
+        -> start_year and end_year, the first and last years of the series;
+        -> age_group_csv_path, an optional csv which maps ages and age groups;
+        -> batch_size, the number of rows read at once.
+
+    Errors of the query are raised, not printed as by query_interest_vars.
+    '''
+
+    _check_arguments(mun_ids, start_year, end_year)
+
+    by = ['mun_id', 'Ano'] if age_group_csv_path is not None else ['mun_id', 'Ano', 'Idade']
+    deaths = streaming.GroupCounter(by=by, age_group_csv_path=age_group_csv_path, value_name='Óbitos')
+    query = _interest_vars_query(mun_ids, start_year, end_year, order=False)
+    streaming.stream_query(query=query, billing_project_id=project_id, aggregators=[deaths], batch_size=batch_size)
+
+    return deaths.result()
+
+
+@instrumentation.track
+def stream_births(mun_ids: List[str], project_id: str, start_year=2000, end_year=2021,
+                  batch_size: int = streaming.DEFAULT_BATCH_SIZE) -> pd.DataFrame:
+    '''
+    Returns the births of query_births counted by mun_id and Ano, in column Nascimentos.
+
+    Requires the same arguments as stream_interest_vars, except age_group_csv_path.
+    '''
+
+    _check_arguments(mun_ids, start_year, end_year)
+
+    births = streaming.GroupCounter(by=['mun_id', 'Ano'], value_name='Nascimentos')
+    query = _births_query(mun_ids, start_year, end_year, order=False)
+    streaming.stream_query(query=query, billing_project_id=project_id, aggregators=[births], batch_size=batch_size)
+
+    return births.result()
+
+
+def child_death_rate(deaths: pd.DataFrame, births: pd.DataFrame, by_year: bool = False) -> pd.DataFrame:
+    '''
+    Returns deaths under 1 year old per live birth of each municipality, from the outputs of stream_interest_vars
+    (without age groups) and stream_births, of query_interest_vars and query_births, or of incremental.read_series.
+
+    Deaths and births are summed over the years, as in the 'Aggregated Child Death Rate' of the mortality cluster
+    notebook, unless by_year is True, in which case the rate of each year is returned, with years as columns.
+    '''
+
+    if 'Óbitos' not in deaths.columns:
+        deaths = deaths.groupby(['mun_id', 'Ano', 'Idade']).size().rename('Óbitos').to_frame()
+    if 'Nascimentos' not in births.columns:
+        births = births.groupby(['mun_id', 'Ano']).size().rename('Nascimentos').to_frame()
+
+    deaths = deaths.reset_index()
+    infant_deaths = deaths[deaths['Idade'] < 1].groupby(['mun_id', 'Ano'])['Óbitos'].sum().unstack()
+    live_births = births.groupby(['mun_id', 'Ano'])['Nascimentos'].sum().unstack()
+
+    if by_year:
+        return infant_deaths / live_births
+
+    return (infant_deaths.sum(axis=1) / live_births.sum(axis=1)).to_frame('Aggregated Child Death Rate')
+
+
 
 
 
@@ -120,25 +204,11 @@ def standard_age_groups(df: pd.DataFrame, age_group_csv_path: str) -> pd.DataFra
     CSV columns must be separated by semi-colon.   
     '''
 
-    df_age_group = pd.read_csv(age_group_csv_path, sep=';') #loads csv which maps ages and age groups
-    dict_age_group = {tup[1]:tup[2] for tup in df_age_group.itertuples()} # generates dictionary that maps age to age group 
-    all_age_groups = df_age_group['Faixa Etária'].unique()
-    
-
-    df.Idade.fillna(value=int(df.Idade.mean()), inplace=True)
-    
-    df['Faixa Etária'] = df.Idade.map(dict_age_group) #retrieves specific age group for each age record in the dataframe
-
-    df['Óbitos'] = 1
+    df = df.assign(Idade=df.Idade.fillna(value=int(df.Idade.mean()))) # records without age receive the mean age
 
-    df = df.drop(columns='Idade').groupby(by=['Ano', 'Sexo', 'Faixa Etária'], as_index=True).sum() #groups data by sex and age group
-    new_index = pd.MultiIndex.from_product([df.index.levels[0], df.index.levels[1], all_age_groups], names=['Ano', 'Sexo', 'Faixa Etária']) #generates standardized index
-    df = df.reindex(new_index) #expands index with possible missing categories
-    df['Óbitos'].fillna(0, inplace=True) #fills nan values in the weight column with 0
-    df.reset_index(inplace=True) # reset index
-    df['Faixa Etária'] = pd.Categorical(df['Faixa Etária'], categories=all_age_groups, ordered=True) # makes Faixa Etária become ordered categorical
+    df = age_groups.group_ages(df=df, age_group_csv_path=age_group_csv_path, by=['Ano', 'Sexo'], value_name='Óbitos') #counts deaths by year, sex and age group, with 0 for missing categories
     df['Sexo'] = df.Sexo.map({'1':'Masculino', '2':'Feminino'})
-    df = df.set_index(['Ano', 'Sexo', 'Faixa Etária']).sort_index().astype(int) # sort sex and age group and usem them as final index
-    df = df.reset_index().pivot_table(columns=['Ano'], index=['Sexo', 'Faixa Etária'], values='Óbitos')
+    df = df.dropna(subset=['Sexo']).astype({'Óbitos': float})
+    df = df.pivot(columns='Ano', index=['Sexo', 'Faixa Etária'], values='Óbitos').sort_index() # sex and age group as index, years as columns
 
-    return df
\ No newline at end of file
+    return df
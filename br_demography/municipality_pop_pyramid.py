@@ -1,9 +1,11 @@
-import basedosdados as bd
+from . import age_groups, cube, instrumentation, query_backend, query_cache
+import numpy as np
 import pandas as pd
 import os
 from typing import List
 
 
+@instrumentation.track
 def query_total_pop_by_sex_age_2022(mun_id: int, project_id: str) -> pd.DataFrame:
     
     # carregar faixas etarias censo 2000.csv, e utilizar no where para escolher somentes as linhas de interesse
@@ -35,7 +37,7 @@ def query_total_pop_by_sex_age_2022(mun_id: int, project_id: str) -> pd.DataFram
 						grupo_idade AS Idade,
 						SUM(populacao_residente) AS Pop 
 				FROM 
-						`basedosdados.br_ibge_censo_2022.populacao_residente_municipio` 
+						{query_backend.table('br_ibge_censo_2022.populacao_residente_municipio')} 
 				WHERE 
 						(id_municipio = '{mun_id}')
 						AND
@@ -45,7 +47,7 @@ def query_total_pop_by_sex_age_2022(mun_id: int, project_id: str) -> pd.DataFram
 				ORDER BY 
 						sexo, grupo_idade;
 				"""
-	df = bd.read_sql(query=query,billing_project_id=project_id).fillna(0)
+	df = query_cache.read_sql(query=query,billing_project_id=project_id).fillna(0)
 
 	df['Sexo'] = df['Sexo'].map({'Homens':'Masculino', 'Mulheres':'Feminino'})
 	
@@ -56,6 +58,7 @@ def query_total_pop_by_sex_age_2022(mun_id: int, project_id: str) -> pd.DataFram
 
 
 
+@instrumentation.track
 def query_total_pop_by_sex_age_2010(mun_id: int, project_id: str) -> pd.DataFrame:
 	'''
 	Returns a Pandas Dataframe with the sum of sample weights from the 2010 census that represent 
@@ -71,7 +74,7 @@ def query_total_pop_by_sex_age_2010(mun_id: int, project_id: str) -> pd.DataFram
 						v6036 AS Idade,
 						SUM(peso_amostral) AS Peso 
 				FROM 
-						`basedosdados.br_ibge_censo_demografico.microdados_pessoa_2010` 
+						{query_backend.table('br_ibge_censo_demografico.microdados_pessoa_2010')} 
 				WHERE 
 						id_municipio = '{mun_id}'
 				GROUP BY 
@@ -79,7 +82,7 @@ def query_total_pop_by_sex_age_2010(mun_id: int, project_id: str) -> pd.DataFram
 				ORDER BY 
 						v0601, v6036;
 				"""
-	df = bd.read_sql(query=query,billing_project_id=project_id)
+	df = query_cache.read_sql(query=query,billing_project_id=project_id)
 	df['Sexo'] = df['Sexo'].map({'1':'Masculino', '2':'Feminino'})
 
 	try:
@@ -88,6 +91,7 @@ def query_total_pop_by_sex_age_2010(mun_id: int, project_id: str) -> pd.DataFram
 		print(f'Something went wrong! {e}')
 
 
+@instrumentation.track
 def query_total_pop_by_sex_age_2000(mun_id: int, project_id: str) -> pd.DataFrame:
 	'''
 	Returns a Pandas Dataframe with the sum of sample weights from the 2000 census that represent 
@@ -103,7 +107,7 @@ def query_total_pop_by_sex_age_2000(mun_id: int, project_id: str) -> pd.DataFram
 						v4752 AS Idade,
 						SUM(p001) AS Peso 
 				FROM 
-						`basedosdados.br_ibge_censo_demografico.microdados_pessoa_2000` 
+						{query_backend.table('br_ibge_censo_demografico.microdados_pessoa_2000')} 
 				WHERE 
 						id_municipio = '{mun_id}'
 				GROUP BY 
@@ -112,7 +116,7 @@ def query_total_pop_by_sex_age_2000(mun_id: int, project_id: str) -> pd.DataFram
 						v0401, v4752;
 				"""
 
-	df = bd.read_sql(query=query,billing_project_id=project_id)
+	df = query_cache.read_sql(query=query,billing_project_id=project_id)
 	df['Sexo'] = df['Sexo'].map({'1':'Masculino', '2':'Feminino'})
 
 	try:
@@ -130,23 +134,11 @@ def standard_age_groups(df: pd.DataFrame, age_group_csv_path: str, year: int) ->
 	CSV columns must be separated by semi-colon.   
 	'''
 
-	df_age_group = pd.read_csv(age_group_csv_path, sep=';') #loads csv which maps ages and age groups
-	dict_age_group = {tup[1]:tup[2] for tup in df_age_group.itertuples()} # generates dictionary that maps age to age group 
-	all_age_groups = df_age_group['Faixa Etária'].unique()
-      
-        
-	df['Faixa Etária'] = df.Idade.map(dict_age_group) #retrieves specific age group for each age record in the dataframe
-	df = df.drop(columns='Idade').groupby(by=['Sexo', 'Faixa Etária'], as_index=False).sum() #groups data by sex and age group
-	df.set_index(['Sexo', 'Faixa Etária'], inplace=True) #sets index
-	new_index = pd.MultiIndex.from_product([df.index.levels[0], all_age_groups], names=['Sexo', 'Faixa Etária']) #generates standardized index
-	df = df.reindex(new_index) #expands index with possible missing categories
-	if year in [2010, 2000]:
-		df.rename(columns={'Peso':'Pop'}, inplace=True)
-	df['Pop'].fillna(0, inplace=True) #fills nan values in the weight column with 0
-	df.reset_index(inplace=True) # reset index    
+	value_column = 'Peso' if year in [2010, 2000] else 'Pop'
+
+	df = age_groups.group_ages(df=df, age_group_csv_path=age_group_csv_path, by=['Sexo'], value_column=value_column, value_name='Pop') #sums population by sex and age group, with 0 for missing categories
 	df['Ano'] = year
-	df['Faixa Etária'] = pd.Categorical(df['Faixa Etária'], categories=all_age_groups, ordered=True) # makes Faixa Etária become ordered categorical
-	df = df.sort_values(['Sexo', 'Faixa Etária']).set_index(['Ano','Sexo', 'Faixa Etária']) # sort sex and age group and usem them as final index
+	df = df.set_index(['Ano','Sexo', 'Faixa Etária']) # sex and age group come sorted and are used as final index
 	if year in [2010, 2000]:
 		df = df.round(decimals=0).astype(int)
 
@@ -167,12 +159,192 @@ def concatenate_treated_dfs(dfs: List[pd.DataFrame]):
     return df
 
 
+def check_mun_ids(mun_ids: List[int]) -> None:
+	'''
+	Raises a ValueError unless mun_ids, the municipalities of a batch query, is a non-empty list of integers, so it
+	always makes a valid IN clause.
+	'''
+
+	if not isinstance(mun_ids, list) or not all(
+			isinstance(id, (int, np.integer)) and not isinstance(id, bool) for id in mun_ids
+			):
+		raise ValueError("mun_ids should be a list of integers.")
+	if not mun_ids:
+		raise ValueError("mun_ids should not be empty.")
+
+
+@instrumentation.track
+def query_total_pop_by_sex_age_2022_batch(mun_ids: List[int], project_id: str) -> pd.DataFrame:
+	'''
+	Returns a Pandas Dataframe with the 2022 census population of several Brazilian municipalities, 
+	grouped by municipality, sex and age, using a single query.
+
+	Requires project_id, the Google Cloud project id for billing, and mun_ids, a list of seven-figures municipality ids.
+
+	'''
+
+	check_mun_ids(mun_ids)
+
+	current_dir = os.path.dirname(__file__)
+
+	csv_file_path = os.path.join(current_dir, 'source/tab/faixas_etarias_censo_2022.csv')
+
+	faixa_etaria = pd.read_csv(csv_file_path, sep=';')
+
+	mun_id_str = ", ".join([f"'{id}'" for id in mun_ids])
+
+	query = f"""
+				SELECT  
+						id_municipio AS mun_id,
+						sexo AS Sexo, 
+						grupo_idade AS Idade,
+						SUM(populacao_residente) AS Pop 
+				FROM 
+						{query_backend.table('br_ibge_censo_2022.populacao_residente_municipio')} 
+				WHERE 
+						(id_municipio IN ({mun_id_str}))
+						AND
+						(grupo_idade IN {tuple(faixa_etaria['faixa_2000_original'].unique())})
+				GROUP BY
+						id_municipio, sexo, grupo_idade            
+				ORDER BY 
+						id_municipio, sexo, grupo_idade;
+				"""
+	df = query_cache.read_sql(query=query,billing_project_id=project_id).fillna(0)
+
+	df['mun_id'] = df['mun_id'].astype(int)
+	df['Sexo'] = df['Sexo'].map({'Homens':'Masculino', 'Mulheres':'Feminino'})
+
+	return df
+
+
+@instrumentation.track
+def query_total_pop_by_sex_age_2010_batch(mun_ids: List[int], project_id: str) -> pd.DataFrame:
+	'''
+	Returns a Pandas Dataframe with the sum of sample weights from the 2010 census that represent 
+	population of several Brazilian municipalities, grouped by municipality, sex and age, using a single
+	scan of the microdata table.
+
+	Requires project_id, the Google Cloud project id for billing, and mun_ids, a list of seven-figures municipality ids.
+
+	'''
+
+	check_mun_ids(mun_ids)
+
+	mun_id_str = ", ".join([f"'{id}'" for id in mun_ids])
+
+	query = f"""
+				SELECT  
+						id_municipio AS mun_id,
+						v0601 AS Sexo, 
+						v6036 AS Idade,
+						SUM(peso_amostral) AS Peso 
+				FROM 
+						{query_backend.table('br_ibge_censo_demografico.microdados_pessoa_2010')} 
+				WHERE 
+						id_municipio IN ({mun_id_str})
+				GROUP BY 
+						id_municipio, v0601, v6036
+				ORDER BY 
+						id_municipio, v0601, v6036;
+				"""
+	df = query_cache.read_sql(query=query,billing_project_id=project_id)
+
+	df['mun_id'] = df['mun_id'].astype(int)
+	df['Sexo'] = df['Sexo'].map({'1':'Masculino', '2':'Feminino'})
+
+	return df
+
+
+@instrumentation.track
+def query_total_pop_by_sex_age_2000_batch(mun_ids: List[int], project_id: str) -> pd.DataFrame:
+	'''
+	Returns a Pandas Dataframe with the sum of sample weights from the 2000 census that represent 
+	population of several Brazilian municipalities, grouped by municipality, sex and age, using a single
+	scan of the microdata table.
+
+	Requires project_id, the Google Cloud project id for billing, and mun_ids, a list of seven-figures municipality ids.
+
+	'''
+
+	check_mun_ids(mun_ids)
+
+	mun_id_str = ", ".join([f"'{id}'" for id in mun_ids])
+
+	query = f"""
+				SELECT 
+						id_municipio AS mun_id,
+						v0401 AS Sexo, 
+						v4752 AS Idade,
+						SUM(p001) AS Peso 
+				FROM 
+						{query_backend.table('br_ibge_censo_demografico.microdados_pessoa_2000')} 
+				WHERE 
+						id_municipio IN ({mun_id_str})
+				GROUP BY 
+						id_municipio, v0401, v4752
+				ORDER BY 
+						id_municipio, v0401, v4752;
+				"""
+
+	df = query_cache.read_sql(query=query,billing_project_id=project_id)
+
+	df['mun_id'] = df['mun_id'].astype(int)
+	df['Sexo'] = df['Sexo'].map({'1':'Masculino', '2':'Feminino'})
+
+	return df
+
+
+def standard_age_groups_batch(df: pd.DataFrame, age_group_csv_path: str, year: int, as_cube: bool = False):
+	'''
+	Batched version of standard_age_groups. Takes the resulting DataFrame from the *_batch population queries,
+	which hold several municipalities identified by the mun_id column, and returns standardized age groups 
+	according to a given csv which maps ages and age groups.
+
+	Every municipality receives the full set of sexes and age groups, with 0 where there is no population.
+	The result is indexed by Ano, mun_id, Sexo and Faixa Etária, with a single Pop column, or, with as_cube, is a
+	cube.PopulationCube with the single year.
+
+	CSV columns must be separated by semi-colon.   
+	'''
+
+	value_column = 'Peso' if year in [2010, 2000] else 'Pop'
+
+	df = age_groups.group_ages(df=df, age_group_csv_path=age_group_csv_path, by=['mun_id', 'Sexo'], value_column=value_column, value_name='Pop') #sums population by municipality, sex and age group
+	df['Ano'] = year
+	if year in [2010, 2000]:
+		df['Pop'] = df['Pop'].round(decimals=0).astype(int)
+	if as_cube:
+		return cube.PopulationCube.from_frame(df, value_column='Pop')
+	df = df.set_index(['Ano', 'mun_id', 'Sexo', 'Faixa Etária'])
+
+	return df
+
+def concatenate_treated_dfs_batch(dfs: List[pd.DataFrame], as_cube: bool = False):
+	"""
+	Takes dataframes that were treated by standard_age_groups_batch function and concatenates them into a single
+	table indexed by mun_id, Sexo and Faixa Etária, with one column per census year, or, with as_cube, into a
+	cube.PopulationCube of integer counts, scattered straight from the long tables with no pivot.
+
+	"""
+	df = pd.concat(objs=dfs, ignore_index=False)
+	if as_cube:
+		return cube.PopulationCube.from_frame(df, value_column='Pop').astype(int)
+	df = df['Pop'].unstack(level='Ano', fill_value=0).sort_index(axis=1)
+	df = df.astype(int)
+	df.columns.name = None
+
+	return df
+
+
+
 ########
 ######## THE CODE BELOW IS NOT IN USE IN THE NOTEBOOKS SO FAR. A TABLE, moradores_dppo.csv, WAS ALREADY GENERATED FOR ALL MUNICIPALITIES IN BRAZIL
 ######## 
 ########
 
 
+@instrumentation.track
 def query_dppo_2022(mun_id: int, project_id: str) -> pd.DataFrame:
     
     # carregar faixas etarias censo 2000.csv, e utilizar no where para escolher somentes as linhas de interesse
@@ -198,14 +370,14 @@ def query_dppo_2022(mun_id: int, project_id: str) -> pd.DataFrame:
 						domicilios AS dppo_2022
 
 				FROM 
-						`basedosdados.br_ibge_censo_2022.domicilio_morador_municipio` 
+						{query_backend.table('br_ibge_censo_2022.domicilio_morador_municipio')} 
 				WHERE 
 						(id_municipio = '{mun_id}')
 						            
 				ORDER BY 
 						id_municipio;
 				"""
-	df = bd.read_sql(query=query,billing_project_id=project_id)
+	df = query_cache.read_sql(query=query,billing_project_id=project_id)
 
 	df['moradores/dppo 2022'] = (df['moradores_dppo_2022'] / df['dppo_2022']).round(2)
 	
@@ -215,6 +387,7 @@ def query_dppo_2022(mun_id: int, project_id: str) -> pd.DataFrame:
 		print(f'Something went wrong! {e}')
 
 
+@instrumentation.track
 def query_household_residents_2010(mun_id: int, project_id: str) -> pd.DataFrame:
 	'''
 	Returns a Pandas Dataframe with the number of household dwellers from the 2010 census.
@@ -227,11 +400,11 @@ def query_household_residents_2010(mun_id: int, project_id: str) -> pd.DataFrame
 				SELECT  
 						SUM(peso_amostral) AS Peso 
 				FROM 
-						`basedosdados.br_ibge_censo_demografico.microdados_pessoa_2010` 
+						{query_backend.table('br_ibge_censo_demografico.microdados_pessoa_2010')} 
 				WHERE 
 						id_municipio = '{mun_id}';
 				"""
-	df = bd.read_sql(query=query,billing_project_id=project_id)
+	df = query_cache.read_sql(query=query,billing_project_id=project_id)
 
 	try:
 		return df
@@ -0,0 +1,597 @@
+from . import age_groups, cube, household_projection, incremental, indicators, interpolation, migration_matrix, \
+    municipality_pop_pyramid, projection, query_backend, regions, result_store, stochastic, trend_models
+import numpy as np
+import pandas as pd
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+
+### The production run of the notebooks (interpolation, births, mortality, migration balance, projection and land
+### demand), plus a stochastic projection, as a graph of stages over the package modules. Each stage reads the
+### tables of its input stages from result_store and writes its own table there. Its fingerprint hashes its
+### parameters (file parameters by content) and the fingerprints of its inputs, so a stage whose fingerprint is in
+### the manifest is skipped, and changing a parameter reruns only the stages downstream of it. Stages without
+### pending inputs run in parallel. Stages that query the source data (DATA_STAGES) also hash the backend, with its
+### data, and data_version, so they run again on other extracts, after a data release, or with --refresh-data.
+### Census population, deaths and births are stored once at single-year ages (the five-year labels of the 2022
+### census) and regrouped in memory, so changing an age group csv never queries again.
+### Run with: python -m br_demography --municipalities br_demography/source/tab/cod_mun.csv --region rmc
+
+SOURCE_TAB = os.path.join(os.path.dirname(__file__), 'source', 'tab')
+
+DEFAULT_PARAMETERS = {
+    'municipalities': os.path.join(SOURCE_TAB, 'cod_mun.csv'), # csv with mun_id and mun columns
+    'project_id': os.getenv('GOOGLE_CLOUD_PROJECT_ID'), # for billing only, not part of any fingerprint
+    'data_version': None, # label of the source data release, e.g. '2024-06'; changing it reruns the query stages
+    'series_dir': None, # local SIM and SINASC series, under the store by default, not part of any fingerprint
+    'start_year': 2000,
+    'end_year': 2022, # last year of deaths and births
+    'rate_end_year': 2019, # last year of the rates fitted, 2020 to 2022 are left out as in the notebooks
+    'base_year': 2022,
+    'horizon': 2042,
+    'step': 10,
+    'age_group_width': 10,
+    'interpolation_method': 'geometric',
+    'birth_models': ['Exponencial'],
+    'death_models': ['Exponencial', 'Linear'],
+    'household_models': ['Linear', 'Exponencial'],
+    'criterion': 'rmse',
+    'migration': False, # the projection notebook projects without migration
+    'n_draws': 1000, # scenarios of the stochastic projection
+    'seed': 0,
+    'migration_sd': 0.25, # standard deviation of the random factor applied to net migration in each scenario
+    'percentiles': [5, 50, 95],
+    'age_groups': os.path.join(SOURCE_TAB, 'faixas_etarias_censo_2000_2010.csv'),
+    'age_groups_2022': os.path.join(SOURCE_TAB, 'faixas_etarias_censo_2022.csv'),
+    'age_groups_mothers': os.path.join(SOURCE_TAB, 'faixas_etarias_maes.csv'),
+    'households': household_projection.HOUSEHOLD_CSV,
+}
+INDEX = ['mun_id', 'Sexo', 'Faixa Etária']
+MANIFEST = 'pipeline.json'
+
+
+class Stage(NamedTuple):
+    name: str
+    function: Callable[[dict, Dict[str, pd.DataFrame]], pd.DataFrame]
+    inputs: Tuple[str, ...] = tuple()
+    parameters: Tuple[str, ...] = tuple()
+    queries: bool = False # reads the source data, so its fingerprint includes the backend and data_version
+
+
+def load_municipalities(path: str) -> pd.Series:
+    '''
+    Reads a municipality csv such as cod_mun.csv and returns the municipality names indexed by mun_id.
+    '''
+
+    df = pd.read_csv(path, sep=';', encoding='utf-8-sig', index_col='mun_id')
+
+    return df.iloc[:, 0]
+
+
+def _mun_ids(parameters: dict) -> List[int]:
+    return [int(mun_id) for mun_id in load_municipalities(parameters['municipalities']).index]
+
+
+def _with_age_groups(df: pd.DataFrame, dtype: pd.CategoricalDtype) -> pd.DataFrame:
+    # age group labels of different csvs as the same categorical, so tables can be aligned
+    levels = [
+        pd.Categorical(df.index.get_level_values(name).astype(str), dtype=dtype) if name == 'Faixa Etária'
+        else df.index.get_level_values(name) for name in df.index.names
+    ]
+
+    return df.set_axis(pd.MultiIndex.from_arrays(levels, names=df.index.names), axis=0)
+
+
+def _fit_years(df: pd.DataFrame, parameters: dict) -> List[int]:
+    return [year for year in df.columns if parameters['start_year'] <= year <= parameters['rate_end_year']]
+
+
+def _projected_rates(rates: pd.DataFrame, models: Sequence[str], parameters: dict) -> pd.DataFrame:
+    params = trend_models.fit_trend_models(rates, models=models, criterion=parameters['criterion'],
+                                           base_year=parameters['start_year'])
+    years = range(parameters['base_year'], parameters['horizon'])
+
+    return trend_models.project_rates(params, years, base_year=parameters['start_year'])
+
+
+# each stage takes the parameters and the tables of its inputs and returns its table
+
+def _regrouped(df: pd.DataFrame, age_group_csv_path: str, by: List[str], value_column: str) -> pd.DataFrame:
+    return age_groups.regroup(df, [age_group_csv_path], by=by, value_column=value_column)[age_group_csv_path]
+
+
+def census_single_ages(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Census population by municipality, year, sex and age, as a string: single years in 2000 and 2010 and the
+    five-year labels of 2022, the finest published.
+    '''
+
+    mun_ids, project_id = _mun_ids(parameters), parameters['project_id']
+    dfs = [
+        municipality_pop_pyramid.query_total_pop_by_sex_age_2022_batch(mun_ids, project_id).assign(Ano=2022),
+        municipality_pop_pyramid.query_total_pop_by_sex_age_2010_batch(mun_ids, project_id)
+        .rename(columns={'Peso': 'Pop'}).assign(Ano=2010),
+        municipality_pop_pyramid.query_total_pop_by_sex_age_2000_batch(mun_ids, project_id)
+        .rename(columns={'Peso': 'Pop'}).assign(Ano=2000),
+    ]
+    df = pd.concat(dfs, ignore_index=True).astype({'Idade': str})
+
+    return df.groupby(['mun_id', 'Ano', 'Sexo', 'Idade'])[['Pop']].sum()
+
+
+def census_population(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    df = inputs['populacao_idade_simples'].reset_index()
+    census_2022 = (df['Ano'] == 2022).to_numpy()
+    dfs = [
+        _regrouped(df[census_2022], parameters['age_groups_2022'], ['Ano', 'mun_id', 'Sexo'], 'Pop'),
+        _regrouped(df[~census_2022], parameters['age_groups'], ['Ano', 'mun_id', 'Sexo'], 'Pop'),
+    ]
+    dfs = [df.set_index(['Ano', 'mun_id', 'Sexo', 'Faixa Etária']).round(decimals=0).astype(int) for df in dfs]
+
+    return municipality_pop_pyramid.concatenate_treated_dfs_batch(dfs)
+
+
+def intercensal_population(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    years = range(parameters['start_year'], parameters['base_year'] + 1)
+
+    return interpolation.interpolate_population(inputs['populacao_censos'], years=years,
+                                                method=parameters['interpolation_method'])
+
+
+def _single_age_series(source: str, parameters: dict) -> pd.DataFrame:
+    # the local series brought up to date, records without age at the mean age of their municipality
+    mun_ids = _mun_ids(parameters)
+    root = parameters['series_dir'] or incremental.series_dir()
+    incremental.refresh_series(source, mun_ids, parameters['project_id'], start_year=parameters['start_year'],
+                               end_year=parameters['end_year'], root=root)
+    df = incremental.read_series(source, mun_ids, parameters['start_year'], parameters['end_year'], root=root)
+    df = incremental.impute_missing_ages(df, source).dropna(subset=['Idade'])
+    settings = incremental.SOURCES[source]
+    keys = ['mun_id', 'Ano'] + list(settings['columns'].values())
+
+    return df.astype({'mun_id': np.int64, 'Idade': np.int64}).groupby(keys)[[settings['value_name']]].sum()
+
+
+def single_age_deaths(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Deaths by municipality, year, sex and single-year age, deaths of unknown sex left out.
+    '''
+
+    df = _single_age_series('br_ms_sim', parameters).reset_index()
+    df['Sexo'] = df['Sexo'].map({'1': 'Masculino', '2': 'Feminino'})
+
+    return df.dropna(subset=['Sexo']).set_index(['mun_id', 'Ano', 'Sexo', 'Idade'])
+
+
+def single_age_births(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Births by municipality, year and single-year age of the mother.
+    '''
+
+    return _single_age_series('br_ms_sinasc', parameters)
+
+
+def deaths(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    df = _regrouped(inputs['obitos_idade_simples'].reset_index(), parameters['age_groups'], ['mun_id', 'Sexo', 'Ano'],
+                    'Óbitos')
+    df = df.astype({'Óbitos': float}).pivot(index=['mun_id', 'Sexo', 'Faixa Etária'], columns='Ano', values='Óbitos')
+    df.columns.name = None
+
+    return df
+
+
+def births(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    df = _regrouped(inputs['nascimentos_idade_simples'].reset_index(), parameters['age_groups_mothers'],
+                    ['mun_id', 'Ano'], 'Nascimentos')
+    df = df.pivot(index=['mun_id', 'Faixa Etária'], columns='Ano', values='Nascimentos').astype(np.int64)
+    df.columns.name = None
+
+    return df
+
+
+def _observed_birth_rates(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    # births per 1,000 women of the years fitted, by municipality and age group
+    women = inputs['populacao'].xs('Feminino', level='Sexo')
+    df = _with_age_groups(inputs['nascimentos'], women.index.get_level_values('Faixa Etária').dtype)
+
+    years = _fit_years(df, parameters)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = df[years] / women.reindex(df.index)[years] * 1000
+
+    return rates.replace([np.inf, -np.inf], np.nan)
+
+
+def _observed_mortality(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    # deaths per 1,000 inhabitants of the years fitted, by municipality, sex and age group
+    population = inputs['populacao']
+    df = _with_age_groups(inputs['obitos'], population.index.get_level_values('Faixa Etária').dtype)
+
+    years = _fit_years(df, parameters)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = df[years] / population.reindex(df.index)[years] * 1000
+
+    return rates.replace([np.inf, -np.inf], np.nan)
+
+
+def birth_rates(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Projected births per 1,000 women by municipality and age group, 0 out of the reproductive ages.
+    '''
+
+    women = inputs['populacao'].xs('Feminino', level='Sexo')
+    rates = _observed_birth_rates(parameters, inputs)
+
+    return _projected_rates(rates, parameters['birth_models'], parameters).reindex(women.index).fillna(0)
+
+
+def survival_rates(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Projected annual survival rates, 1 - deaths per 1,000 inhabitants / 1,000, by municipality, sex and age group.
+    '''
+
+    rates = _observed_mortality(parameters, inputs)
+    mortality = _projected_rates(rates, parameters['death_models'], parameters).reindex(inputs['populacao'].index)
+
+    return (1 - mortality / 1000).clip(0, 1).fillna(1)
+
+
+def net_migration(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Annual net migrants by municipality, sex and age group, from the 2010 census, or no rows if migration is off.
+    '''
+
+    if not parameters['migration']:
+        index = pd.MultiIndex.from_arrays([[], [], []], names=INDEX)
+        return pd.DataFrame({'Saldo Migratório': pd.Series([], dtype=float)}, index=index)
+
+    matrix = migration_matrix.build_migration_matrix(2010, parameters['project_id'], parameters['age_groups'])
+
+    return (matrix.net_migration(_mun_ids(parameters)) / 5).rename(columns={'Peso': 'Saldo Migratório'})
+
+
+def population_projection(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    base_year = parameters['base_year']
+    population = inputs['populacao'][[base_year]].sort_index()
+    index = population.index
+    women = index[index.get_level_values('Sexo') == 'Feminino'].droplevel('Sexo')
+
+    survival = inputs['taxa_sobrevivencia'].reindex(index).fillna(1)
+    fertility = inputs['taxa_natalidade'].reindex(women).fillna(0)
+    migration = None
+    if len(inputs['saldo_migratorio']):
+        annual = inputs['saldo_migratorio']['Saldo Migratório'].reindex(index).fillna(0).to_numpy()
+        migration = projection.frame_to_array(
+            pd.DataFrame(np.repeat(annual[:, np.newaxis], survival.shape[1], axis=1), index=index), INDEX)
+
+    result = projection.project_population(
+        projection.frame_to_array(population, INDEX)[..., 0], projection.frame_to_array(survival, INDEX),
+        projection.frame_to_array(fertility, ['mun_id', 'Faixa Etária']), migration=migration,
+        base_year=base_year, horizon=parameters['horizon'], step=parameters['step'],
+        age_group_width=parameters['age_group_width'], rate_years=list(survival.columns))
+
+    mun_ids = index.get_level_values('mun_id').unique().sort_values()
+    labels = index.get_level_values('Faixa Etária').unique().sort_values()
+    projected = cube.PopulationCube.from_projection(result, mun_ids, labels.astype(str), base_year=base_year,
+                                                    step=parameters['step'])
+
+    return projected.round().astype(np.int64).to_frame()
+
+
+def regional_projection(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Projected population summed by UF, major region and for all the municipalities of the run (region Total).
+    '''
+
+    mun_ids = _mun_ids(parameters)
+    hierarchy = regions.RegionHierarchy.from_groupings(mun_ids, {'total': pd.Series('Total', index=mun_ids)})
+
+    return hierarchy.rollup(inputs['projecao'])
+
+
+def stochastic_population_projection(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Percentile bands of n_draws projections with fertility and mortality trend parameters and net migration drawn
+    at random, by municipality, sex, age group and year (see stochastic.py).
+    '''
+
+    migration = inputs['saldo_migratorio']['Saldo Migratório'] if len(inputs['saldo_migratorio']) else None
+
+    return stochastic.stochastic_projection(
+        inputs['populacao'][parameters['base_year']], _observed_mortality(parameters, inputs),
+        _observed_birth_rates(parameters, inputs), migration, percentiles=parameters['percentiles'],
+        n_draws=parameters['n_draws'], base_year=parameters['base_year'], horizon=parameters['horizon'],
+        step=parameters['step'], age_group_width=parameters['age_group_width'],
+        death_models=parameters['death_models'], birth_models=parameters['birth_models'],
+        criterion=parameters['criterion'], fit_base_year=parameters['start_year'],
+        migration_sd=parameters['migration_sd'], seed=parameters['seed'])
+
+
+def demographic_indicators(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Life expectancy, crude rates, total fertility, dependency ratios and infant mortality by municipality and year
+    (see indicators.py).
+    '''
+
+    return indicators.indicator_panel(inputs['populacao'], inputs['obitos'], inputs['nascimentos'],
+                                      inputs['obitos_idade_simples'], inputs['nascimentos_idade_simples'])
+
+
+def households(parameters: dict, inputs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    df = inputs['projecao']
+    years = [year for year in df.columns if year > parameters['base_year']]
+    population = df.groupby(level='mun_id').sum().rename_axis('Município')
+    result = household_projection.household_projection(population, years, path=parameters['households'],
+                                                       models=parameters['household_models'],
+                                                       criterion=parameters['criterion'])
+
+    return result[result.index.isin(_mun_ids(parameters))]
+
+
+_RATES = ('start_year', 'rate_end_year', 'base_year', 'horizon', 'criterion')
+
+STAGES: Dict[str, Stage] = {stage.name: stage for stage in [
+    Stage('populacao_idade_simples', census_single_ages, parameters=('municipalities',), queries=True),
+    Stage('obitos_idade_simples', single_age_deaths, parameters=('municipalities', 'start_year', 'end_year'),
+          queries=True),
+    Stage('nascimentos_idade_simples', single_age_births, parameters=('municipalities', 'start_year', 'end_year'),
+          queries=True),
+    Stage('populacao_censos', census_population, ('populacao_idade_simples',), ('age_groups', 'age_groups_2022')),
+    Stage('populacao', intercensal_population, ('populacao_censos',),
+          ('start_year', 'base_year', 'interpolation_method')),
+    Stage('obitos', deaths, ('obitos_idade_simples',), ('age_groups',)),
+    Stage('nascimentos', births, ('nascimentos_idade_simples',), ('age_groups_mothers',)),
+    Stage('taxa_natalidade', birth_rates, ('populacao', 'nascimentos'), _RATES + ('birth_models',)),
+    Stage('taxa_sobrevivencia', survival_rates, ('populacao', 'obitos'), _RATES + ('death_models',)),
+    Stage('saldo_migratorio', net_migration, parameters=('municipalities', 'migration', 'age_groups'), queries=True),
+    Stage('projecao', population_projection, ('populacao', 'taxa_sobrevivencia', 'taxa_natalidade', 'saldo_migratorio'),
+          ('base_year', 'horizon', 'step', 'age_group_width')),
+    Stage('projecao_regioes', regional_projection, ('projecao',), ('municipalities',)),
+    Stage('projecao_estocastica', stochastic_population_projection,
+          ('populacao', 'obitos', 'nascimentos', 'saldo_migratorio'),
+          _RATES + ('birth_models', 'death_models', 'step', 'age_group_width', 'n_draws', 'seed', 'migration_sd',
+                    'percentiles')),
+    Stage('indicadores', demographic_indicators,
+          ('populacao', 'obitos', 'nascimentos', 'obitos_idade_simples', 'nascimentos_idade_simples')),
+    Stage('domicilios', households, ('projecao',),
+          ('municipalities', 'base_year', 'households', 'household_models', 'criterion')),
+]}
+DATA_STAGES = [name for name, stage in STAGES.items() if stage.queries]
+
+
+def upstream(targets: Optional[Sequence[str]] = None) -> List[str]:
+    '''
+    Returns the targets (every stage by default) and all the stages they depend on, inputs before the stages that
+    read them.
+    '''
+
+    targets = list(STAGES) if targets is None else list(targets)
+    unknown = set(targets) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}. Stages are {list(STAGES)}.")
+
+    order = list()
+
+    def visit(name):
+        if name in order:
+            return
+        for input_name in STAGES[name].inputs:
+            visit(input_name)
+        order.append(name)
+
+    for name in targets:
+        visit(name)
+
+    return order
+
+
+def _digest(value):
+    # files are fingerprinted by content, so editing a csv invalidates the stages that read it
+    if isinstance(value, str) and os.path.isfile(value):
+        with open(value, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    return value
+
+
+def fingerprints(parameters: dict, names: Optional[Sequence[str]] = None) -> Dict[str, str]:
+    '''
+    Returns the fingerprint of each stage in names and of the stages upstream of them. Stages that query the source
+    data also hash the identity of the active backend (see query_backend.identity) and data_version, so tables
+    built from other extracts, or from an older release of the data, are not reused.
+    '''
+
+    result = dict()
+    for name in upstream(names):
+        stage = STAGES[name]
+        content = {
+            'stage': name,
+            'parameters': {key: _digest(parameters[key]) for key in stage.parameters},
+            'inputs': {input_name: result[input_name] for input_name in stage.inputs},
+        }
+        if stage.queries:
+            content['data'] = {'backend': query_backend.identity(), 'version': parameters.get('data_version')}
+        result[name] = hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    return result
+
+
+def _manifest_path(root: Optional[str]) -> str:
+    return os.path.join(root or result_store.STORE_DIR, MANIFEST)
+
+
+def load_manifest(root: Optional[str] = None) -> dict:
+    '''
+    Returns the manifest of the store, a dict by region of dicts by stage with the fingerprint of the stored table.
+    '''
+
+    try:
+        with open(_manifest_path(root), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return dict()
+
+
+def _save_manifest(manifest: dict, root: Optional[str]) -> None:
+    os.makedirs(root or result_store.STORE_DIR, exist_ok=True)
+    tmp_path = _manifest_path(root) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, _manifest_path(root))
+
+
+def plan(parameters: Optional[dict] = None, targets: Optional[Sequence[str]] = None, region: str = 'rmc',
+         root: Optional[str] = None, force: Sequence[str] = tuple()) -> pd.DataFrame:
+    '''
+    Returns, for the targets and their upstream stages, the fingerprint and whether the stage would run, because
+    its fingerprint is not in the manifest, its table is missing or it is downstream of a stage in force.
+    '''
+
+    parameters = {**DEFAULT_PARAMETERS, **(parameters or dict())}
+    names = upstream(targets)
+    stage_fingerprints = fingerprints(parameters, names)
+    stored = load_manifest(root).get(region, dict())
+
+    upstream(force) # unknown stage names raise here
+    stale = set(force)
+    rows = list()
+    for name in names:
+        table_path = os.path.join(result_store._partition_dir(name, region, root), 'data.parquet')
+        run = (name in stale or stored.get(name) != stage_fingerprints[name] or not os.path.exists(table_path)
+               or any(input_name in stale for input_name in STAGES[name].inputs))
+        if run:
+            stale.add(name)
+        rows.append({'stage': name, 'fingerprint': stage_fingerprints[name], 'run': run})
+
+    return pd.DataFrame(rows, columns=['stage', 'fingerprint', 'run'])
+
+
+def run_pipeline(parameters: Optional[dict] = None, targets: Optional[Sequence[str]] = None, region: str = 'rmc',
+                 root: Optional[str] = None, force: Sequence[str] = tuple(), max_workers: int = 4,
+                 verbose: bool = True) -> pd.DataFrame:
+    '''
+    Runs the stages needed to bring targets (every stage by default) up to date and returns the plan with the
+    status of each stage ('executado' or 'em cache') and the seconds it took.
+
+    Requires nothing, accepts:
+        -> parameters, values that replace those in DEFAULT_PARAMETERS;
+        -> targets, the stages wanted;
+        -> region, the region the tables are stored under in result_store;
+        -> root, the store directory, result_store.STORE_DIR by default;
+        -> force, stages run again whatever their fingerprint, together with the stages downstream, e.g. DATA_STAGES
+           to query the source data again;
+        -> max_workers, the maximum number of stages running at the same time;
+        -> verbose, if True, prints each stage as it starts and finishes.
+    '''
+
+    parameters = {**DEFAULT_PARAMETERS, **(parameters or dict())}
+    if parameters['series_dir'] is None:
+        parameters['series_dir'] = incremental.series_dir(root)
+    df = plan(parameters, targets, region, root, force)
+    pending = set(df.loc[df['run'], 'stage'])
+    stage_fingerprints = dict(zip(df['stage'], df['fingerprint']))
+    seconds = dict()
+    lock = threading.Lock()
+
+    def execute(name):
+        stage = STAGES[name]
+        start = time.perf_counter()
+        if verbose:
+            print(f'{name}: executando')
+        inputs = {input_name: result_store.read_table(input_name, regions=[region], root=root) for input_name in stage.inputs}
+        result_store.write_table(stage.function(parameters, inputs), stage=name, region=region, root=root)
+        with lock:
+            manifest = load_manifest(root)
+            manifest.setdefault(region, dict())[name] = stage_fingerprints[name]
+            _save_manifest(manifest, root)
+        seconds[name] = time.perf_counter() - start
+        if verbose:
+            print(f'{name}: concluído em {seconds[name]:.1f} s')
+
+    running = dict()
+    done = set(df['stage']) - pending
+    errors = list()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if not errors:
+                for name in sorted(pending):
+                    if all(input_name in done for input_name in STAGES[name].inputs):
+                        running[executor.submit(execute, name)] = name
+                        pending.discard(name)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    errors.append((name, future.exception()))
+                else:
+                    done.add(name)
+
+    if errors:
+        name, error = errors[0]
+        raise RuntimeError(f"Stage {name} failed: {error}") from error
+
+    df['status'] = np.where(df['run'], 'executado', 'em cache')
+    df['seconds'] = df['stage'].map(seconds)
+
+    return df
+
+
+def _parse_value(value: str):
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m br_demography',
+                                     description='Runs the br_demography population projection pipeline.')
+    parser.add_argument('--municipalities', default=None, help='csv with mun_id and mun columns, cod_mun.csv by default')
+    parser.add_argument('--region', default='rmc', help='name the results are stored under')
+    parser.add_argument('--project-id', default=None, help='Google Cloud project id for billing')
+    parser.add_argument('--data-dir', default=None, help='local basedosdados extracts, queried with DuckDB')
+    parser.add_argument('--store', default=None, help=f'result store directory, {result_store.STORE_DIR} by default')
+    parser.add_argument('--stages', nargs='+', default=None, help=f'stages wanted, all by default: {", ".join(STAGES)}')
+    parser.add_argument('--force', nargs='+', default=list(), help='stages run again whatever their fingerprint')
+    parser.add_argument('--refresh-data', action='store_true',
+                        help=f'query the source data again, forcing {", ".join(DATA_STAGES)}')
+    parser.add_argument('--data-version', default=None, help='label of the source data release, e.g. 2024-06')
+    parser.add_argument('--set', nargs='+', default=list(), metavar='KEY=VALUE',
+                        help='parameters, e.g. horizon=2052 migration=true \'death_models=["Linear"]\'')
+    parser.add_argument('--jobs', type=int, default=4, help='stages running at the same time')
+    parser.add_argument('--plan', action='store_true', help='only show which stages would run')
+    args = parser.parse_args(argv)
+
+    parameters = dict()
+    for item in args.set:
+        key, _, value = item.partition('=')
+        if key not in DEFAULT_PARAMETERS:
+            parser.error(f"unknown parameter {key}, parameters are {', '.join(DEFAULT_PARAMETERS)}")
+        parameters[key] = _parse_value(value)
+    if args.municipalities is not None:
+        parameters['municipalities'] = args.municipalities
+    if args.project_id is not None:
+        parameters['project_id'] = args.project_id
+    if args.data_version is not None:
+        parameters['data_version'] = args.data_version
+    if args.data_dir is not None:
+        query_backend.set_backend(query_backend.DuckDBBackend(args.data_dir))
+    force = list(args.force) + (DATA_STAGES if args.refresh_data else list())
+
+    if args.plan:
+        df = plan(parameters, args.stages, args.region, args.store, force)
+    else:
+        df = run_pipeline(parameters, args.stages, args.region, args.store, force, max_workers=args.jobs)
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(df.drop(columns='fingerprint'))
+
+
+if __name__ == '__main__':
+    main()
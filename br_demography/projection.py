@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Sequence
+
+
+### Cohort-component population projection for many municipalities at once. It reproduces the steps of
+### notebooks/pdui/5_projecao_populacional.ipynb (births from female population and fertility rates, survival of
+### each cohort to the next age group, net migration) with arrays shaped (municipality, sex, age group, year), so
+### every municipality advances in the same NumPy operation.
+
+SEXES = ['Feminino', 'Masculino'] # sex order used in the arrays, the same order standard_age_groups returns
+MALE_SHARE_AT_BIRTH = 0.51 # share of male births used in the projection notebook
+
+
+def frame_to_array(df: pd.DataFrame, index: List[str]) -> np.ndarray:
+    '''
+    Takes a DataFrame indexed by the columns in index (e.g. ['Município', 'Sexo', 'Faixa Etária']) with one column per
+    year, as the tables in results/tab, and returns a dense array shaped (len(level) for each index level) x years.
+    Levels are sorted, so Faixa Etária must be an ordered categorical. Missing combinations receive 0.
+    '''
+
+    levels = [df.index.get_level_values(name).unique().sort_values() for name in index]
+    new_index = pd.MultiIndex.from_product(levels, names=index)
+    values = df.reindex(new_index).fillna(0).to_numpy(dtype=float)
+
+    return values.reshape(tuple(len(level) for level in levels) + (df.shape[1],))
+
+
+def leslie_promotion_matrix(n_age_groups: int, step: int, age_group_width: int) -> np.ndarray:
+    '''
+    Returns the (n_age_groups, n_age_groups) matrix that moves survivors between age groups in a projection step.
+    A share step / age_group_width of each age group moves to the next one, the rest stays, and the last, open age
+    group keeps all its survivors. With step equal to age_group_width, every cohort moves one age group up.
+    '''
+
+    if step > age_group_width:
+        raise ValueError("step cannot be greater than age_group_width.")
+
+    share = step / age_group_width
+    matrix = np.diag(np.full(n_age_groups, 1 - share))
+    matrix[np.arange(1, n_age_groups), np.arange(n_age_groups - 1)] = share
+    matrix[-1, -1] = 1.0
+
+    return matrix
+
+
+def project_population(population: np.ndarray, survival: np.ndarray, fertility: np.ndarray,
+                       migration: Optional[np.ndarray] = None, base_year: int = 2022, horizon: int = 2042,
+                       step: int = 10, age_group_width: int = 10, rate_years: Optional[Sequence[int]] = None,
+                       male_share: float = MALE_SHARE_AT_BIRTH, female_index: int = 0) -> np.ndarray:
+    '''
+    Projects the population of every municipality from base_year to horizon in steps of step years and returns an
+    array shaped (municipality, sex, age group, projected year), the first year being base_year.
+
+    Requires:
+        -> population, array (municipality, sex, age group) with the population in base_year;
+        -> survival, array (municipality, sex, age group, year) with annual survival rates (1 - deaths / population);
+        -> fertility, array (municipality, age group, year) with annual births per 1,000 women of each age group,
+           0 for age groups out of the reproductive ages;
+        -> migration, optional array (municipality, sex, age group, year) with annual net migrants;
+        -> base_year and horizon, the first and last year of the projection, horizon - base_year must be a multiple
+           of step;
+        -> step, the length in years of each projection step, at most age_group_width;
+        -> rate_years, the years of the last axis of the rate arrays, base_year onwards by default;
+        -> male_share, the share of male births;
+        -> female_index, position of Feminino in the sex axis.
+
+    In each step, survivors are population times the product of the annual survival rates, moved between age groups
+    by leslie_promotion_matrix; births are female population times the mean fertility rate of the step, split by sex
+    into the first age group; net migrants of the step are added at the end. Memory use is about 8 bytes times
+    municipality x sex x age group x (years + steps).
+    '''
+
+    population = np.asarray(population, dtype=float)
+    survival = np.asarray(survival, dtype=float)
+    fertility = np.asarray(fertility, dtype=float)
+
+    if population.ndim != 3:
+        raise ValueError("population should be shaped (municipality, sex, age group).")
+    if survival.shape[:3] != population.shape:
+        raise ValueError("survival should be shaped (municipality, sex, age group, year) as population.")
+    if fertility.shape[:2] != (population.shape[0], population.shape[2]):
+        raise ValueError("fertility should be shaped (municipality, age group, year).")
+    if not isinstance(step, int) or step <= 0:
+        raise ValueError("step should be a positive integer.")
+    if horizon < base_year or (horizon - base_year) % step != 0:
+        raise ValueError("horizon - base_year should be a non-negative multiple of step.")
+
+    if rate_years is None:
+        rate_years = np.arange(base_year, base_year + survival.shape[-1])
+    if migration is not None:
+        migration = np.asarray(migration, dtype=float)
+        if migration.shape[:3] != population.shape:
+            raise ValueError("migration should be shaped (municipality, sex, age group, year) as population.")
+
+    promotion = leslie_promotion_matrix(population.shape[2], step, age_group_width)
+    sex_share = np.where(np.arange(population.shape[1]) == female_index, 1 - male_share, male_share)
+
+    n_steps = (horizon - base_year) // step
+    result = np.empty(population.shape + (n_steps + 1,))
+    result[..., 0] = population
+
+    current = population
+    for i in range(n_steps):
+        start = base_year + i * step
+        years = pd.Index(rate_years).get_indexer(np.arange(start, start + step))
+        if np.any(years < 0):
+            raise ValueError(f"Rates are missing for some year between {start} and {start + step - 1}.")
+
+        survivors = (current * survival[..., years].prod(axis=-1)) @ promotion.T
+
+        births = (current[:, female_index, :] * fertility[..., years].mean(axis=-1) / 1000 * step).sum(axis=-1)
+        survivors[:, :, 0] += births[:, np.newaxis] * sex_share
+
+        if migration is not None:
+            survivors += migration[..., years].sum(axis=-1)
+
+        current = survivors
+        result[..., i + 1] = current
+
+    return result
+
+
+def projection_to_frame(result: np.ndarray, mun_ids: Sequence, age_groups: Sequence, base_year: int = 2022,
+                        step: int = 10, sexes: Sequence[str] = SEXES, value_name: str = 'População') -> pd.DataFrame:
+    '''
+    Takes the array returned by project_population and returns a tidy DataFrame with the columns Município, Sexo,
+    Faixa Etária (ordered categorical), Ano and value_name.
+    '''
+
+    years = base_year + step * np.arange(result.shape[-1])
+    index = pd.MultiIndex.from_product(
+        [list(mun_ids), list(sexes), pd.CategoricalIndex(age_groups, categories=age_groups, ordered=True), years],
+        names=['Município', 'Sexo', 'Faixa Etária', 'Ano']
+        )
+
+    return pd.DataFrame({value_name: result.ravel()}, index=index).reset_index()
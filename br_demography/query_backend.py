@@ -0,0 +1,216 @@
+import pandas as pd
+import glob
+import hashlib
+import os
+from typing import Dict, Optional
+
+
+### Query functions never hard-code where a table lives. They write the logical basedosdados table id, e.g.
+### table('br_ms_sim.microdados'), and the active backend turns it into something its engine can read: the
+### BigQuery table for BigQueryBackend, or a read_parquet() over local extracts for DuckDBBackend.
+
+# logical table ids used by the package, with the columns each query relies on
+TABLES = {
+    'br_ms_sim.microdados': ['ano', 'sexo', 'idade', 'id_municipio_residencia', 'tipo_obito'],
+    'br_ms_sinasc.microdados': ['ano', 'idade_mae', 'id_municipio_residencia'],
+    'br_ibge_censo_demografico.microdados_pessoa_2000': ['id_municipio', 'v0401', 'v4752', 'p001', 'v4250', 'v0424'],
+    'br_ibge_censo_demografico.microdados_pessoa_2010': ['id_municipio', 'v0601', 'v6036', 'peso_amostral', 'v6264'],
+    'br_ibge_censo_2022.populacao_residente_municipio': ['id_municipio', 'sexo', 'grupo_idade', 'populacao_residente'],
+    'br_ibge_censo_2022.domicilio_morador_municipio': ['id_municipio', 'moradores', 'domicilios'],
+}
+
+
+class BigQueryBackend:
+    '''
+    Runs queries on Google BigQuery through basedosdados. This is the default backend.
+    '''
+
+    name = 'bigquery'
+    cacheable = True
+
+    def __init__(self, project: str = 'basedosdados'):
+        self.project = project
+
+    def table_ref(self, table_id: str) -> str:
+        return f'`{self.project}.{table_id}`'
+
+    def identity(self) -> str:
+        '''
+        Returns what the results of this backend depend on, the project the tables are read from.
+        '''
+
+        return f'{self.name}:{self.project}'
+
+    def read_sql(self, query: str, billing_project_id: str) -> pd.DataFrame:
+        import basedosdados as bd
+
+        return bd.read_sql(query=query, billing_project_id=billing_project_id)
+
+    def estimate_bytes(self, query: str, billing_project_id: str) -> int:
+        '''
+        Returns the bytes BigQuery would process to run query, using a dry run, which is not billed.
+        '''
+
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=billing_project_id)
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+
+        return client.query(query, job_config=job_config).total_bytes_processed
+
+    def read_batches(self, query: str, billing_project_id: str, batch_size: int = 100000):
+        '''
+        Runs query and yields its result as pyarrow RecordBatches of about batch_size rows, downloaded page by page.
+        '''
+
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=billing_project_id)
+        rows = client.query(query).result(page_size=batch_size)
+
+        yield from rows.to_arrow_iterable()
+
+
+class DuckDBBackend:
+    '''
+    Runs the same queries with DuckDB over local Parquet extracts of the basedosdados tables.
+
+    By default, table 'dataset.table' is read from data_dir/dataset/table/*.parquet. Tables stored elsewhere can be
+    given in the tables dict, mapping the logical table id to a file, a glob or a directory. Column names and types
+    must be the same as in basedosdados (e.g. id_municipio and sexo as strings).
+    '''
+
+    name = 'duckdb'
+    cacheable = False
+
+    def __init__(self, data_dir: str, tables: Optional[Dict[str, str]] = None, threads: Optional[int] = None):
+        self.data_dir = data_dir
+        self.tables = dict(tables or dict())
+        self.threads = threads
+
+    def register_table(self, table_id: str, path: str) -> None:
+        self.tables[table_id] = path
+
+    def table_path(self, table_id: str) -> str:
+        path = self.tables.get(table_id, os.path.join(self.data_dir, *table_id.split('.')))
+        if os.path.isdir(path):
+            path = os.path.join(path, '**', '*.parquet')
+
+        return path
+
+    def table_ref(self, table_id: str) -> str:
+        path = self.table_path(table_id).replace("'", "''")
+
+        return f"read_parquet('{path}', hive_partitioning = true, union_by_name = true)"
+
+    def identity(self) -> str:
+        '''
+        Returns what the results of this backend depend on: the extracts of the tables in TABLES, by path, size and
+        modification time, so replacing an extract changes it.
+        '''
+
+        digest = hashlib.sha256()
+        for table_id in sorted(TABLES):
+            path = self.table_path(table_id)
+            for file in sorted(glob.glob(path, recursive=True)):
+                status = os.stat(file)
+                digest.update(f'{os.path.abspath(file)}:{status.st_size}:{status.st_mtime_ns};'.encode('utf-8'))
+
+        return f'{self.name}:{os.path.abspath(self.data_dir)}:{digest.hexdigest()[:16]}'
+
+    def connect(self):
+        import duckdb
+
+        con = duckdb.connect()
+        if self.threads is not None:
+            con.execute(f'SET threads TO {int(self.threads)}')
+
+        return con
+
+    def read_sql(self, query: str, billing_project_id: Optional[str] = None) -> pd.DataFrame:
+        con = self.connect()
+        try:
+            return con.execute(query).df()
+        finally:
+            con.close()
+
+    def read_batches(self, query: str, billing_project_id: Optional[str] = None, batch_size: int = 100000):
+        '''
+        Runs query and yields its result as pyarrow RecordBatches of at most batch_size rows.
+        '''
+
+        con = self.connect()
+        try:
+            reader = con.execute(query).fetch_record_batch(batch_size)
+            for batch in reader:
+                yield batch
+        finally:
+            con.close()
+
+
+_backend = None
+
+
+def set_backend(backend) -> None:
+    '''
+    Sets the backend used by every query function, e.g. set_backend(DuckDBBackend('/data/basedosdados')).
+    '''
+
+    global _backend
+
+    _backend = backend
+
+
+def get_backend():
+    '''
+    Returns the active backend. When none was set, BR_DEMOGRAPHY_BACKEND=duckdb together with
+    BR_DEMOGRAPHY_DATA_DIR selects DuckDBBackend, otherwise BigQueryBackend is used.
+    '''
+
+    global _backend
+
+    if _backend is None:
+        if os.getenv('BR_DEMOGRAPHY_BACKEND', 'bigquery').lower() == 'duckdb':
+            _backend = DuckDBBackend(data_dir=os.getenv('BR_DEMOGRAPHY_DATA_DIR', '.'))
+        else:
+            _backend = BigQueryBackend()
+
+    return _backend
+
+
+def table(table_id: str) -> str:
+    '''
+    Returns the reference of a logical table id, e.g. 'br_ms_sim.microdados', to be placed in the FROM clause of
+    a query for the active backend.
+    '''
+
+    if table_id not in TABLES:
+        raise ValueError(f"Unknown table {table_id}. Register it in query_backend.TABLES.")
+
+    return get_backend().table_ref(table_id)
+
+
+def identity() -> str:
+    '''
+    Returns the identity of the active backend, e.g. 'bigquery:basedosdados' or 'duckdb:<data_dir>:<digest of the
+    extracts>', so results computed with different backends or data are told apart.
+    '''
+
+    return get_backend().identity()
+
+
+def read_sql(query: str, billing_project_id: str) -> pd.DataFrame:
+    '''
+    Runs a query on the active backend.
+    '''
+
+    return get_backend().read_sql(query=query, billing_project_id=billing_project_id)
+
+
+def read_batches(query: str, billing_project_id: str, batch_size: int = 100000):
+    '''
+    Runs a query on the active backend and yields its result as pyarrow RecordBatches, so results larger than memory
+    can be aggregated batch by batch.
+    '''
+
+    return get_backend().read_batches(query=query, billing_project_id=billing_project_id, batch_size=batch_size)
@@ -0,0 +1,277 @@
+from . import instrumentation, query_backend
+import pandas as pd
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import warnings
+from typing import Dict, Optional
+
+
+### Every query in the package goes through read_sql below instead of calling the backend directly, so results
+### already downloaded from BigQuery are reused across notebook runs. Results are stored as Parquet files under
+### CACHE_DIR, with an index.json file keeping size and access times for LRU eviction.
+
+CACHE_DIR = os.getenv('BR_DEMOGRAPHY_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'br_demography'))
+MAX_CACHE_BYTES = int(os.getenv('BR_DEMOGRAPHY_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+OFFLINE = os.getenv('BR_DEMOGRAPHY_CACHE_OFFLINE', '0') == '1'
+ENABLED = os.getenv('BR_DEMOGRAPHY_CACHE_ENABLED', '1') == '1'
+
+# time to live in seconds by data source, None means the cached result never expires
+SOURCE_TTL = {
+    'br_ibge_censo': None,
+    'br_ms_sim': 30 * 24 * 60 * 60,
+    'br_ms_sinasc': 30 * 24 * 60 * 60,
+}
+DEFAULT_TTL = None
+
+
+
+class OfflineCacheMissError(LookupError):
+    '''
+    Raised when a query result is not in the cache and offline mode is on.
+    '''
+
+
+# errors query functions must let through, instead of printing them and returning None
+PROPAGATED_ERRORS = (instrumentation.BudgetExceededError, OfflineCacheMissError)
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+
+def configure(cache_dir: Optional[str] = None, max_bytes: Optional[int] = None, offline: Optional[bool] = None,
+              enabled: Optional[bool] = None, source_ttl: Optional[Dict[str, Optional[int]]] = None) -> None:
+    '''
+    Changes the cache settings for the current session. Arguments left as None keep their current values.
+
+    Requires nothing, accepts:
+        -> cache_dir, the directory where Parquet files and the index are stored;
+        -> max_bytes, the maximum size of the cache before least recently used results are evicted;
+        -> offline, if True, queries are answered only from the cache and a miss raises OfflineCacheMissError;
+        -> enabled, if False, read_sql goes straight to the query backend;
+        -> source_ttl, a dict which updates time to live in seconds by data source, e.g. {'br_ms_sim': 86400}.
+    '''
+
+    global CACHE_DIR, MAX_CACHE_BYTES, OFFLINE, ENABLED
+
+    if cache_dir is not None:
+        CACHE_DIR = cache_dir
+    if max_bytes is not None:
+        if not isinstance(max_bytes, int) or max_bytes < 0:
+            raise ValueError("max_bytes should be a non-negative integer.")
+        MAX_CACHE_BYTES = max_bytes
+    if offline is not None:
+        OFFLINE = offline
+    if enabled is not None:
+        ENABLED = enabled
+    if source_ttl is not None:
+        SOURCE_TTL.update(source_ttl)
+
+
+def normalize_sql(query: str) -> str:
+    '''
+    Returns the query with comments removed and whitespace collapsed, so the same query written with different
+    indentation maps to the same cache entry.
+    '''
+
+    query = re.sub(r'--[^\n]*', ' ', query)
+    query = re.sub(r'\s+', ' ', query).strip()
+
+    return query.rstrip(';').strip()
+
+
+def cache_key(query: str, billing_project_id: str) -> str:
+    '''
+    Returns the key of a query in the cache, a hash of the normalized SQL and the billing project.
+    '''
+
+    content = f'{billing_project_id}\n{normalize_sql(query)}'
+
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def query_ttl(query: str) -> Optional[int]:
+    '''
+    Returns the time to live, in seconds, for the result of a query, according to the data sources it reads.
+    When a query reads more than one source, the shortest time to live is used.
+    '''
+
+    ttls = [ttl for source, ttl in SOURCE_TTL.items() if source in query]
+    if not ttls:
+        return DEFAULT_TTL
+    if any(ttl is not None for ttl in ttls):
+        return min(ttl for ttl in ttls if ttl is not None)
+
+    return None
+
+
+def _index_path() -> str:
+    return os.path.join(CACHE_DIR, 'index.json')
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f'{key}.parquet')
+
+
+def _load_index() -> dict:
+    try:
+        with open(_index_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return dict()
+
+
+def _save_index(index: dict) -> None:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = _index_path() + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, _index_path())
+
+
+def _remove_entry(index: dict, key: str) -> None:
+    index.pop(key, None)
+    try:
+        os.remove(_entry_path(key))
+    except FileNotFoundError:
+        pass
+
+
+def _evict(index: dict) -> None:
+    total = sum(entry['size'] for entry in index.values())
+    for key in sorted(index, key=lambda k: index[k]['last_access']):
+        if total <= MAX_CACHE_BYTES:
+            break
+        total -= index[key]['size']
+        _remove_entry(index, key)
+        _stats['evictions'] += 1
+
+
+def _read_cached(key: str) -> Optional[pd.DataFrame]:
+    with _lock:
+        index = _load_index()
+        entry = index.get(key)
+        if entry is None:
+            return None
+        if entry['expires'] is not None and entry['expires'] < time.time() and not OFFLINE:
+            _remove_entry(index, key)
+            _save_index(index)
+            _stats['expired'] += 1
+            return None
+        try:
+            df = pd.read_parquet(_entry_path(key))
+        except (FileNotFoundError, OSError):
+            _remove_entry(index, key)
+            _save_index(index)
+            return None
+        entry['last_access'] = time.time()
+        entry['hits'] += 1
+        _save_index(index)
+
+    return df
+
+
+def _write_cached(key: str, query: str, df: pd.DataFrame) -> None:
+    with _lock:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(_entry_path(key), index=False)
+        ttl = query_ttl(query)
+        now = time.time()
+        index = _load_index()
+        index[key] = {
+            'query': normalize_sql(query),
+            'size': os.path.getsize(_entry_path(key)),
+            'created': now,
+            'last_access': now,
+            'expires': None if ttl is None else now + ttl,
+            'hits': 0,
+        }
+        _evict(index)
+        _save_index(index)
+
+
+def read_sql(query: str, billing_project_id: str, use_cache: bool = True) -> pd.DataFrame:
+    '''
+    Runs a query on the active query backend, answering from the on-disk cache when the same query, for the same
+    billing project, was already run and its result has not expired. Backends reading local files are not cached.
+    Queries sent to the backend go through instrumentation.execute, which checks the byte budget of the run. A
+    result which cannot be written to the cache is returned all the same, with a warning.
+
+    Requires:
+        -> query, the SQL query;
+        -> billing_project_id, the Google Cloud project id for billing;
+        -> use_cache, False to run the query even when its result is cached, replacing the cached entry. In offline
+           mode the cache is still read, as the backend cannot be.
+    '''
+
+    backend = query_backend.get_backend()
+    if not ENABLED or not backend.cacheable:
+        return instrumentation.execute(backend=backend, query=query, billing_project_id=billing_project_id)
+
+    key = cache_key(query, billing_project_id)
+    start = time.perf_counter()
+    df = _read_cached(key) if use_cache or OFFLINE else None
+    with _lock:
+        _stats['hits' if df is not None else 'misses'] += 1
+    if df is not None:
+        instrumentation.record_cache_hit(query=query, backend=backend.name, df=df, seconds=time.perf_counter() - start)
+        return df
+
+    if OFFLINE:
+        raise OfflineCacheMissError("Query result is not in the cache and offline mode is on.")
+
+    import pyarrow
+
+    df = instrumentation.execute(backend=backend, query=query, billing_project_id=billing_project_id)
+    try:
+        _write_cached(key, query, df)
+    except (OSError, pyarrow.ArrowException) as e: # the query ran and was billed, its result is still returned
+        warnings.warn(f'Query result could not be cached: {e}')
+
+    return df
+
+
+def cache_stats() -> dict:
+    '''
+    Returns a dict with hits, misses, expired entries and evictions since the session started (or since reset_stats),
+    plus the number of entries and the size in bytes currently in the cache.
+    '''
+
+    with _lock:
+        index = _load_index()
+        stats = dict(_stats)
+    stats['entries'] = len(index)
+    stats['size'] = sum(entry['size'] for entry in index.values())
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+
+    return stats
+
+
+def reset_stats() -> None:
+    '''
+    Sets hit, miss, expiration and eviction counters back to zero.
+    '''
+
+    with _lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def clear_cache(source: Optional[str] = None) -> int:
+    '''
+    Removes cached results and returns how many entries were removed. If source is given, e.g. 'br_ms_sim', only
+    results of queries reading that source are removed.
+    '''
+
+    with _lock:
+        index = _load_index()
+        keys = [key for key, entry in index.items() if source is None or source in entry['query']]
+        for key in keys:
+            _remove_entry(index, key)
+        _save_index(index)
+
+    return len(keys)
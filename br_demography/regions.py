@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+import os
+from functools import lru_cache
+from scipy import sparse
+from typing import Dict, Mapping, Optional, Sequence, Union
+
+
+### Regional totals from municipality results. Municipality ids carry the state (UF, first two figures) and the
+### major region (first figure), and custom groupings, such as the municipalities of the RMC in cod_mun.csv or
+### planning regions given as a mun_id -> region table, are registered by name. RegionHierarchy holds one sparse
+### (region, municipality) membership matrix per level, and rollup sums any table indexed by mun_id into every
+### region of every level with a single sparse product, so regional figures never query the data again.
+
+SOURCE_TAB = os.path.join(os.path.dirname(__file__), 'source', 'tab')
+
+UFS = {
+    11: 'RO', 12: 'AC', 13: 'AM', 14: 'RR', 15: 'PA', 16: 'AP', 17: 'TO',
+    21: 'MA', 22: 'PI', 23: 'CE', 24: 'RN', 25: 'PB', 26: 'PE', 27: 'AL', 28: 'SE', 29: 'BA',
+    31: 'MG', 32: 'ES', 33: 'RJ', 35: 'SP',
+    41: 'PR', 42: 'SC', 43: 'RS',
+    50: 'MS', 51: 'MT', 52: 'GO', 53: 'DF',
+}
+MAJOR_REGIONS = {1: 'Norte', 2: 'Nordeste', 3: 'Sudeste', 4: 'Sul', 5: 'Centro-Oeste'}
+
+# custom groupings that can be given by name, see register_grouping
+GROUPINGS = {
+    'rmc': os.path.join(SOURCE_TAB, 'cod_mun.csv'),
+}
+
+
+def register_grouping(name: str, grouping: Union[str, Sequence, Mapping]) -> None:
+    '''
+    Registers a custom grouping of municipalities under name, so it can be used as a level of RegionHierarchy.
+    grouping is either a csv, see load_grouping, a list of mun_ids, taken as a single region named name, or a dict
+    mapping mun_id to region.
+    '''
+
+    if isinstance(grouping, str) and not os.path.isfile(grouping):
+        raise ValueError(f"{grouping} is not a file.")
+    GROUPINGS[name] = grouping
+    _hierarchy.cache_clear()
+
+
+def load_grouping(name: str, column: Optional[str] = None) -> pd.Series:
+    '''
+    Returns a registered grouping as a Series of region names indexed by mun_id. A csv grouping, semi-colon
+    separated with a mun_id column, maps each municipality to the region in column, or, without column, puts every
+    municipality of the csv in a single region named name.
+    '''
+
+    if name not in GROUPINGS:
+        raise ValueError(f"Unknown grouping {name}. Groupings are {list(GROUPINGS)}, see register_grouping.")
+    grouping = GROUPINGS[name]
+
+    if isinstance(grouping, str):
+        df = pd.read_csv(grouping, sep=';', encoding='utf-8-sig')
+        regions = df[column].astype(str).to_numpy() if column is not None else name
+        return pd.Series(regions, index=df['mun_id'].astype(np.int64).to_numpy(), name=name)
+    if isinstance(grouping, (Mapping, pd.Series)):
+        return pd.Series({int(mun_id): str(region) for mun_id, region in grouping.items()}, name=name)
+
+    return pd.Series(name, index=[int(mun_id) for mun_id in grouping], name=name)
+
+
+def uf_codes(mun_ids: Sequence) -> np.ndarray:
+    '''
+    Returns the two-figures state (UF) code of each seven-figures (or six-figures) municipality id.
+    '''
+
+    mun_ids = np.asarray(mun_ids, dtype=np.int64)
+
+    return np.where(mun_ids >= 1000000, mun_ids // 100000, mun_ids // 10000)
+
+
+class RegionHierarchy:
+    '''
+    Membership of municipalities in the regions of each level: 'uf', 'regiao' (the major regions) and every
+    custom grouping given. membership[level] is a sparse (region, municipality) matrix with a 1 where the
+    municipality belongs to the region, regions[level] the region names and mun_ids the municipalities, in the order
+    of the columns. Municipalities may belong to no region or, in custom groupings, to several.
+    '''
+
+    def __init__(self, mun_ids: Sequence, regions: Dict[str, np.ndarray], membership: Dict[str, sparse.csr_matrix]):
+        self.mun_ids = np.asarray(mun_ids, dtype=np.int64)
+        self.regions = regions
+        self.membership = membership
+        self.levels = list(membership)
+        self._positions = pd.Index(self.mun_ids)
+
+    @classmethod
+    def from_groupings(cls, mun_ids: Sequence, groupings: Optional[Dict[str, pd.Series]] = None) -> 'RegionHierarchy':
+        '''
+        Builds the hierarchy of mun_ids with the IBGE levels, from the municipality ids, plus one level per
+        grouping, a Series of region names indexed by mun_id as returned by load_grouping.
+        '''
+
+        mun_ids = np.unique(np.asarray(mun_ids, dtype=np.int64))
+        ufs = uf_codes(mun_ids)
+        levels = {
+            'uf': pd.Series(ufs).map(UFS).to_numpy(dtype=object),
+            'regiao': pd.Series(ufs // 10).map(MAJOR_REGIONS).to_numpy(dtype=object),
+        }
+        positions = pd.Index(mun_ids)
+
+        regions, membership = dict(), dict()
+        for level, labels in levels.items():
+            known = pd.notna(labels)
+            codes, uniques = pd.factorize(labels[known], sort=True)
+            regions[level] = np.asarray(uniques, dtype=object)
+            membership[level] = sparse.csr_matrix(
+                (np.ones(len(codes)), (codes, np.flatnonzero(known))), shape=(len(uniques), len(mun_ids))
+                )
+
+        for level, grouping in (groupings or dict()).items():
+            cols = positions.get_indexer(grouping.index)
+            found = cols >= 0 # municipalities of the grouping out of mun_ids are ignored
+            codes, uniques = pd.factorize(grouping.to_numpy()[found], sort=True)
+            regions[level] = np.asarray(uniques, dtype=object)
+            membership[level] = sparse.csr_matrix(
+                (np.ones(len(codes)), (codes, cols[found])), shape=(len(uniques), len(mun_ids))
+                )
+            membership[level].data[:] = 1 # a municipality listed twice in the same region counts once
+
+        return cls(mun_ids=mun_ids, regions=regions, membership=membership)
+
+    def members(self, level: str, region: str) -> np.ndarray:
+        '''
+        Returns the mun_ids of a region of a level.
+        '''
+
+        if level not in self.membership:
+            raise ValueError(f"level should be one of {self.levels}.")
+        row = np.flatnonzero(self.regions[level] == region)
+        if len(row) == 0:
+            raise ValueError(f"{region} is not a region of {level}.")
+
+        return self.mun_ids[self.membership[level][row[0]].indices]
+
+    def rollup(self, df: pd.DataFrame, levels: Optional[Sequence[str]] = None, on: str = 'mun_id') -> pd.DataFrame:
+        '''
+        Takes a municipality table, with the municipality ids in the index level (or column) on, other index levels
+        such as Sexo and Faixa Etária, and numeric columns such as years, and returns the sums by region, indexed by
+        Nível, Região and the other index levels, for every level in levels (all by default). Missing values are
+        skipped, and a sum is NaN only when every municipality of the region is missing. Sums of integer columns are
+        integers, nullable when some are missing. Rows of municipalities out of the hierarchy are ignored.
+        '''
+
+        levels = self.levels if levels is None else list(levels)
+        unknown = set(levels) - set(self.membership)
+        if unknown:
+            raise ValueError(f"Unknown levels {sorted(unknown)}. Levels are {self.levels}.")
+        if on in df.columns:
+            df = df.set_index(on, append=any(name is not None for name in df.index.names))
+        if on not in df.index.names:
+            raise ValueError(f"{on} is neither a column nor an index level of df.")
+
+        others = [name for name in df.index.names if name != on]
+        cols = self._positions.get_indexer(df.index.get_level_values(on).astype(np.int64))
+        if others:
+            rest_codes, rest = pd.factorize(df.index.droplevel(on), sort=True)
+        else:
+            rest_codes, rest = np.zeros(len(df), dtype=np.int64), None
+        n_rest = len(rest) if rest is not None else 1
+
+        # one (region and other keys, row of df) matrix for all levels, built from the membership of each row
+        stacked = sparse.vstack([self.membership[level] for level in levels]).tocsc()
+        found = np.flatnonzero(cols >= 0)
+        rows = stacked[:, cols[found]].tocoo()
+        n_regions = stacked.shape[0]
+        operator = sparse.csr_matrix(
+            (rows.data, (rows.row * n_rest + rest_codes[found][rows.col], found[rows.col])),
+            shape=(n_regions * n_rest, len(df))
+            )
+
+        values = df.to_numpy(dtype=float, na_value=np.nan)
+        present = ~np.isnan(values)
+        membership = operator.copy()
+        membership.data = np.ones_like(membership.data)
+        counts = membership @ present.astype(float) # non-missing values summed into each cell
+        values = operator @ np.where(present, values, 0)
+        values[counts == 0] = np.nan
+        used = np.asarray(operator.sum(axis=1)).ravel() > 0 # regions and keys with at least one row
+
+        level_names = np.concatenate([np.repeat(level, len(self.regions[level])) for level in levels])
+        region_names = np.concatenate([self.regions[level] for level in levels])
+        region_codes, rest_positions = np.divmod(np.flatnonzero(used), n_rest)
+        arrays = [level_names[region_codes], region_names[region_codes]]
+        if rest is not None:
+            rest_index = rest[rest_positions]
+            arrays += [rest_index.get_level_values(i) for i in range(rest_index.nlevels)]
+        index = pd.MultiIndex.from_arrays(arrays, names=['Nível', 'Região'] + others)
+
+        result = pd.DataFrame(values[used], index=index, columns=df.columns)
+        integers = [column for column in df.columns if pd.api.types.is_integer_dtype(df[column])]
+
+        return result.astype({
+            column: 'Int64' if result[column].isna().any() else np.int64 for column in integers
+            })
+
+
+@lru_cache(maxsize=None)
+def _hierarchy(mun_ids: tuple, groupings: tuple) -> RegionHierarchy:
+    return RegionHierarchy.from_groupings(mun_ids, {name: load_grouping(name) for name in groupings})
+
+
+def hierarchy(mun_ids: Sequence, groupings: Sequence[str] = ('rmc',)) -> RegionHierarchy:
+    '''
+    Returns the RegionHierarchy of mun_ids with the registered groupings in groupings as custom levels. Hierarchies
+    are built once per municipalities and groupings.
+    '''
+
+    return _hierarchy(tuple(sorted(int(mun_id) for mun_id in mun_ids)), tuple(groupings))
+
+
+def rollup(df: pd.DataFrame, levels: Optional[Sequence[str]] = None, groupings: Sequence[str] = ('rmc',),
+           on: str = 'mun_id') -> pd.DataFrame:
+    '''
+    Sums a municipality table into the regions of levels ('uf', 'regiao' and the groupings, all by default), see
+    RegionHierarchy.rollup.
+    '''
+
+    mun_ids = (df[on] if on in df.columns else df.index.get_level_values(on)).unique()
+
+    return hierarchy(mun_ids, groupings).rollup(df, levels=levels, on=on)
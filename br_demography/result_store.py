@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import re
+from typing import List, Optional, Sequence
+
+
+### Stores intermediate and final tables (deaths, births, rates, projections) as Parquet instead of UTF-16,
+### semicolon separated CSVs. Tables are kept under STORE_DIR/stage=<stage>/region=<region>/data.parquet with
+### Sexo and Faixa Etária as categoricals, year columns as integers and the smallest integer types that fit on disk,
+### read back as int64, so reading them back needs no parsing and no CategoricalDtype applied by hand.
+
+STORE_DIR = os.getenv('BR_DEMOGRAPHY_STORE_DIR', os.path.join(os.path.dirname(__file__), 'results', 'parquet'))
+SEXES = ['Feminino', 'Masculino'] # same sex order as projection.SEXES
+CATEGORICAL_COLUMNS = ['Município', 'Sexo', 'Faixa Etária', 'Próxima_Faixa_Etária', 'Tipo de Modelo']
+METADATA_KEY = b'br_demography'
+
+
+def age_group_dtype(labels: Sequence[str]) -> pd.CategoricalDtype:
+    '''
+    Returns an ordered CategoricalDtype for age group labels, e.g. '0 a 9 anos', '10 a 19 anos', '80 anos ou mais',
+    sorted by the first age in each label.
+    '''
+
+    labels = pd.unique(pd.Series(labels).dropna().astype(str))
+
+    def first_age(label):
+        match = re.search(r'\d+', label)
+        return (int(match.group()) if match else np.inf, label)
+
+    return pd.CategoricalDtype(sorted(labels, key=first_age), ordered=True)
+
+
+def _categorize(df: pd.DataFrame) -> pd.DataFrame:
+    for column in CATEGORICAL_COLUMNS:
+        if column not in df.columns:
+            continue
+        if column in ['Faixa Etária', 'Próxima_Faixa_Etária']:
+            values = df[column].astype(object).where(df[column].notna())
+            df[column] = values.astype(age_group_dtype(values))
+        elif column == 'Sexo':
+            # other labels, such as Total, are kept after the sexes instead of becoming NaN
+            values = df[column].astype(object)
+            others = sorted(set(values.dropna().astype(str)) - set(SEXES))
+            df[column] = values.astype(pd.CategoricalDtype(SEXES + others))
+        else:
+            df[column] = df[column].astype('category')
+
+    return df
+
+
+def _restore_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    df = _categorize(df)
+    # integers are stored in the smallest type that fits and read back as int64, so arithmetic cannot overflow
+    integers = [column for column in df.columns if column not in CATEGORICAL_COLUMNS
+                and pd.api.types.is_integer_dtype(df[column]) and not isinstance(df[column].dtype, pd.CategoricalDtype)]
+    df = df.astype({column: np.int64 if isinstance(df[column].dtype, np.dtype) else 'Int64' for column in integers})
+    df.columns = [int(column) if isinstance(column, str) and column.isdigit() else column for column in df.columns]
+
+    return df
+
+
+def compact_frame(df: pd.DataFrame, float32: bool = False) -> pd.DataFrame:
+    '''
+    Returns a copy of df, with its index turned into columns, ready to be stored: label columns as categoricals,
+    integers downcast to the smallest type that fits and, if float32 is True, floats as float32.
+    '''
+
+    df = df.reset_index() if any(name is not None for name in df.index.names) else df.reset_index(drop=True)
+    df = _categorize(df)
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            continue
+        if pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+        elif float32 and pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype(np.float32)
+    df.columns = [str(column) for column in df.columns] # Parquet column names must be strings
+
+    return df
+
+
+def _partition_dir(stage: str, region: Optional[str], root: Optional[str]) -> str:
+    path = os.path.join(root or STORE_DIR, f'stage={stage}')
+    if region is not None:
+        path = os.path.join(path, f'region={region}')
+
+    return path
+
+
+def write_table(df: pd.DataFrame, stage: str, region: str = 'brasil', root: Optional[str] = None,
+                float32: bool = False) -> str:
+    '''
+    Writes df to the store and returns the path of the Parquet file, replacing a table already stored for the same
+    stage and region.
+
+    Requires:
+        -> df, the table, its named index levels (e.g. Município, Sexo and Faixa Etária) are stored as columns and
+           restored by read_table;
+        -> stage, the name of the pipeline step, e.g. 'obitos', 'taxa_sobrevivencia' or 'projecao_populacional';
+        -> region, the region the table covers, e.g. 'rmc';
+        -> root, the store directory, STORE_DIR by default;
+        -> float32, if True, floats are stored as float32.
+    '''
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    index = [name for name in df.index.names if name is not None]
+    table = pa.Table.from_pandas(compact_frame(df, float32=float32), preserve_index=False)
+    metadata = dict(table.schema.metadata or dict())
+    metadata[METADATA_KEY] = json.dumps({'index': index, 'stage': stage, 'region': region}).encode('utf-8')
+
+    path = _partition_dir(stage, region, root)
+    os.makedirs(path, exist_ok=True)
+    file_path = os.path.join(path, 'data.parquet')
+    pq.write_table(table.replace_schema_metadata(metadata), file_path, compression='zstd')
+
+    return file_path
+
+
+def read_table(stage: str, regions: Optional[Sequence[str]] = None, columns: Optional[List] = None,
+               filters: Optional[list] = None, root: Optional[str] = None) -> pd.DataFrame:
+    '''
+    Reads a stored stage and returns it with the index it was written with.
+
+    Requires stage, accepts:
+        -> regions, the regions to read, all by default. When more than one region is read, a region column is
+           added to the front of the index;
+        -> columns, the columns to read, e.g. ['Município', 'Sexo', 'Faixa Etária', 2042], index columns are always
+           read;
+        -> filters, row filters in pyarrow form, e.g. [('Sexo', '=', 'Feminino'), ('Município', 'in', ['Curitiba'])],
+           applied while reading;
+        -> root, the store directory, STORE_DIR by default.
+    '''
+
+    import pyarrow.parquet as pq
+
+    path = _partition_dir(stage, None, root)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"Stage {stage} is not in the store {root or STORE_DIR}.")
+
+    stored_regions = sorted(name.split('=', 1)[1] for name in os.listdir(path) if name.startswith('region='))
+    regions = stored_regions if regions is None else list(regions)
+    missing = set(regions) - set(stored_regions)
+    if missing:
+        raise FileNotFoundError(f"Regions {sorted(missing)} of stage {stage} are not in the store.")
+
+    metadata = json.loads(pq.read_schema(os.path.join(path, f'region={regions[0]}', 'data.parquet')).metadata[METADATA_KEY])
+    index = metadata['index']
+    if columns is not None:
+        columns = list(dict.fromkeys(index + [str(column) for column in columns]))
+        if len(regions) > 1:
+            columns = ['region'] + columns
+
+    filters = list(filters or list()) + [('region', 'in', regions)]
+    table = pq.read_table(path, columns=columns, filters=filters, partitioning='hive')
+    df = _restore_dtypes(table.to_pandas())
+
+    if len(regions) > 1:
+        df['region'] = df['region'].astype(str)
+        index = ['region'] + index
+    elif 'region' in df.columns:
+        df = df.drop(columns='region')
+
+    return df.set_index(index) if index else df
+
+
+def read_legacy_csv(path: str, **kwargs) -> pd.DataFrame:
+    '''
+    Reads one of the semicolon separated, comma decimal CSVs in results/tab, written as UTF-16 by the notebooks
+    (or UTF-8 by older ones), so it can be moved into the store with write_table.
+    '''
+
+    with open(path, 'rb') as f:
+        bom = f.read(2)
+    encodings = ['utf-16'] if bom in (b'\xff\xfe', b'\xfe\xff') else ['utf-8-sig', 'latin-1']
+
+    for encoding in encodings:
+        try:
+            df = pd.read_csv(path, sep=';', decimal=',', encoding=encoding, **kwargs)
+        except (UnicodeError, UnicodeDecodeError):
+            continue
+        df = df.drop(columns=[column for column in df.columns if str(column).startswith('Unnamed')])
+        return _restore_dtypes(df)
+
+    raise ValueError(f"Could not read {path} with encodings {encodings}.")
@@ -0,0 +1,317 @@
+import numpy as np
+import pandas as pd
+import argparse
+import hashlib
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+### Loader for the IBGE SIDRA exports in source/tab, the xlsx tables (Tabela <number>.xlsx) and the quoted BMM csv
+### files (resultado_bmm_<number>.csv, Latin-1), from which moradores_dppo.csv and domicilios/dppo_1991_2022.csv
+### are built. Every export is parsed once into a table indexed by the seven-figures municipality id and cached as
+### Parquet under SIDRA_DIR, named after the content of the export, so rebuilding the household tables after a new
+### census release only parses the new export. The 1991 BMM exports have six-figures ids, completed with the
+### check digit of the municipality found among the ids of the other exports.
+### Run with: python -m br_demography.sidra
+
+SOURCE_TAB = os.path.join(os.path.dirname(__file__), 'source', 'tab')
+SIDRA_DIR = os.getenv('BR_DEMOGRAPHY_SIDRA_DIR', os.path.join(os.path.dirname(__file__), 'results', 'sidra'))
+
+# SIDRA symbols: '-' is an absolute zero, the others mean not available, not applicable or suppressed
+SYMBOLS = {'-': 0.0, '..': np.nan, '...': np.nan, 'X': np.nan}
+VALUE_COLUMN = 'Valor' # name of the single value column of tables with no column headers
+
+# output column, export (relative to SOURCE_TAB) and export column of the household tables
+MORADORES_DPPO = [
+    ('MDPPO 1991', os.path.join('moradores', 'resultado_bmm_175705.csv'), 'Moradores, número (operação: Soma)'),
+    ('MDPPO 1996', os.path.join('moradores', 'Tabela 305.xlsx'), VALUE_COLUMN),
+    ('MPPO 2000', os.path.join('moradores', 'Tabela 2407.xlsx'), 'Moradores em domicílios particulares permanentes (Pessoas)'),
+    ('MDPPO 2007', os.path.join('moradores', 'Tabela 579.xlsx'), 'População recenseada em domicílios particulares permanentes (Pessoas)'),
+    ('MDPPO 2010', os.path.join('moradores', 'Tabela 1211.xlsx'), 'Moradores em domicílios particulares permanentes (Pessoas)'),
+    ('MDPPO 2022', os.path.join('moradores', 'Tabela 6893.xlsx'), VALUE_COLUMN),
+    ('DPPO 1991', os.path.join('domicilios', 'resultado_bmm_175685.csv'), 'Frequência'),
+    ('DPPO 1996', os.path.join('domicilios', 'Tabela 482.xlsx'), VALUE_COLUMN),
+    ('DPPO 2000', os.path.join('moradores', 'Tabela 2407.xlsx'), 'Domicílios particulares permanentes (Unidades)'),
+    ('DPPO 2007', os.path.join('moradores', 'Tabela 579.xlsx'), 'Domicílios particulares permanentes (Unidades)'),
+    ('DPPO 2010', os.path.join('moradores', 'Tabela 1211.xlsx'), 'Domicílios particulares permanentes (Unidades)'),
+    ('DPPO 2022', os.path.join('domicilios', 'Tabela 4711.xlsx'), 'Particular permanente ocupado'),
+    ('DPP 2022', os.path.join('domicilios', 'Tabela 4711.xlsx'), 'Particular permanente'),
+    ('DPPV 2022', os.path.join('domicilios', 'Tabela 4711.xlsx'), 'Particular permanente não ocupado - vago'),
+    ('DPPUO 2022', os.path.join('domicilios', 'Tabela 4711.xlsx'), 'Particular permanente não ocupado - uso ocasional'),
+]
+DPPO = [
+    ('dppo 1991', os.path.join('domicilios', 'resultado_bmm_175685.csv'), 'Frequência'),
+    ('dppo 1996', os.path.join('domicilios', 'Tabela 482.xlsx'), VALUE_COLUMN),
+    ('dppo 2000', os.path.join('domicilios', 'Tabela 1310.xlsx'), '2000 - Particular - ocupado'),
+    ('dppo 2010', os.path.join('domicilios', 'Tabela 1310.xlsx'), '2010 - Particular - ocupado'),
+    ('dppo 2022', os.path.join('domicilios', 'Tabela 4711.xlsx'), 'Particular permanente ocupado'),
+    ('Particular 2022', os.path.join('domicilios', 'Tabela 4711.xlsx'), 'Particular'),
+    ('Particular permanente 2022', os.path.join('domicilios', 'Tabela 4711.xlsx'), 'Particular permanente'),
+    ('Particular permanente não ocupado 2022', os.path.join('domicilios', 'Tabela 4711.xlsx'), 'Particular permanente não ocupado'),
+]
+# average residents per household, as (column, residents, households)
+AVERAGES = [
+    ('AVG MDPPO 1991', 'MDPPO 1991', 'DPPO 1991'),
+    ('AVG MDPPO 1996', 'MDPPO 1996', 'DPPO 1996'),
+    ('AVG MPPO 2000', 'MPPO 2000', 'DPPO 2000'),
+    ('AVG MDPPO 2007', 'MDPPO 2007', 'DPPO 2007'),
+    ('AVG MDPPO 2010', 'MDPPO 2010', 'DPPO 2010'),
+    ('AVG MDPPO 2022', 'MDPPO 2022', 'DPPO 2022'),
+]
+NAMES_EXPORT = os.path.join('domicilios', 'Tabela 4711.xlsx') # municipality names and UFs of the 2022 census
+
+
+def detect_encoding(path: str) -> str:
+    '''
+    Returns the encoding of a text file: UTF-16 or UTF-8 when it starts with their byte order mark or decodes as
+    UTF-8, Latin-1, the encoding of SIDRA csv downloads, otherwise.
+    '''
+
+    with open(path, 'rb') as f:
+        raw = f.read()
+
+    if raw[:2] in (b'\xff\xfe', b'\xfe\xff'):
+        return 'utf-16'
+    try:
+        raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+    return 'utf-8-sig'
+
+
+def to_number(values: pd.Series) -> pd.Series:
+    '''
+    Converts SIDRA values to floats: numbers with '.' as thousands separator and ',' as decimal separator, as in the
+    csv exports, numbers already read as such from xlsx exports and the SIDRA symbols in SYMBOLS.
+    '''
+
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+
+    def convert(value):
+        if isinstance(value, (int, float)):
+            return float(value)
+        text = str(value).strip()
+        if text in SYMBOLS:
+            return SYMBOLS[text]
+        try:
+            return float(text.replace('.', '').replace(',', '.'))
+        except ValueError:
+            return np.nan
+
+    return values.map(convert).astype(float)
+
+
+def _split_name(names: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    # 'Alta Floresta D'Oeste (RO)' -> "Alta Floresta D'Oeste", 'RO'
+    parts = names.astype(str).str.extract(r'^(.*?)(?: \(([A-Z]{2})\))?$')
+
+    return parts[0].str.strip(), parts[1]
+
+
+def read_sidra_xlsx(path: str) -> pd.DataFrame:
+    '''
+    Parses a SIDRA xlsx export with municipalities in rows and returns a DataFrame indexed by mun_id, with columns
+    mun, uf and one column per combination of the column headers, joined by ' - ' (e.g. '2010 - Particular -
+    ocupado' for a table with years and household types), or a single Valor column when there are none. The
+    dimensions fixed in the title rows, e.g. 'Ano - 2010', are kept in df.attrs['dimensoes'].
+    '''
+
+    raw = pd.read_excel(path, sheet_name=0, header=None, dtype=object)
+    first_column = raw.iloc[:, 0].astype('string').str.strip()
+
+    header = int(np.flatnonzero((first_column == 'Cód.').fillna(False).to_numpy())[0])
+    codes = pd.to_numeric(first_column, errors='coerce')
+    data = np.flatnonzero(codes.notna().to_numpy() & (np.arange(len(raw)) > header))
+    first, last = data[0], data[-1]
+
+    dimensions = dict()
+    for line in first_column.iloc[1:header].dropna():
+        name, _, value = line.partition(' - ')
+        dimensions[name.strip()] = value.strip()
+
+    # header rows below 'Cód.', forward filled to the right, as SIDRA merges the cells of a header over its columns
+    headers = raw.iloc[header + 1:first, 2:].ffill(axis=1)
+    names = [
+        ' - '.join(str(value).strip() for value in headers[column] if pd.notna(value)) or VALUE_COLUMN
+        for column in headers.columns
+    ] if len(headers) else [VALUE_COLUMN] * (raw.shape[1] - 2)
+
+    body = raw.iloc[first:last + 1]
+    mun, uf = _split_name(body.iloc[:, 1])
+    index = pd.Index(codes.iloc[first:last + 1].astype(np.int64).to_numpy(), name='mun_id')
+    df = pd.DataFrame({'mun': mun.to_numpy(), 'uf': uf.to_numpy()}, index=index)
+    for i, name in enumerate(names):
+        df[name] = to_number(body.iloc[:, i + 2].reset_index(drop=True)).to_numpy()
+    df = df[df.index >= 100000] # country, regions and states, when listed, have shorter codes
+    df.attrs['dimensoes'] = dimensions
+
+    return df
+
+
+def read_sidra_csv(path: str, encoding: Optional[str] = None) -> pd.DataFrame:
+    '''
+    Parses a SIDRA BMM csv export (semi-colon separated, every field quoted) and returns a DataFrame indexed by
+    mun_id, the 'Código do Item Geográfico' column, with the municipality name in mun, the year in Ano and every other
+    column, numbers converted by to_number. The encoding is detected unless given.
+    '''
+
+    df = pd.read_csv(path, sep=';', quotechar='"', dtype=str, encoding=encoding or detect_encoding(path))
+    df.columns = [column.strip() for column in df.columns]
+
+    result = pd.DataFrame({
+        'mun': df['Item Geográfico'].str.strip().to_numpy(),
+        'Ano': pd.to_numeric(df['Item Temporal']).to_numpy(),
+    }, index=pd.Index(df['Código do Item Geográfico'].astype(np.int64).to_numpy(), name='mun_id'))
+
+    skipped = ['Código do Nível Geográfico', 'Nível Geográfico', 'Código do Item Geográfico', 'Item Geográfico',
+               'Ordem Geográfica', 'Código do Item Temporal', 'Nível Temporal', 'Item Temporal', 'Observações']
+    for column in df.columns:
+        if column in skipped:
+            continue
+        numbers = to_number(df[column])
+        result[column] = (numbers if numbers.notna().any() else df[column].str.strip()).to_numpy()
+
+    return result
+
+
+def _digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def load_export(path: str, root: Optional[str] = None) -> pd.DataFrame:
+    '''
+    Returns a SIDRA export parsed by read_sidra_xlsx or read_sidra_csv, from the Parquet cache under root (SIDRA_DIR
+    by default) when the same file was parsed before.
+    '''
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(root or SIDRA_DIR, f'{name}-{_digest(path)}.parquet')
+    if os.path.isfile(cache_path):
+        return pd.read_parquet(cache_path)
+
+    df = read_sidra_xlsx(path) if path.lower().endswith(('.xlsx', '.xls')) else read_sidra_csv(path)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    df.to_parquet(tmp_path, engine='pyarrow')
+    os.replace(tmp_path, cache_path)
+
+    return df
+
+
+def check_digit(codes: Sequence[int]) -> np.ndarray:
+    '''
+    Returns the IBGE check digit of six-figures municipality ids: figures weighted 1, 2, 1, 2, 1, 2, the figures of
+    each product summed, and 10 minus the last figure of the sum. A few municipalities have ids which do not follow
+    the rule, see complete_codes.
+    '''
+
+    codes = np.asarray(codes, dtype=np.int64)
+    total = np.zeros(len(codes), dtype=np.int64)
+    for position in range(6):
+        figure = codes // 10 ** (5 - position) % 10
+        product = figure * (1 if position % 2 == 0 else 2)
+        total += product // 10 + product % 10
+
+    return (10 - total % 10) % 10
+
+
+def complete_codes(codes: Sequence[int], reference: Sequence[int]) -> np.ndarray:
+    '''
+    Returns the seven-figures ids of six-figures municipality ids, looking them up among the ids in reference
+    (e.g. those of the 2022 census), or, for municipalities not found there, computed with check_digit.
+    '''
+
+    codes = np.asarray(codes, dtype=np.int64)
+    reference = pd.Series(np.asarray(reference, dtype=np.int64))
+    reference = pd.Series(reference.to_numpy(), index=reference.to_numpy() // 10)
+    reference = reference[~reference.index.duplicated()]
+
+    found = reference.reindex(codes).to_numpy()
+    computed = codes * 10 + check_digit(codes)
+
+    return np.where(pd.notna(found), found, computed).astype(np.int64)
+
+
+def _column(export: pd.DataFrame, column: str, reference: pd.Index) -> pd.Series:
+    if column not in export.columns:
+        raise ValueError(f"Column {column} not found. Columns are {list(export.columns)}.")
+    values = export[column]
+    if export.index.max() < 1000000: # six-figures ids of the 1991 exports
+        values = values.set_axis(complete_codes(export.index, reference))
+
+    return values.groupby(level=0).sum(min_count=1).reindex(reference)
+
+
+def build_table(columns: Sequence[Tuple[str, str, str]], source_dir: str = SOURCE_TAB,
+                root: Optional[str] = None) -> pd.DataFrame:
+    '''
+    Assembles a national table, indexed by cod_mun with columns mun and uf from the 2022 census, plus one column per
+    (output column, export, export column) in columns, exports given relative to source_dir. Municipalities
+    created after an export have no value in its columns.
+    '''
+
+    names = load_export(os.path.join(source_dir, NAMES_EXPORT), root)[['mun', 'uf']]
+    df = names.rename_axis('cod_mun')
+
+    exports: Dict[str, pd.DataFrame] = dict()
+    for name, export, column in columns:
+        if export not in exports:
+            exports[export] = load_export(os.path.join(source_dir, export), root)
+        df[name] = _column(exports[export], column, df.index).to_numpy()
+
+    return df
+
+
+def build_household_tables(source_dir: str = SOURCE_TAB, root: Optional[str] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Returns the tables of moradores_dppo.csv, residents and households in permanent private households by census
+    with the average residents per household, and of domicilios/dppo_1991_2022.csv, households by census and type,
+    both sorted by cod_mun. Counts are nullable integers.
+    '''
+
+    moradores = build_table(MORADORES_DPPO, source_dir, root)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        averages = pd.DataFrame({
+            name: moradores[residents] / moradores[households] for name, residents, households in AVERAGES
+        }, index=moradores.index)
+    averages = np.floor(averages * 100 + 0.5 + 1e-9) / 100 # rounded half up, as the spreadsheets did
+    moradores = pd.concat([moradores[['mun', 'uf']], averages, moradores.drop(columns=['mun', 'uf'])], axis=1)
+    moradores = moradores.sort_index()
+
+    dppo = build_table(DPPO, source_dir, root).sort_index()
+
+    counts = lambda df: df.astype({column: 'Int64' for column in df.columns if column not in ['mun', 'uf'] and
+                                   not column.startswith('AVG')})
+
+    return counts(moradores), counts(dppo)
+
+
+def write_household_tables(source_dir: str = SOURCE_TAB, root: Optional[str] = None) -> List[str]:
+    '''
+    Builds the household tables and writes them to source_dir/moradores_dppo.csv and
+    source_dir/domicilios/dppo_1991_2022.csv, in the layout read by household_projection. Returns the paths written.
+    '''
+
+    moradores, dppo = build_household_tables(source_dir, root)
+    paths = [os.path.join(source_dir, 'moradores_dppo.csv'), os.path.join(source_dir, 'domicilios', 'dppo_1991_2022.csv')]
+    for df, path in zip([moradores, dppo], paths):
+        df.to_csv(path, sep=';', decimal=',', float_format='%.2f', encoding='utf-8-sig', lineterminator='\r\n')
+
+    return paths
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Builds moradores_dppo.csv and dppo_1991_2022.csv from SIDRA exports.')
+    parser.add_argument('--source-dir', default=SOURCE_TAB, help='directory with the moradores and domicilios exports')
+    parser.add_argument('--cache', default=None, help=f'parsed exports directory, {SIDRA_DIR} by default')
+    args = parser.parse_args(argv)
+
+    for path in write_household_tables(args.source_dir, args.cache):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
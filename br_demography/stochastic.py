@@ -0,0 +1,271 @@
+from . import projection, trend_models
+import numpy as np
+import pandas as pd
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence
+
+
+### Stochastic mode of the cohort-component projection. Instead of the single path of point-estimate rates, the
+### parameters of the fertility and mortality trend models are drawn n_draws times from their least squares
+### sampling distribution, net migration is scaled by a random factor, and every draw is projected in the same
+### NumPy operation: draws are stacked on the municipality axis of projection.project_population. Draws are
+### split in chunks that fit memory_budget, optionally spread over processes, and written to a temporary file as they
+### finish when all the draws would not fit memory_budget. percentile_bands then reads them back in blocks of cells,
+### so memory use stays within the budget whatever n_draws.
+
+INDEX = ['mun_id', 'Sexo', 'Faixa Etária']
+DEFAULT_MEMORY_BUDGET = 256 * 1024 ** 2 # bytes of rate arrays held at once by each process
+
+
+class RateModel(NamedTuple):
+    '''
+    Trend models fitted to a rate table: params as returned by trend_models.fit_trend_models and covariance, an
+    array (row, 2, 2) with the covariance of intercept and slope of the linear fit behind each row (of log rates for
+    the exponential model), zero for rows without enough points and for logistic rows, which are not drawn.
+    '''
+    params: pd.DataFrame
+    covariance: np.ndarray
+    base_year: int
+
+
+def fit_rate_model(rates: pd.DataFrame, models: Sequence[str] = ('Exponencial', 'Linear'), criterion: str = 'rmse',
+                   base_year: int = 2000) -> RateModel:
+    '''
+    Fits trend models to every row of a rate table, as trend_models.fit_trend_models with drop_zeros=True, and
+    estimates the sampling covariance of the selected linear or exponential fit, s2 (X'X)^-1, s2 being the residual
+    variance of the fit.
+    '''
+
+    params = trend_models.fit_trend_models(rates, models=models, criterion=criterion, base_year=base_year)
+
+    x = rates.columns.astype(int).to_numpy() - base_year
+    y = rates.to_numpy(dtype=float)
+    mask = np.isfinite(y) & (y > 0)
+    kinds = params['Tipo de Modelo'].to_numpy()
+    exponential = (kinds == 'Exponencial')[:, np.newaxis]
+
+    intercept, slope = _linear_parameters(params)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        target = np.where(exponential, np.log(np.where(mask, y, 1.0)), y)
+    residuals = np.where(mask, target - (intercept[:, np.newaxis] + slope[:, np.newaxis] * x), 0.0)
+
+    n = mask.sum(axis=1)
+    sx = np.where(mask, x, 0).sum(axis=1)
+    sxx = np.where(mask, x ** 2, 0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s2 = (residuals ** 2).sum(axis=1) / (n - 2)
+        det = n * sxx - sx ** 2
+        covariance = s2[:, np.newaxis, np.newaxis] * np.stack(
+            [np.stack([sxx, -sx], axis=-1), np.stack([-sx, n], axis=-1)], axis=1) / det[:, np.newaxis, np.newaxis]
+
+    drawn = np.isin(kinds, ['Exponencial', 'Linear']) & (n > 2) & (det > 0)
+    covariance[~drawn] = 0.0
+
+    return RateModel(params=params, covariance=np.nan_to_num(covariance), base_year=base_year)
+
+
+def _linear_parameters(params: pd.DataFrame):
+    # intercept and slope of the straight line fitted, log c and -k for exponential models
+    kinds = params['Tipo de Modelo'].to_numpy()
+    constant = params['Constante'].to_numpy(dtype=float)
+    coefficient = params['Coeficiente'].to_numpy(dtype=float)
+    exponential = kinds == 'Exponencial'
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intercept = np.where(exponential, np.log(constant), constant)
+    slope = np.where(exponential, -coefficient, coefficient)
+
+    return intercept, slope
+
+
+def _cholesky(covariance: np.ndarray) -> np.ndarray:
+    # closed form lower Cholesky factor of (row, 2, 2) positive semidefinite matrices
+    c11, c21, c22 = covariance[:, 0, 0], covariance[:, 1, 0], covariance[:, 1, 1]
+    l11 = np.sqrt(np.maximum(c11, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        l21 = np.where(l11 > 0, c21 / l11, 0.0)
+    l22 = np.sqrt(np.maximum(c22 - l21 ** 2, 0))
+    factor = np.zeros_like(covariance)
+    factor[:, 0, 0], factor[:, 1, 0], factor[:, 1, 1] = l11, l21, l22
+
+    return factor
+
+
+def draw_rates(model: RateModel, years: Sequence[int], n_draws: int, rng: np.random.Generator) -> np.ndarray:
+    '''
+    Returns n_draws projections of every row of a RateModel, an array (draw, row, year). Intercept and slope are
+    drawn from a normal distribution with the fitted values as mean and the covariance of the model. Logistic rows
+    keep their fitted projection and rows without a model are NaN.
+    '''
+
+    params = model.params
+    x = np.asarray(years, dtype=float) - model.base_year
+    kinds = params['Tipo de Modelo'].to_numpy()
+
+    intercept, slope = _linear_parameters(params)
+    noise = np.einsum('rij,drj->dri', _cholesky(model.covariance), rng.standard_normal((n_draws, len(params), 2)))
+    intercepts = intercept + noise[..., 0]
+    slopes = slope + noise[..., 1]
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        line = intercepts[..., np.newaxis] + slopes[..., np.newaxis] * x
+        values = np.where((kinds == 'Exponencial')[:, np.newaxis], np.exp(line), line)
+
+    logistic = kinds == 'Logístico'
+    if logistic.any():
+        values[:, logistic] = trend_models.project_rates(params[logistic], years, model.base_year).to_numpy()
+    values[:, ~np.isin(kinds, trend_models.MODELS)] = np.nan
+
+    return values
+
+
+def _simulate_chunk(population: np.ndarray, mortality: RateModel, fertility: RateModel,
+                    migration: Optional[np.ndarray], migration_sd: float, n_draws: int, seed, settings: dict) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    n_mun, n_sex, n_age = population.shape
+    years = np.arange(settings['base_year'], settings['horizon'])
+
+    survival = np.clip(1 - draw_rates(mortality, years, n_draws, rng) / 1000, 0, 1)
+    survival = np.nan_to_num(survival, nan=1.0).reshape(n_draws * n_mun, n_sex, n_age, len(years))
+    births = np.maximum(np.nan_to_num(draw_rates(fertility, years, n_draws, rng), nan=0.0), 0)
+    births = births.reshape(n_draws * n_mun, n_age, len(years))
+
+    migrants = None
+    if migration is not None:
+        factor = rng.normal(1.0, migration_sd, size=(n_draws, n_mun)) # one factor by draw and municipality
+        migrants = (migration[np.newaxis] * factor[..., np.newaxis, np.newaxis]).reshape(n_draws * n_mun, n_sex, n_age)
+        migrants = np.repeat(migrants[..., np.newaxis], len(years), axis=-1)
+
+    result = projection.project_population(
+        np.tile(population, (n_draws, 1, 1)), survival, births, migration=migrants, base_year=settings['base_year'],
+        horizon=settings['horizon'], step=settings['step'], age_group_width=settings['age_group_width'],
+        rate_years=years)
+
+    return result.reshape((n_draws,) + population.shape + (result.shape[-1],)).astype(np.float32)
+
+
+def _chunks(n_draws: int, chunk_size: int) -> List[int]:
+    return [min(chunk_size, n_draws - start) for start in range(0, n_draws, chunk_size)]
+
+
+def _results(arguments: list, n_jobs: Optional[int]):
+    # chunk results in order, at most two chunks per process pending at once
+    if n_jobs == 1 or len(arguments) == 1:
+        for chunk_arguments in arguments:
+            yield _simulate_chunk(*chunk_arguments)
+        return
+
+    window = 2 * (n_jobs or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        pending = [executor.submit(_simulate_chunk, *chunk_arguments) for chunk_arguments in arguments[:window]]
+        for position in range(len(arguments)):
+            result = pending.pop(0).result()
+            if position + window < len(arguments):
+                pending.append(executor.submit(_simulate_chunk, *arguments[position + window]))
+            yield result
+
+
+def simulate(population: pd.Series, mortality_rates: pd.DataFrame, birth_rates: pd.DataFrame,
+             migration: Optional[pd.Series] = None, n_draws: int = 1000, base_year: int = 2022, horizon: int = 2042,
+             step: int = 10, age_group_width: int = 10, death_models: Sequence[str] = ('Exponencial', 'Linear'),
+             birth_models: Sequence[str] = ('Exponencial',), criterion: str = 'rmse', fit_base_year: int = 2000,
+             migration_sd: float = 0.25, memory_budget: int = DEFAULT_MEMORY_BUDGET, n_jobs: Optional[int] = 1,
+             seed: int = 0) -> np.ndarray:
+    '''
+    Projects n_draws scenarios and returns an array (draw, municipality, sex, age group, projected year), with
+    municipalities, sexes and age groups sorted as in the index of population, a np.memmap over a temporary file
+    when it is larger than memory_budget.
+
+    Requires:
+        -> population, the base_year population indexed by mun_id, Sexo and Faixa Etária (ordered categorical);
+        -> mortality_rates, observed deaths per 1,000 inhabitants, same index, one column per year;
+        -> birth_rates, observed births per 1,000 women, indexed by mun_id and Faixa Etária, one column per year;
+        -> migration, optional annual net migrants with the index of population;
+        -> n_draws, the number of scenarios;
+        -> base_year, horizon, step and age_group_width, as in projection.project_population;
+        -> death_models, birth_models and criterion, the trend models fitted, as in trend_models.fit_trend_models,
+           with years counted from fit_base_year;
+        -> migration_sd, the standard deviation of the factor, with mean 1, net migration of each municipality is
+           multiplied by in each scenario;
+        -> memory_budget, the bytes of rate arrays each process holds at once, which sets the draws per chunk. When
+           the draws do not fit it either, they are written to a temporary file, deleted with the returned array;
+        -> n_jobs, the number of processes chunks are spread over, all cpus if None;
+        -> seed, results depend on it and on memory_budget, not on n_jobs.
+    '''
+
+    population = population.sort_index()
+    levels = [population.index.get_level_values(name).unique().sort_values() for name in INDEX]
+    index = pd.MultiIndex.from_product(levels, names=INDEX)
+    women = pd.MultiIndex.from_product([levels[0], levels[2]], names=['mun_id', 'Faixa Etária'])
+    shape = tuple(len(level) for level in levels)
+
+    mortality = fit_rate_model(mortality_rates.reindex(index), death_models, criterion, fit_base_year)
+    fertility = fit_rate_model(birth_rates.reindex(women), birth_models, criterion, fit_base_year)
+    base = population.reindex(index).fillna(0).to_numpy(dtype=float).reshape(shape)
+    migrants = None if migration is None else migration.reindex(index).fillna(0).to_numpy(dtype=float).reshape(shape)
+
+    settings = {'base_year': base_year, 'horizon': horizon, 'step': step, 'age_group_width': age_group_width}
+    n_years = horizon - base_year
+    draw_bytes = 8 * n_years * shape[0] * shape[2] * (2 * shape[1] + 1) * 3 # survival, migration and fertility, with temporaries
+    chunks = _chunks(n_draws, max(1, memory_budget // draw_bytes))
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    arguments = [(base, mortality, fertility, migrants, migration_sd, size, chunk_seed, settings)
+                 for size, chunk_seed in zip(chunks, seeds)]
+
+    draws_shape = (n_draws,) + shape + (len(range(0, n_years + 1, step)),)
+    if 4 * np.prod(draws_shape) <= memory_budget:
+        draws = np.empty(draws_shape, dtype=np.float32)
+    else:
+        # the file has no name and is deleted when the array is, the data stays on disk until then
+        draws = np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode='w+', shape=draws_shape)
+
+    start = 0
+    for result in _results(arguments, n_jobs):
+        draws[start:start + len(result)] = result
+        start += len(result)
+
+    return draws
+
+
+def percentile_bands(draws: np.ndarray, index: pd.MultiIndex, base_year: int = 2022, step: int = 10,
+                     percentiles: Sequence[float] = (5, 50, 95),
+                     memory_budget: int = DEFAULT_MEMORY_BUDGET) -> pd.DataFrame:
+    '''
+    Takes the array returned by simulate and the sorted index of its population and returns a DataFrame indexed by
+    mun_id, Sexo, Faixa Etária and Ano with the mean (Média) and one column per percentile, e.g. P5, P50 and P95.
+    Draws are summarized in blocks of cells of about memory_budget bytes.
+    '''
+
+    levels = [index.get_level_values(name).unique().sort_values() for name in INDEX]
+    years = base_year + step * np.arange(draws.shape[-1])
+    full_index = pd.MultiIndex.from_product(levels + [years], names=INDEX + ['Ano'])
+
+    cells = draws.reshape(len(draws), -1)
+    block = max(1, memory_budget // (8 * len(draws) * (len(percentiles) + 2))) # block, its sort and the bands
+    mean = np.empty(cells.shape[1])
+    bands = np.empty((len(percentiles), cells.shape[1]))
+    for start in range(0, cells.shape[1], block):
+        values = np.asarray(cells[:, start:start + block], dtype=np.float64)
+        mean[start:start + block] = values.mean(axis=0)
+        bands[:, start:start + block] = np.percentile(values, percentiles, axis=0)
+
+    df = pd.DataFrame({'Média': mean}, index=full_index)
+    for percentile, values in zip(percentiles, bands):
+        df[f'P{percentile:g}'] = values
+
+    return df
+
+
+def stochastic_projection(population: pd.Series, mortality_rates: pd.DataFrame, birth_rates: pd.DataFrame,
+                          migration: Optional[pd.Series] = None, percentiles: Sequence[float] = (5, 50, 95),
+                          **kwargs) -> pd.DataFrame:
+    '''
+    Runs simulate with the same arguments (n_draws, horizon, seed, n_jobs...) and returns its percentile_bands.
+    '''
+
+    draws = simulate(population, mortality_rates, birth_rates, migration, **kwargs)
+    base_year, step = kwargs.get('base_year', 2022), kwargs.get('step', 10)
+
+    return percentile_bands(draws, population.sort_index().index, base_year, step, percentiles,
+                            kwargs.get('memory_budget', DEFAULT_MEMORY_BUDGET))
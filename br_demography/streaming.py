@@ -0,0 +1,121 @@
+from . import age_groups, instrumentation, query_backend
+import numpy as np
+import pandas as pd
+import time
+from typing import Callable, List, Optional, Sequence
+
+
+### Bounded-memory ingestion of large query results. Instead of materializing millions of microdata rows in one
+### DataFrame, stream_query reads the result as pyarrow RecordBatches and hands each batch to incremental
+### aggregators, which only keep their running counts. Peak memory is one batch plus the aggregated tables, whatever
+### the number of municipalities and years requested. Streamed results are not stored in the query cache.
+
+DEFAULT_BATCH_SIZE = 100000
+
+
+class GroupCounter:
+    '''
+    Counts records by the columns in by and, when age_group_csv_path is given, by the age group of age_column.
+
+    Records without age are counted apart and, in result, assigned to the age group of the mean age of all records,
+    as standard_age_groups does with whole DataFrames. where, a function taking a batch as a DataFrame and returning
+    a boolean mask, restricts the records counted, e.g. lambda df: df['Idade'] < 1.
+    '''
+
+    def __init__(self, by: List[str], age_group_csv_path: Optional[str] = None, age_column: str = 'Idade',
+                 where: Optional[Callable[[pd.DataFrame], Sequence[bool]]] = None, value_name: str = 'Contagem'):
+        self.by = list(by)
+        self.scheme = None if age_group_csv_path is None else age_groups.load_scheme(age_group_csv_path)
+        self.age_column = age_column
+        self.where = where
+        self.value_name = value_name
+        self.rows = 0
+        self._counts = None
+        self._missing_age = None
+        self._age_sum = 0.0
+        self._age_count = 0
+
+    @staticmethod
+    def _accumulate(total: Optional[pd.Series], counts: pd.Series) -> pd.Series:
+        return counts if total is None else total.add(counts, fill_value=0)
+
+    def update(self, batch) -> None:
+        columns = self.by + ([self.age_column] if self.scheme is not None or self.where is not None else list())
+        columns = list(dict.fromkeys(column for column in columns if column in batch.schema.names))
+        df = batch.select(columns).to_pandas()
+        self.rows += len(df)
+
+        if self.scheme is not None:
+            ages = pd.to_numeric(df[self.age_column], errors='coerce')
+            self._age_sum += float(ages.sum())
+            self._age_count += int(ages.notna().sum())
+            df = df.assign(**{self.age_column: ages})
+
+        if self.where is not None:
+            df = df[np.asarray(self.where(df), dtype=bool)]
+
+        if self.scheme is None:
+            self._counts = self._accumulate(self._counts, df.groupby(self.by, sort=False).size())
+            return
+
+        missing = df[self.age_column].isna()
+        if missing.any():
+            self._missing_age = self._accumulate(self._missing_age, df[missing].groupby(self.by, sort=False).size())
+
+        df = df[~missing]
+        codes = age_groups.age_group_codes(df[self.age_column], self.scheme)
+        df = df[self.by].assign(_faixa=codes)[codes >= 0]
+        self._counts = self._accumulate(self._counts, df.groupby(self.by + ['_faixa'], sort=False).size())
+
+    def result(self) -> pd.DataFrame:
+        '''
+        Returns the counts as a DataFrame indexed by the columns in by (and Faixa Etária, as an ordered categorical)
+        with the counts in column value_name.
+        '''
+
+        names = self.by + (['_faixa'] if self.scheme is not None else list())
+        counts = self._counts
+        if counts is None:
+            counts = pd.Series([], dtype=np.int64, index=pd.MultiIndex.from_arrays([[]] * len(names), names=names))
+
+        if self.scheme is not None and self._missing_age is not None and self._age_count > 0:
+            mean_age_code = age_groups.age_group_codes([int(self._age_sum / self._age_count)], self.scheme)[0]
+            if mean_age_code >= 0:
+                missing = self._missing_age.to_frame('n').assign(_faixa=mean_age_code).set_index('_faixa', append=True)['n']
+                counts = counts.add(missing, fill_value=0)
+
+        df = counts.astype(np.int64).rename(self.value_name).to_frame()
+        if self.scheme is not None:
+            labels = pd.Categorical.from_codes(df.index.get_level_values('_faixa'), categories=self.scheme.labels, ordered=True)
+            df = df.reset_index('_faixa', drop=True).set_index(pd.CategoricalIndex(labels, name='Faixa Etária'), append=True)
+
+        return df.sort_index()
+
+
+def stream_query(query: str, billing_project_id: str, aggregators: Sequence, batch_size: int = DEFAULT_BATCH_SIZE) -> Sequence:
+    '''
+    Runs a query on the active backend, passing each RecordBatch of its result to the update method of every
+    aggregator, and returns the aggregators. The query is checked against the byte budget and recorded by
+    instrumentation like any other query.
+    '''
+
+    backend = query_backend.get_backend()
+    estimated_bytes = instrumentation.check_budget(backend, query, billing_project_id)
+
+    start = time.perf_counter()
+    rows, nbytes = 0, 0
+    try:
+        for batch in backend.read_batches(query=query, billing_project_id=billing_project_id, batch_size=batch_size):
+            rows += batch.num_rows
+            nbytes += batch.nbytes
+            for aggregator in aggregators:
+                aggregator.update(batch)
+    except Exception as e:
+        instrumentation.record_query(query=query, backend=backend.name, estimated_bytes=estimated_bytes,
+                                     seconds=time.perf_counter() - start, rows=rows, result_memory_bytes=nbytes,
+                                     error=e)
+        raise
+    instrumentation.record_query(query=query, backend=backend.name, estimated_bytes=estimated_bytes,
+                                 seconds=time.perf_counter() - start, rows=rows, result_memory_bytes=nbytes)
+
+    return aggregators
@@ -0,0 +1,227 @@
+from . import query_backend
+import numpy as np
+import pandas as pd
+import os
+from typing import Dict, Optional, Sequence
+
+
+### Synthetic microdata shaped like the results of the query functions, for every municipality of the country, so
+### processing functions can be exercised and benchmarked without BigQuery. Sizes follow the real sources at
+### scale=1.0: about 5,570 municipalities, 200 million inhabitants, 1.3 million deaths and 2.9 million births a
+### year, and a 10% census sample. write_extracts stores the same data with basedosdados column names, so
+### query_backend.DuckDBBackend can run the query functions themselves on it.
+
+N_MUNICIPALITIES = 5570
+UF_CODES = [11, 12, 13, 14, 15, 16, 17, 21, 22, 23, 24, 25, 26, 27, 28, 29, 31, 32, 33, 35, 41, 42, 43, 50, 51, 52, 53]
+MAX_AGE = 100
+DEATH_RATE = 6.5 / 1000 # deaths per inhabitant per year
+BIRTH_RATE = 14 / 1000 # births per inhabitant per year
+MIGRANT_SHARE = 0.05 # share of census respondents who lived in another municipality five years before
+
+
+def municipality_ids(n_municipalities: int = N_MUNICIPALITIES, seed: int = 0) -> np.ndarray:
+    '''
+    Returns n_municipalities distinct, sorted seven-figures municipality ids, starting with real UF codes.
+    '''
+
+    rng = np.random.default_rng(seed)
+    uf = np.sort(rng.choice(UF_CODES, size=n_municipalities))
+    sequence = np.arange(n_municipalities) - np.searchsorted(uf, uf) # position of each municipality within its UF
+    if sequence.max() >= 10000:
+        raise ValueError("Too many municipalities for five-figures codes within a UF.")
+
+    return uf * 100000 + sequence * 10 + rng.integers(0, 10, n_municipalities)
+
+
+def municipality_population(mun_ids: Sequence[int], year: int = 2022, seed: int = 0) -> pd.Series:
+    '''
+    Returns a log-normal population for each municipality in year (median about 13,000 inhabitants in 2022), with
+    annual growth rates around 0.8% between years.
+    '''
+
+    rng = np.random.default_rng(seed)
+    population = rng.lognormal(mean=9.5, sigma=1.4, size=len(mun_ids))
+    growth = rng.normal(0.008, 0.01, size=len(mun_ids))
+    population = np.maximum(population * (1 + growth) ** (year - 2022), 100)
+
+    return pd.Series(population.round().astype(np.int64), index=pd.Index(mun_ids, name='mun_id'), name='Pop')
+
+
+def _age_distribution(year: int) -> np.ndarray:
+    # younger population in older censuses
+    ages = np.arange(MAX_AGE + 1)
+    weights = np.exp(-ages / (38 + (year - 2000) / 2)) * (1 - 1 / (1 + np.exp(-(ages - 85) / 4)))
+
+    return weights / weights.sum()
+
+
+def _sample_ages(rng, n: int, kind: str, year: int = 2010) -> np.ndarray:
+    if kind == 'death':
+        ages = np.clip(rng.normal(72, 16, n), 1, 110).astype(np.int64)
+        return np.where(rng.random(n) < 0.03, 0, ages) # infant deaths
+    if kind == 'mother':
+        return np.clip(rng.normal(27, 6.5, n), 10, 55).astype(np.int64)
+
+    return rng.choice(MAX_AGE + 1, size=n, p=_age_distribution(year))
+
+
+def _event_rows(rng, population: pd.Series, years: Sequence[int], rate: float, scale: float):
+    counts = rng.poisson(np.outer(population.to_numpy(), np.ones(len(years))) * rate * scale)
+    mun_ids = np.repeat(np.tile(population.index.to_numpy(), len(years)), counts.T.ravel())
+    event_years = np.repeat(np.repeat(np.asarray(years), len(population)), counts.T.ravel())
+
+    return mun_ids, event_years
+
+
+def deaths_microdata(mun_ids: Optional[Sequence[int]] = None, start_year: int = 2000, end_year: int = 2022,
+                     scale: float = 1.0, seed: int = 0) -> pd.DataFrame:
+    '''
+    Returns one row per death with the columns of query_deaths, Ano, Sexo ('1', '2' and a few '9') and Idade (with
+    about 0.5% missing ages), plus mun_id. scale multiplies the number of deaths.
+    '''
+
+    rng = np.random.default_rng(seed)
+    mun_ids = municipality_ids(seed=seed) if mun_ids is None else np.asarray(mun_ids)
+    population = municipality_population(mun_ids, seed=seed)
+    ids, years = _event_rows(rng, population, range(start_year, end_year + 1), DEATH_RATE, scale)
+
+    n = len(ids)
+    ages = _sample_ages(rng, n, 'death').astype(float)
+    ages[rng.random(n) < 0.005] = np.nan
+    sex = rng.choice(np.array(['1', '2', '9'], dtype=object), size=n, p=[0.559, 0.44, 0.001])
+
+    return pd.DataFrame({'mun_id': ids, 'Ano': years, 'Sexo': sex, 'Idade': ages})
+
+
+def births_microdata(mun_ids: Optional[Sequence[int]] = None, start_year: int = 2000, end_year: int = 2022,
+                     scale: float = 1.0, seed: int = 0) -> pd.DataFrame:
+    '''
+    Returns one row per birth with the columns of query_births, Ano and Idade (the age of the mother, with about
+    0.5% missing), plus mun_id. scale multiplies the number of births.
+    '''
+
+    rng = np.random.default_rng(seed + 1)
+    mun_ids = municipality_ids(seed=seed) if mun_ids is None else np.asarray(mun_ids)
+    population = municipality_population(mun_ids, seed=seed)
+    ids, years = _event_rows(rng, population, range(start_year, end_year + 1), BIRTH_RATE, scale)
+
+    ages = _sample_ages(rng, len(ids), 'mother').astype(float)
+    ages[rng.random(len(ids)) < 0.005] = np.nan
+
+    return pd.DataFrame({'mun_id': ids, 'Ano': years, 'Idade': ages})
+
+
+def census_microdata(year: int, mun_ids: Optional[Sequence[int]] = None, scale: float = 1.0,
+                     sample_fraction: float = 0.1, seed: int = 0) -> pd.DataFrame:
+    '''
+    Returns one row per respondent of the 2000 or 2010 census sample with the columns of the migration and pyramid
+    queries before grouping: Sexo ('1' or '2'), Idade, Peso (the sample weight), plus mun_id and Origem, the
+    municipality of residence five years before for migrants (None for the others and for some migrants of unknown
+    origin) and Migrante, True for respondents who lived in another municipality. scale multiplies the number of
+    respondents.
+    '''
+
+    if year not in [2000, 2010]:
+        raise ValueError("year should be 2000 or 2010.")
+
+    rng = np.random.default_rng(seed + year)
+    mun_ids = municipality_ids(seed=seed) if mun_ids is None else np.asarray(mun_ids)
+    population = municipality_population(mun_ids, year=year, seed=seed)
+    counts = rng.poisson(population.to_numpy() * sample_fraction * scale)
+    ids = np.repeat(population.index.to_numpy(), counts)
+
+    n = len(ids)
+    weights = rng.lognormal(0, 0.2, n) / (sample_fraction * scale)
+    migrant = rng.random(n) < MIGRANT_SHARE
+    origin = np.full(n, None, dtype=object)
+    known = migrant & (rng.random(n) < 0.95)
+    origin[known] = rng.choice(mun_ids, size=known.sum(), p=population.to_numpy() / population.sum()).astype(str)
+
+    return pd.DataFrame({
+        'mun_id': ids,
+        'Sexo': rng.choice(np.array(['1', '2'], dtype=object), size=n, p=[0.49, 0.51]),
+        'Idade': _sample_ages(rng, n, 'person', year),
+        'Peso': weights,
+        'Origem': origin,
+        'Migrante': migrant,
+        })
+
+
+def census_2022_population(mun_ids: Optional[Sequence[int]] = None, seed: int = 0) -> pd.DataFrame:
+    '''
+    Returns the 2022 population by municipality, sex and five-year age group label, with the columns of
+    query_total_pop_by_sex_age_2022_batch: mun_id, Sexo ('Masculino' or 'Feminino'), Idade and Pop.
+    '''
+
+    mun_ids = municipality_ids(seed=seed) if mun_ids is None else np.asarray(mun_ids)
+    population = municipality_population(mun_ids, seed=seed).to_numpy()
+
+    shares = _age_distribution(2022)
+    starts = np.arange(0, MAX_AGE + 1, 5)
+    labels = [f'{start} a {start + 4} anos' for start in starts[:-1]] + [f'{MAX_AGE} anos ou mais']
+    label_shares = np.add.reduceat(shares, starts)
+
+    sexes = ['Feminino', 'Masculino']
+    values = population[:, np.newaxis, np.newaxis] * np.array([0.51, 0.49])[:, np.newaxis] * label_shares
+    index = pd.MultiIndex.from_product([mun_ids, sexes, labels], names=['mun_id', 'Sexo', 'Idade'])
+
+    return pd.DataFrame({'Pop': values.round().astype(np.int64).ravel()}, index=index).reset_index()
+
+
+def write_extracts(data_dir: str, mun_ids: Optional[Sequence[int]] = None, scale: float = 1.0, seed: int = 0,
+                   start_year: int = 2000, end_year: int = 2022) -> Dict[str, str]:
+    '''
+    Writes synthetic extracts of the tables in query_backend.TABLES to data_dir/dataset/table/data.parquet, with
+    basedosdados column names and types, and returns the path of each table. Use with
+    query_backend.set_backend(query_backend.DuckDBBackend(data_dir)).
+    '''
+
+    mun_ids = municipality_ids(seed=seed) if mun_ids is None else np.asarray(mun_ids)
+    tables = dict()
+
+    deaths = deaths_microdata(mun_ids, start_year, end_year, scale, seed)
+    tables['br_ms_sim.microdados'] = pd.DataFrame({
+        'ano': deaths['Ano'], 'sexo': deaths['Sexo'], 'idade': deaths['Idade'],
+        'id_municipio_residencia': deaths['mun_id'].astype(str), 'tipo_obito': '2',
+        })
+
+    births = births_microdata(mun_ids, start_year, end_year, scale, seed)
+    tables['br_ms_sinasc.microdados'] = pd.DataFrame({
+        'ano': births['Ano'], 'idade_mae': births['Idade'], 'id_municipio_residencia': births['mun_id'].astype(str),
+        })
+
+    census = census_microdata(2000, mun_ids, scale, seed=seed)
+    tables['br_ibge_censo_demografico.microdados_pessoa_2000'] = pd.DataFrame({
+        'id_municipio': census['mun_id'].astype(str), 'v0401': census['Sexo'], 'v4752': census['Idade'],
+        'p001': census['Peso'], 'v4250': census['Origem'], 'v0424': np.where(census['Migrante'], '3', '1'),
+        })
+
+    census = census_microdata(2010, mun_ids, scale, seed=seed)
+    tables['br_ibge_censo_demografico.microdados_pessoa_2010'] = pd.DataFrame({
+        'id_municipio': census['mun_id'].astype(str), 'v0601': census['Sexo'], 'v6036': census['Idade'],
+        'peso_amostral': census['Peso'], 'v6264': census['Origem'].where(census['Migrante'], None),
+        })
+
+    population = census_2022_population(mun_ids, seed)
+    tables['br_ibge_censo_2022.populacao_residente_municipio'] = pd.DataFrame({
+        'id_municipio': population['mun_id'].astype(str), 'sexo': population['Sexo'].map({'Masculino': 'Homens', 'Feminino': 'Mulheres'}),
+        'grupo_idade': population['Idade'], 'populacao_residente': population['Pop'],
+        })
+
+    residents = population.groupby('mun_id')['Pop'].sum()
+    tables['br_ibge_censo_2022.domicilio_morador_municipio'] = pd.DataFrame({
+        'id_municipio': residents.index.astype(str), 'moradores': residents.to_numpy(),
+        'domicilios': (residents.to_numpy() / np.random.default_rng(seed).normal(2.8, 0.3, len(residents))).round().astype(np.int64),
+        })
+
+    paths = dict()
+    for table_id, df in tables.items():
+        missing = set(query_backend.TABLES[table_id]) - set(df.columns)
+        if missing:
+            raise ValueError(f"Synthetic {table_id} is missing columns {missing}.")
+        path = os.path.join(data_dir, *table_id.split('.'))
+        os.makedirs(path, exist_ok=True)
+        df.to_parquet(os.path.join(path, 'data.parquet'), index=False)
+        paths[table_id] = path
+
+    return paths
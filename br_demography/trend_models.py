@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import curve_fit
+from typing import Optional, Sequence
+
+
+### Fits trend models to rate tables, such as mortality rates per 1,000 inhabitants or birth rates per 1,000 women,
+### built from municipality_deaths and municipality_births outputs: one row per municipality, sex and age group and
+### one column per year. Models with a closed form (exponential, by log-linear least squares, and linear) are fitted
+### for every row in a single array operation, the logistic model is fitted with curve_fit over a process pool.
+
+MODELS = ['Exponencial', 'Linear', 'Logístico']
+CRITERIA = ['rmse', 'aic', 'bic']
+PARAMETERS = ['Constante', 'Coeficiente', 'Ponto Médio']
+
+
+def exponential_model(x, constante, coeficiente):
+    return constante * np.exp(coeficiente * (-x))
+
+
+def linear_model(x, constante, coeficiente):
+    return coeficiente * x + constante
+
+
+def logistic_model(x, constante, coeficiente, ponto_medio):
+    return constante / (1 + np.exp(-coeficiente * (x - ponto_medio)))
+
+
+N_PARAMETERS = {'Exponencial': 2, 'Linear': 2, 'Logístico': 3}
+
+
+def _least_squares(x: np.ndarray, y: np.ndarray, mask: np.ndarray):
+    # straight line fitted to every row of y at once, using only the points where mask is True
+    w = mask.astype(float)
+    y = np.where(mask, y, 0.0)
+    s0 = w.sum(axis=1)
+    sx = (w * x).sum(axis=1)
+    sy = (w * y).sum(axis=1)
+    sxx = (w * x * x).sum(axis=1)
+    sxy = (w * x * y).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (s0 * sxy - sx * sy) / (s0 * sxx - sx * sx)
+        intercept = (sy - slope * sx) / s0
+
+    return intercept, slope
+
+
+def _outlier_mask(y: np.ndarray, mask: np.ndarray, outlier_factor: float) -> np.ndarray:
+    # same rule as the mortality notebook: points beyond outlier_factor interquartile ranges from the quartiles
+    values = np.where(mask, y, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        q1, q3 = np.nanpercentile(values, [25, 75], axis=1, keepdims=True)
+    iqr = q3 - q1
+
+    return mask & (y >= q1 - outlier_factor * iqr) & (y <= q3 + outlier_factor * iqr)
+
+
+def _fit_logistic_rows(x: np.ndarray, y: np.ndarray, mask: np.ndarray, maxfev: int) -> np.ndarray:
+    params = np.full((y.shape[0], 3), np.nan)
+    for i in range(y.shape[0]):
+        xi, yi = x[mask[i]], y[i, mask[i]]
+        if len(xi) <= 3:
+            continue
+        trend = np.sign(np.polyfit(xi, yi, 1)[0]) or 1.0
+        p0 = [yi.max() * 1.1 if trend > 0 else yi.max(), 0.1 * trend, np.median(xi)]
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                params[i], _ = curve_fit(logistic_model, xi, yi, p0=p0, maxfev=maxfev)
+        except (RuntimeError, ValueError):
+            pass
+
+    return params
+
+
+def _fit_logistic(x: np.ndarray, y: np.ndarray, mask: np.ndarray, n_jobs: Optional[int], maxfev: int) -> np.ndarray:
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or y.shape[0] < 2 * n_jobs:
+        return _fit_logistic_rows(x, y, mask, maxfev)
+
+    chunks = np.array_split(np.arange(y.shape[0]), n_jobs * 4)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = executor.map(_fit_logistic_rows, [x] * len(chunks), [y[c] for c in chunks], [mask[c] for c in chunks], [maxfev] * len(chunks))
+
+    return np.concatenate(list(results), axis=0)
+
+
+def _predict(model: str, x: np.ndarray, params: np.ndarray) -> np.ndarray:
+    with np.errstate(over='ignore', invalid='ignore'):
+        if model == 'Exponencial':
+            return exponential_model(x, params[:, [0]], params[:, [1]])
+        if model == 'Linear':
+            return linear_model(x, params[:, [0]], params[:, [1]])
+        return logistic_model(x, params[:, [0]], params[:, [1]], params[:, [2]])
+
+
+def fit_trend_models(rates: pd.DataFrame, models: Sequence[str] = tuple(MODELS), criterion: str = 'rmse',
+                     base_year: int = 2000, drop_zeros: bool = True, outlier_factor: Optional[float] = None,
+                     n_jobs: Optional[int] = None, maxfev: int = 10000) -> pd.DataFrame:
+    '''
+    Fits trend models to every row of a rate table and returns, for each row, the model selected by criterion.
+
+    Requires:
+        -> rates, a DataFrame with one row per cell (e.g. municipality, sex and age group) and one column per year;
+        -> models, the models to try, among 'Exponencial', 'Linear' and 'Logístico';
+        -> criterion, 'rmse', 'aic' or 'bic', the smallest value wins;
+        -> base_year, years are counted from it, as in the notebooks (x = year - 2000);
+        -> drop_zeros, if True, years with rate 0 are left out of the fit, as in the mortality notebook;
+        -> outlier_factor, if given, years beyond outlier_factor interquartile ranges are left out (1.2 in the notebook);
+        -> n_jobs, the number of processes for the logistic fit, all cpus by default.
+
+    Returns a DataFrame with the same index as rates and the columns Tipo de Modelo, Constante, Coeficiente,
+    Ponto Médio (logistic model only), N (points used) and the criterion. Rows without enough points get Tipo de
+    Modelo None.
+    '''
+
+    unknown = set(models) - set(MODELS)
+    if unknown:
+        raise ValueError(f"Unknown models {unknown}. Models should be in {MODELS}.")
+    if criterion not in CRITERIA:
+        raise ValueError(f"criterion should be one of {CRITERIA}.")
+
+    x = rates.columns.astype(int).to_numpy() - base_year
+    y = rates.to_numpy(dtype=float)
+    mask = np.isfinite(y)
+    if drop_zeros:
+        mask &= y > 0
+    if outlier_factor is not None:
+        mask &= _outlier_mask(y, mask, outlier_factor)
+    n = mask.sum(axis=1)
+
+    scores = dict()
+    params = dict()
+    for model in models:
+        if model == 'Logístico':
+            model_params = _fit_logistic(x, y, mask, n_jobs, maxfev)
+        elif model == 'Exponencial':
+            positive = mask & (y > 0)
+            with np.errstate(divide='ignore'):
+                intercept, slope = _least_squares(x, np.log(np.where(positive, y, 1.0)), positive)
+            model_params = np.column_stack([np.exp(intercept), -slope, np.full(len(y), np.nan)])
+        else:
+            intercept, slope = _least_squares(x, y, mask)
+            model_params = np.column_stack([intercept, slope, np.full(len(y), np.nan)])
+
+        residuals = np.where(mask, y - _predict(model, x, model_params), 0.0)
+        sse = (residuals ** 2).sum(axis=1)
+        k = N_PARAMETERS[model]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if criterion == 'rmse':
+                score = np.sqrt(sse / n)
+            elif criterion == 'aic':
+                score = n * np.log(sse / n) + 2 * k
+            else:
+                score = n * np.log(sse / n) + k * np.log(n)
+        valid = (n > k) & np.all(np.isfinite(model_params[:, :k]), axis=1)
+        scores[model] = np.where(valid & ~np.isnan(score), score, np.inf)
+        params[model] = model_params
+
+    score_table = np.column_stack([scores[model] for model in models])
+    best = score_table.argmin(axis=1)
+    fitted = np.isfinite(score_table[np.arange(len(y)), best])
+
+    result = pd.DataFrame(index=rates.index)
+    result['Tipo de Modelo'] = np.where(fitted, np.asarray(models, dtype=object)[best], None)
+    chosen = np.stack([params[model] for model in models], axis=0)[best, np.arange(len(y))]
+    for i, name in enumerate(PARAMETERS):
+        result[name] = np.where(fitted, chosen[:, i], np.nan)
+    result['N'] = n
+    result[criterion.upper()] = np.where(fitted, score_table[np.arange(len(y)), best], np.nan)
+
+    return result
+
+
+def project_rates(params: pd.DataFrame, years: Sequence[int], base_year: int = 2000) -> pd.DataFrame:
+    '''
+    Takes the DataFrame returned by fit_trend_models and returns the projected rates, with the same index and one
+    column per year.
+    '''
+
+    x = np.asarray(years, dtype=float) - base_year
+    values = np.full((len(params), len(x)), np.nan)
+    model_params = params[PARAMETERS].to_numpy(dtype=float)
+    for model in MODELS:
+        rows = (params['Tipo de Modelo'] == model).to_numpy()
+        if rows.any():
+            values[rows] = _predict(model, x, model_params[rows])
+
+    return pd.DataFrame(values, index=params.index, columns=list(years))
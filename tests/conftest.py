@@ -0,0 +1,33 @@
+import pytest
+
+from br_demography import query_backend, synthetic
+
+MUN_IDS = synthetic.municipality_ids(n_municipalities=4)
+
+
+@pytest.fixture
+def mun_ids():
+    return [int(mun_id) for mun_id in MUN_IDS]
+
+
+@pytest.fixture
+def use_backend(monkeypatch):
+    # makes a backend the active one for a single test
+    def use(backend):
+        monkeypatch.setattr(query_backend, '_backend', backend)
+        return backend
+
+    return use
+
+
+@pytest.fixture(scope='session')
+def extracts(tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp('extracts'))
+    synthetic.write_extracts(data_dir, mun_ids=MUN_IDS, scale=0.05, start_year=2010, end_year=2022)
+
+    return data_dir
+
+
+@pytest.fixture
+def duckdb_backend(extracts, use_backend):
+    return use_backend(query_backend.DuckDBBackend(extracts))
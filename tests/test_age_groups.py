@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+from br_demography import age_groups, synthetic
+
+MUN_IDS = synthetic.municipality_ids(n_municipalities=3)
+SINGLE_YEAR_SCHEMES = ['censo_2000_2010', 'censo_2000_2010_65_anos_mais', 'maes']
+LABEL_SCHEMES = ['censo_2022', 'censo_2022_65_anos_mais']
+
+
+def _assert_regroup_matches_group_ages(df, schemes, by, value_column=None):
+    results = age_groups.regroup(df, schemes, by=by, value_column=value_column)
+
+    assert list(results) == schemes
+    for scheme in schemes:
+        expected = age_groups.group_ages(df, age_groups.SCHEMES[scheme], by=by, value_column=value_column)
+        pd.testing.assert_frame_equal(results[scheme], expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('value_column', [None, 'Peso'])
+def test_regroup_of_census_ages_matches_group_ages(value_column):
+    df = synthetic.census_microdata(2010, mun_ids=MUN_IDS, scale=0.05)
+
+    _assert_regroup_matches_group_ages(df, SINGLE_YEAR_SCHEMES, ['mun_id', 'Sexo'], value_column)
+
+
+def test_regroup_of_deaths_with_missing_ages_matches_group_ages():
+    df = synthetic.deaths_microdata(mun_ids=MUN_IDS, start_year=2019, end_year=2020, scale=1)
+
+    assert df['Idade'].isna().any()
+    _assert_regroup_matches_group_ages(df, SINGLE_YEAR_SCHEMES, ['mun_id', 'Ano', 'Sexo'])
+
+
+def test_regroup_of_2022_labels_matches_group_ages():
+    df = synthetic.census_2022_population(mun_ids=MUN_IDS)
+
+    _assert_regroup_matches_group_ages(df, LABEL_SCHEMES, ['mun_id', 'Sexo'], 'Pop')
+
+
+def test_regroup_keys_results_by_the_schemes_as_given():
+    df = synthetic.census_microdata(2010, mun_ids=MUN_IDS[:1], scale=0.05)
+    scheme = age_groups.load_scheme(age_groups.SCHEMES['maes'])
+
+    results = age_groups.regroup(df, [scheme, age_groups.SCHEMES['censo_2000_2010']], by=['Sexo'])
+
+    assert list(results) == [scheme.path, age_groups.SCHEMES['censo_2000_2010']]
+    assert results[scheme.path]['Contagem'].sum() == df['Idade'].between(10, 49).sum()
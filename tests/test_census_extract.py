@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from br_demography import census_extract, municipality_migration
+
+CURITIBA, TOLEDO = 4106902, 4127700
+
+
+def _aggregates():
+    # people of both municipalities, one of them arrived from Toledo, and a Curitiba emigrant living elsewhere
+    return pd.DataFrame({
+        'mun_id': [str(CURITIBA), str(CURITIBA), str(CURITIBA), str(TOLEDO), None],
+        'Origem': [None, None, str(TOLEDO), None, str(CURITIBA)],
+        'Sexo': ['1', '2', '2', '1', '1'],
+        'Idade': [30, 30, 40, 5, 25],
+        'Peso': [10.0, 12.0, 3.0, 7.0, 4.0],
+        'Imigrantes': [0.0, 2.0, 3.0, 0.0, 0.0],
+    })
+
+
+def test_split_census_aggregates_sums_each_metric():
+    tables = census_extract.split_census_aggregates(_aggregates(), 2010)
+
+    assert list(tables) == census_extract.METRICS
+    assert tables['populacao_total'].set_index('mun_id')['Peso'].to_dict() == {CURITIBA: 25.0, TOLEDO: 7.0}
+    assert tables['moradores'].equals(tables['populacao_total'])
+    assert tables['populacao']['Sexo'].tolist() == ['Masculino', 'Feminino', 'Feminino', 'Masculino']
+    assert tables['populacao']['Peso'].sum() == 32.0
+
+    immigration = tables['imigracao']
+    assert immigration.columns.tolist() == ['mun_id', 'Peso', 'Sexo', 'Idade']
+    assert immigration[['mun_id', 'Idade', 'Peso']].values.tolist() == [[CURITIBA, 30, 2.0], [CURITIBA, 40, 3.0]]
+
+    emigration = tables['emigracao']
+    assert emigration[['mun_id', 'Idade', 'Peso']].values.tolist() == [[CURITIBA, 25, 4.0], [TOLEDO, 40, 3.0]]
+
+
+def test_household_residents_are_only_split_for_2010():
+    assert 'moradores' not in census_extract.split_census_aggregates(_aggregates(), 2000)
+
+
+def test_municipality_tables_match_the_single_municipality_queries(duckdb_backend, mun_ids):
+    tables = census_extract.extract_census(2010, mun_ids, project_id=None)
+
+    for mun_id in mun_ids:
+        rows = census_extract.municipality_tables(tables, mun_id)
+        total = municipality_migration.query_total_population(mun_id, None)
+        emigration = municipality_migration.query_emigration_by_sex_age(mun_id, None)
+        immigration = municipality_migration.query_immigration_by_sex_age(mun_id, None)
+
+        assert rows['populacao_total']['Peso'].sum() == pytest.approx(total.iloc[0, 0])
+        pd.testing.assert_frame_equal(rows['emigracao'], emigration[rows['emigracao'].columns], check_dtype=False)
+        pd.testing.assert_frame_equal(rows['imigracao'], immigration[rows['imigracao'].columns], check_dtype=False)
+
+
+def test_unknown_census_year_is_refused():
+    with pytest.raises(ValueError):
+        census_extract.query_census_aggregates(1991, [CURITIBA], project_id=None)
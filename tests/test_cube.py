@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from br_demography import cube
+
+
+def _cube():
+    values = np.arange(2 * 2 * 3 * 4, dtype=float).reshape(2, 2, 3, 4)
+    return cube.PopulationCube(values, [4106902, 4119152], ['Feminino', 'Masculino'],
+                               ['0 a 9 anos', '10 a 19 anos', '20 anos ou mais'], [2000, 2010, 2022, 2032])
+
+
+def test_isel_negative_positions():
+    c = _cube()
+    selected = c.isel(years=[-2, -1])
+    assert selected.shape == (2, 2, 3, 2)
+    assert list(selected.years) == [2022, 2032]
+    assert np.shares_memory(selected.values, c.values)
+    assert list(c.isel(years=-1).years) == [2032]
+    with pytest.raises(ValueError):
+        c.isel(years=[4])
+
+
+def test_arithmetic_requires_equal_labels():
+    c = _cube()
+    with pytest.raises(ValueError):
+        c.sel(mun_ids=4106902) + c.sel(mun_ids=4119152)
+    with pytest.raises(ValueError):
+        c.sel(years=2022) - c.sel(years=2032)
+    with pytest.raises(ValueError):
+        c.sel(mun_ids=4106902) + c
+
+
+def test_sums_broadcast():
+    c = _cube()
+    shares = c / c.sum('Faixa Etária')
+    assert shares.shape == c.shape
+    np.testing.assert_allclose(shares.values.sum(axis=2), 1)
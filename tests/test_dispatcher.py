@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+from br_demography import dispatcher
+
+
+def query_flaky_2010(mun_id, failures, calls):
+    # fails the first failures[mun_id] calls of each municipality, returning None once before raising
+    calls[mun_id] = calls.get(mun_id, 0) + 1
+    if calls[mun_id] == 1 and failures[mun_id]:
+        return None
+    if calls[mun_id] <= failures[mun_id]:
+        raise ConnectionError(f'attempt {calls[mun_id]}')
+
+    return pd.DataFrame({'mun_id': [mun_id]})
+
+
+def test_failed_calls_are_retried_and_results_keep_the_task_order():
+    failures, calls = {3: 2, 1: 0, 2: 1}, dict()
+    tasks = dispatcher.expand_tasks([query_flaky_2010], [3, 1, 2], failures=failures, calls=calls)
+
+    results = dispatcher.dispatch(tasks, max_workers=3, retries=2, backoff=0)
+
+    assert list(results) == [('query_flaky_2010', mun_id, 2010) for mun_id in [3, 1, 2]]
+    assert [df['mun_id'].item() for df in results.values()] == [3, 1, 2]
+    assert calls == {3: 3, 1: 1, 2: 2}
+
+
+def test_tasks_failing_every_retry_raise_dispatch_error_with_the_others():
+    failures, calls = {1: 5, 2: 0}, dict()
+    tasks = dispatcher.expand_tasks([query_flaky_2010], [1, 2], failures=failures, calls=calls)
+
+    with pytest.raises(dispatcher.DispatchError) as error:
+        dispatcher.dispatch(tasks, retries=1, backoff=0)
+
+    assert list(error.value.errors) == [('query_flaky_2010', 1, 2010)]
+    assert isinstance(error.value.errors[('query_flaky_2010', 1, 2010)], ConnectionError)
+    assert list(error.value.results) == [('query_flaky_2010', 2, 2010)]
+    assert calls[1] == 2
+
+
+def test_errors_not_in_retry_on_fail_at_once_and_map_to_none():
+    failures, calls = {1: 5}, dict()
+    tasks = [dispatcher.task(query_flaky_2010, 1, failures=failures, calls=calls)]
+
+    results = dispatcher.dispatch(tasks, retries=3, backoff=0, retry_on=(ValueError,), raise_errors=False)
+
+    assert results == {('query_flaky_2010', 1, 2010): None}
+    assert calls[1] == 1
+
+
+def test_duplicated_keys_raise():
+    tasks = [dispatcher.task(query_flaky_2010, 1), dispatcher.task(query_flaky_2010, 1)]
+
+    with pytest.raises(ValueError):
+        dispatcher.dispatch(tasks)
@@ -0,0 +1,69 @@
+import os
+
+import pandas as pd
+import pytest
+
+from br_demography import incremental, query_backend, result_store
+
+KEYS = ['mun_id', 'Ano', 'Sexo', 'Idade']
+
+
+def _whole(mun_ids, start_year, end_year):
+    df = incremental.query_series('br_ms_sim', [str(mun_id) for mun_id in mun_ids], 'project', start_year, end_year)
+    return df.astype({'mun_id': str}).sort_values(KEYS, na_position='first').reset_index(drop=True)
+
+
+def _series(root, start_year=None, end_year=None):
+    df = incremental.read_series('br_ms_sim', start_year=start_year, end_year=end_year, root=root)
+    return df.sort_values(KEYS, na_position='first').reset_index(drop=True)
+
+
+def test_refresh_fetches_only_the_revision_window_after_the_watermark(duckdb_backend, mun_ids, tmp_path):
+    root = str(tmp_path)
+    first = incremental.refresh_series('br_ms_sim', mun_ids, 'project', start_year=2012, end_year=2016, root=root)
+    marks = incremental.load_watermarks(root)['br_ms_sim']
+
+    second = incremental.refresh_series('br_ms_sim', mun_ids, 'project', start_year=2012, end_year=2020,
+                                        revision_years=2, root=root)
+
+    assert first['Ano Inicial'].tolist() == [2012]
+    assert {mark['last_year'] for mark in marks.values()} == {2016}
+    assert second['Ano Inicial'].tolist() == [2015] # 2015 and 2016 are fetched again as revisions
+    assert second['Municípios'].tolist() == [len(mun_ids)]
+    pd.testing.assert_frame_equal(_series(root), _whole(mun_ids, 2012, 2020), check_dtype=False)
+
+
+def test_revised_years_replace_the_years_loaded(duckdb_backend, mun_ids, tmp_path):
+    root = str(tmp_path)
+    incremental.refresh_series('br_ms_sim', mun_ids, 'project', start_year=2012, end_year=2016, root=root)
+    series = pd.read_parquet(os.path.join(root, 'br_ms_sim.parquet'))
+    series.loc[series['Ano'] == 2016, 'Óbitos'] += 1000 # preliminary counts, revised at the source
+    series.to_parquet(os.path.join(root, 'br_ms_sim.parquet'), index=False)
+
+    incremental.refresh_series('br_ms_sim', mun_ids, 'project', start_year=2012, end_year=2016, revision_years=1,
+                               root=root)
+
+    pd.testing.assert_frame_equal(_series(root), _whole(mun_ids, 2012, 2016), check_dtype=False)
+
+
+def test_municipalities_loaded_from_a_later_year_are_fetched_from_start_year(mun_ids):
+    watermarks = {str(mun_ids[0]): {'first_year': 2015, 'last_year': 2020},
+                  str(mun_ids[1]): {'first_year': 2010, 'last_year': 2020}}
+
+    plan = incremental._fetch_plan(watermarks, [str(mun_id) for mun_id in mun_ids[:3]], 2010, 2)
+
+    assert plan == {2010: [str(mun_ids[0]), str(mun_ids[2])], 2019: [str(mun_ids[1])]}
+
+
+def test_default_series_directory_is_one_per_backend(duckdb_backend, mun_ids, use_backend, tmp_path, monkeypatch):
+    monkeypatch.delenv('BR_DEMOGRAPHY_SERIES_DIR', raising=False)
+    monkeypatch.setattr(result_store, 'STORE_DIR', str(tmp_path))
+    incremental.refresh_series('br_ms_sim', mun_ids, 'project', start_year=2012, end_year=2016)
+    duckdb_dir = incremental.series_dir()
+
+    use_backend(query_backend.BigQueryBackend())
+
+    assert os.path.exists(os.path.join(duckdb_dir, 'br_ms_sim.parquet'))
+    assert os.path.dirname(duckdb_dir) == os.path.join(str(tmp_path), 'series')
+    with pytest.raises(FileNotFoundError): # the series loaded from the extracts are not BigQuery series
+        incremental.read_series('br_ms_sim')
@@ -0,0 +1,20 @@
+import numpy as np
+
+from br_demography import indicators
+
+
+def _table(labels, rates):
+    starts, widths = indicators.age_bounds(labels)
+    return indicators._life_table(np.asarray([rates], dtype=float), starts, widths, np.asarray([1.0]))
+
+
+def test_wide_first_age_group_gets_infant_separation_factors():
+    table = _table(['0 a 9 anos', '10 a 59 anos', '60 anos ou mais'], [0.002, 0.003, 0.05])
+
+    assert 0 < table['nax'][0, 0] < 2 # most deaths of the group are infants, not at the midpoint 5
+
+
+def test_open_group_without_deaths_has_no_life_expectancy():
+    table = _table(['0 a 9 anos', '10 a 59 anos', '60 anos ou mais'], [0.002, 0.003, 0.0])
+
+    assert np.isnan(table['ex'][0, 0])
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from br_demography import interpolation
+
+
+def _census():
+    return pd.DataFrame({2000: [1000, 500, 0], 2010: [2000, 400, 100], 2022: [4000, 600, 300]},
+                        index=['cresce', 'oscila', 'zero'])
+
+
+@pytest.mark.parametrize('method', ['linear', 'geometric'])
+def test_census_years_keep_the_census_values(method):
+    df = _census()
+
+    result = interpolation.interpolate_population(df, method=method, as_int=False)
+
+    assert result.columns.tolist() == list(range(2000, 2023))
+    pd.testing.assert_frame_equal(result[[2000, 2010, 2022]], df.astype(float))
+
+
+def test_linear_and_geometric_midpoints():
+    df = _census()
+
+    linear = interpolation.interpolate_population(df, years=[2005], method='linear', as_int=False)
+    geometric = interpolation.interpolate_population(df, years=[2005], method='geometric', as_int=False)
+
+    assert linear[2005].tolist() == pytest.approx([1500, 450, 50])
+    # geometric growth from 0 cannot be computed and is 0
+    assert geometric[2005].tolist() == pytest.approx([1000 * 2 ** 0.5, 500 * 0.8 ** 0.5, 0])
+
+
+def test_years_out_of_range_use_the_first_or_last_period():
+    df = _census()
+
+    result = interpolation.interpolate_population(df, years=[1990, 2032], method='linear', as_int=False)
+
+    assert result[1990].tolist() == pytest.approx([0, 600, 0]) # negative extrapolations are 0
+    assert result[2032].tolist() == pytest.approx([4000 + 2000 * 10 / 12, 600 + 200 * 10 / 12, 300 + 200 * 10 / 12])
+
+
+def test_exponential_fits_exact_growth_through_every_census():
+    df = pd.DataFrame({2000: [1000.0], 2010: [1000 * np.exp(0.2)], 2022: [1000 * np.exp(0.44)]})
+
+    result = interpolation.interpolate_population(df, method='exponential', as_int=False)
+
+    assert result.iloc[0].tolist() == pytest.approx(1000 * np.exp(0.02 * np.arange(23)))
+
+
+def test_growth_rates_by_period():
+    rates = interpolation.growth_rates(_census())
+
+    assert rates.columns.tolist() == ['2000 a 2010', '2010 a 2022']
+    assert rates.loc['cresce'].tolist() == pytest.approx([2 ** 0.1 - 1, 2 ** (1 / 12) - 1])
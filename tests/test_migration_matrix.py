@@ -0,0 +1,39 @@
+import os
+
+import pandas as pd
+
+from br_demography import migration_matrix
+
+AGE_GROUPS = os.path.join(os.path.dirname(migration_matrix.__file__), 'source', 'tab',
+                          'faixas_etarias_censo_2000_2010.csv')
+
+
+def _matrix():
+    # 2000 records with an origin but not counted as immigrants (Imigrantes 0) leave the origin, never arrive
+    df = pd.DataFrame({
+        'Origem': ['4106902', '4106902', '4119152', None],
+        'Destino': ['4119152', '4119152', '4106902', '4106902'],
+        'Sexo': ['1', '2', '2', '1'],
+        'Idade': [30, 30, 40, 20],
+        'Peso': [10.0, 5.0, 2.0, 3.0],
+        'Imigrantes': [10.0, 0.0, 2.0, 3.0],
+    })
+
+    return migration_matrix.MigrationMatrix.from_flows(df, 2000, AGE_GROUPS)
+
+
+def test_immigration_counts_only_immigrants_and_emigration_every_origin():
+    matrix = _matrix()
+
+    immigration = matrix.immigration().groupby('mun_id')['Peso'].sum()
+    emigration = matrix.emigration().groupby('mun_id')['Peso'].sum()
+
+    assert immigration.to_dict() == {4106902: 5.0, 4119152: 10.0}
+    assert emigration.to_dict() == {4106902: 15.0, 4119152: 2.0}
+
+
+def test_region_leaves_internal_flows_out():
+    matrix = _matrix()
+
+    assert matrix.immigration([4106902, 4119152], as_region=True)['Peso'].sum() == 3.0
+    assert matrix.emigration([4106902, 4119152], as_region=True)['Peso'].sum() == 0.0
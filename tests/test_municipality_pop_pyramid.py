@@ -0,0 +1,12 @@
+import pytest
+
+from br_demography import census_extract, municipality_pop_pyramid
+
+
+@pytest.mark.parametrize('mun_ids', [[], 4106902, ['4106902'], [4106902, None]])
+def test_batch_queries_reject_invalid_mun_ids(mun_ids):
+    # the check runs before any query, so no backend is needed
+    with pytest.raises(ValueError):
+        municipality_pop_pyramid.query_total_pop_by_sex_age_2010_batch(mun_ids, 'project')
+    with pytest.raises(ValueError):
+        census_extract.query_census_aggregates(2010, mun_ids, 'project')
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from br_demography import pipeline, query_backend
+
+
+@pytest.fixture
+def store(duckdb_backend, mun_ids, tmp_path):
+    # populacao and its upstream stages run once on the synthetic extracts
+    municipalities = tmp_path / 'municipios.csv'
+    pd.DataFrame({'mun_id': mun_ids, 'mun': [f'Município {i}' for i in range(len(mun_ids))]}).to_csv(
+        municipalities, sep=';', index=False)
+    parameters = {'municipalities': str(municipalities), 'series_dir': str(tmp_path / 'series')}
+    root = str(tmp_path / 'store')
+    pipeline.run_pipeline(parameters, targets=['populacao'], root=root, verbose=False)
+
+    return parameters, root
+
+
+def _stages_to_run(parameters, root, **kwargs):
+    df = pipeline.plan(parameters, targets=['populacao'], root=root, **kwargs)
+    return df.loc[df['run'], 'stage'].tolist()
+
+
+def test_stages_run_once_then_come_from_the_store(store):
+    parameters, root = store
+
+    result = pipeline.run_pipeline(parameters, targets=['populacao'], root=root, verbose=False)
+
+    assert _stages_to_run(parameters, root) == []
+    assert result['status'].tolist() == ['em cache'] * 3
+    assert pipeline.load_manifest(root)['rmc'].keys() == {'populacao_idade_simples', 'populacao_censos', 'populacao'}
+
+
+def test_changing_a_parameter_runs_only_the_stages_downstream(store):
+    parameters, root = store
+
+    assert _stages_to_run({**parameters, 'interpolation_method': 'linear'}, root) == ['populacao']
+    assert _stages_to_run({**parameters, 'age_groups': pipeline.DEFAULT_PARAMETERS['age_groups_2022']}, root) == [
+        'populacao_censos', 'populacao']
+
+
+def test_data_version_backend_and_force_run_the_query_stages_again(store, use_backend):
+    parameters, root = store
+    every_stage = ['populacao_idade_simples', 'populacao_censos', 'populacao']
+
+    assert _stages_to_run({**parameters, 'data_version': '2024-06'}, root) == every_stage
+    assert _stages_to_run(parameters, root, force=pipeline.DATA_STAGES) == every_stage
+    use_backend(query_backend.BigQueryBackend())
+    assert _stages_to_run(parameters, root) == every_stage
+
+
+def test_fingerprints_ignore_billing_project_and_unknown_stages_raise(store):
+    parameters, root = store
+
+    assert _stages_to_run({**parameters, 'project_id': 'outro-projeto'}, root) == []
+    with pytest.raises(ValueError):
+        pipeline.plan(parameters, targets=['populacao_desconhecida'], root=root)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from br_demography import projection
+
+S = 0.99 ** 10 # survival over a ten-year step at 1% deaths a year
+
+
+def _inputs():
+    population = np.array([[[100.0, 200.0, 300.0], [90.0, 180.0, 270.0]]]) # Feminino, Masculino
+    survival = np.full((1, 2, 3, 20), 0.99)
+    fertility = np.zeros((1, 3, 20))
+    fertility[:, 1] = 50 # births per 1,000 women of the middle age group, a year
+
+    return population, survival, fertility
+
+
+def test_two_steps_match_a_hand_computed_leslie_projection():
+    population, survival, fertility = _inputs()
+
+    result = projection.project_population(population, survival, fertility, base_year=2000, horizon=2020)
+
+    # births use the women at the start of the step: 200 * 0.05 * 10 = 100, then 100 * S * 0.05 * 10 = 50 * S
+    expected_2010 = [[49, 100 * S, 500 * S], [51, 90 * S, 450 * S]]
+    expected_2020 = [[0.49 * 50 * S, 49 * S, 600 * S ** 2], [0.51 * 50 * S, 51 * S, 540 * S ** 2]]
+    assert result.shape == (1, 2, 3, 3)
+    np.testing.assert_allclose(result[0, ..., 0], population[0])
+    np.testing.assert_allclose(result[0, ..., 1], expected_2010)
+    np.testing.assert_allclose(result[0, ..., 2], expected_2020)
+
+
+def test_net_migrants_of_the_step_are_added_at_its_end():
+    population, survival, fertility = _inputs()
+    migration = np.zeros((1, 2, 3, 20))
+    migration[:, :, 2] = 1.0
+
+    without = projection.project_population(population, survival, fertility, base_year=2000, horizon=2010)
+    result = projection.project_population(population, survival, fertility, migration=migration, base_year=2000,
+                                           horizon=2010)
+
+    np.testing.assert_allclose(result[..., 1] - without[..., 1], migration[..., :10].sum(axis=-1))
+
+
+def test_promotion_matrix_moves_a_share_of_each_group():
+    matrix = projection.leslie_promotion_matrix(3, step=5, age_group_width=10)
+
+    np.testing.assert_allclose(matrix, [[0.5, 0, 0], [0.5, 0.5, 0], [0, 0.5, 1]])
+    with pytest.raises(ValueError):
+        projection.leslie_promotion_matrix(3, step=20, age_group_width=10)
+
+
+def test_missing_rate_years_raise():
+    population, survival, fertility = _inputs()
+
+    with pytest.raises(ValueError):
+        projection.project_population(population, survival[..., :15], fertility[..., :15], base_year=2000,
+                                      horizon=2020)
@@ -0,0 +1,107 @@
+import itertools
+import time
+
+import pandas as pd
+import pytest
+
+from br_demography import query_cache
+
+DEATHS = "SELECT ano FROM br_ms_sim.microdados WHERE ano = {year}"
+
+
+class CountingBackend:
+    # a cacheable backend returning a small frame per query and counting the queries it runs
+    name = 'counting'
+    cacheable = True
+
+    def __init__(self):
+        self.queries = list()
+
+    def read_sql(self, query, billing_project_id=None):
+        self.queries.append(query)
+        return pd.DataFrame({'query': [query] * 50, 'value': range(50)})
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch, use_backend):
+    monkeypatch.setattr(query_cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(query_cache, 'ENABLED', True)
+    monkeypatch.setattr(query_cache, 'OFFLINE', False)
+    monkeypatch.setattr(query_cache, 'MAX_CACHE_BYTES', 10 ** 9)
+    clock = itertools.count(time.time())
+    monkeypatch.setattr(query_cache.time, 'time', lambda: next(clock)) # a second between every access
+    query_cache.reset_stats()
+
+    return use_backend(CountingBackend())
+
+
+def test_hit_after_miss_and_same_entry_for_reformatted_sql(backend):
+    first = query_cache.read_sql(DEATHS.format(year=2020), 'project')
+    second = query_cache.read_sql('  SELECT ano\nFROM br_ms_sim.microdados -- deaths\n WHERE ano = 2020;', 'project')
+
+    assert len(backend.queries) == 1
+    pd.testing.assert_frame_equal(first, second)
+    stats = query_cache.cache_stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_expired_entry_is_queried_again(backend):
+    query_cache.read_sql(DEATHS.format(year=2020), 'project')
+    index = query_cache._load_index()
+    for entry in index.values():
+        entry['expires'] = 0
+    query_cache._save_index(index)
+
+    query_cache.read_sql(DEATHS.format(year=2020), 'project')
+
+    assert len(backend.queries) == 2
+    assert query_cache.cache_stats()['expired'] == 1
+
+
+def test_use_cache_false_runs_the_query_again(backend):
+    query_cache.read_sql(DEATHS.format(year=2020), 'project')
+    query_cache.read_sql(DEATHS.format(year=2020), 'project', use_cache=False)
+
+    assert len(backend.queries) == 2
+
+
+def test_least_recently_used_entry_is_evicted(backend, monkeypatch):
+    query_cache.read_sql(DEATHS.format(year=2018), 'project')
+    size = query_cache.cache_stats()['size']
+    monkeypatch.setattr(query_cache, 'MAX_CACHE_BYTES', int(2.5 * size))
+    query_cache.read_sql(DEATHS.format(year=2019), 'project')
+    query_cache.read_sql(DEATHS.format(year=2018), 'project') # 2019 is now the least recently used
+
+    query_cache.read_sql(DEATHS.format(year=2020), 'project')
+    cached = [entry['query'] for entry in query_cache._load_index().values()]
+
+    assert query_cache.cache_stats()['evictions'] == 1
+    assert sorted(cached) == sorted(query_cache.normalize_sql(DEATHS.format(year=year)) for year in [2018, 2020])
+
+
+def test_offline_miss_raises_and_offline_hit_is_answered(backend, monkeypatch):
+    query_cache.read_sql(DEATHS.format(year=2020), 'project')
+    monkeypatch.setattr(query_cache, 'OFFLINE', True)
+
+    assert len(query_cache.read_sql(DEATHS.format(year=2020), 'project')) == 50
+    with pytest.raises(query_cache.OfflineCacheMissError):
+        query_cache.read_sql(DEATHS.format(year=2021), 'project')
+    assert len(backend.queries) == 1
+
+
+def test_result_is_returned_when_it_cannot_be_cached(backend, monkeypatch):
+    def fail(*args):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(query_cache, '_write_cached', fail)
+
+    with pytest.warns(UserWarning, match='could not be cached'):
+        df = query_cache.read_sql(DEATHS.format(year=2020), 'project')
+
+    assert len(df) == 50
+
+
+def test_query_ttl_is_the_shortest_of_the_sources_read():
+    assert query_cache.query_ttl('SELECT * FROM br_ibge_censo_demografico.x') is None
+    assert query_cache.query_ttl('SELECT * FROM br_ms_sim.x JOIN br_ibge_censo_2022.y') == \
+        query_cache.SOURCE_TTL['br_ms_sim']
@@ -0,0 +1,15 @@
+import numpy as np
+import pandas as pd
+
+from br_demography import regions
+
+
+def test_rollup_skips_missing_values_and_keeps_all_missing_cells_nan():
+    mun_ids = [4106902, 4119152]
+    hierarchy = regions.RegionHierarchy.from_groupings(mun_ids, {'total': pd.Series('Total', index=mun_ids)})
+    df = pd.DataFrame({2010: [1.0, np.nan], 2022: [np.nan, np.nan]}, index=pd.Index(mun_ids, name='mun_id'))
+
+    result = hierarchy.rollup(df, levels=['total'])
+
+    assert result[2010].tolist() == [1.0]
+    assert np.isnan(result[2022]).all()
@@ -0,0 +1,55 @@
+import filecmp
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from br_demography import sidra
+
+COMMITTED = [os.path.join(sidra.SOURCE_TAB, 'moradores_dppo.csv'),
+             os.path.join(sidra.SOURCE_TAB, 'domicilios', 'dppo_1991_2022.csv')]
+
+
+@pytest.fixture(scope='module')
+def source_dir(tmp_path_factory):
+    # a copy of the exports, so writing the tables never touches the committed csvs
+    tmp = tmp_path_factory.mktemp('tab')
+    for directory in ['moradores', 'domicilios']:
+        shutil.copytree(os.path.join(sidra.SOURCE_TAB, directory), tmp / directory,
+                        ignore=shutil.ignore_patterns('*.csv:*', '*.xlsx:*', '*.zip', 'dppo_*.csv'))
+
+    return str(tmp)
+
+
+@pytest.fixture(scope='module')
+def cache(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('sidra'))
+
+
+@pytest.fixture(scope='module')
+def tables(source_dir, cache):
+    return sidra.build_household_tables(source_dir, cache)
+
+
+def test_household_tables_equal_the_committed_csvs(tables):
+    for df, path in zip(tables, COMMITTED):
+        # the hand-made dppo_1991_2022.csv has the municipalities created after 2010 at the end
+        committed = pd.read_csv(path, sep=';', decimal=',', index_col='cod_mun', encoding='utf-8-sig').sort_index()
+        pd.testing.assert_frame_equal(df.astype(float, errors='ignore'), committed.astype(float, errors='ignore'),
+                                      check_dtype=False)
+
+
+def test_written_moradores_is_byte_identical_and_reuses_parsed_exports(source_dir, cache, tables):
+    parsed = sorted(os.listdir(cache))
+
+    paths = sidra.write_household_tables(source_dir, cache)
+
+    assert sorted(os.listdir(cache)) == parsed
+    assert filecmp.cmp(paths[0], COMMITTED[0], shallow=False)
+
+
+def test_six_figures_ids_are_completed():
+    # Sao Paulo from the reference ids, Brasilia with its computed check digit
+    assert sidra.complete_codes([355030, 530010], reference=[3550308]).tolist() == [3550308, 5300108]
+    assert sidra.check_digit([355030, 530010]).tolist() == [8, 8]
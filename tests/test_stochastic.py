@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from br_demography import projection, stochastic
+
+YEARS = np.arange(2000, 2020)
+AGE_GROUPS = pd.CategoricalIndex(range(9), ordered=True)
+
+
+def _inputs():
+    rng = np.random.default_rng(1)
+    index = pd.MultiIndex.from_product([[4106902, 4119152], projection.SEXES, AGE_GROUPS],
+                                       names=['mun_id', 'Sexo', 'Faixa Etária'])
+    population = pd.Series(rng.uniform(500, 5000, len(index)), index=index)
+    mortality = pd.DataFrame(rng.uniform(1, 80, (len(index), 1)) * np.exp(-0.02 * (YEARS - 2000)) *
+                             rng.lognormal(0, 0.05, (len(index), len(YEARS))), index=index, columns=YEARS)
+    women = population.xs('Feminino', level='Sexo').index
+    births = pd.DataFrame(rng.uniform(0, 90, (len(women), 1)) * rng.lognormal(0, 0.05, (len(women), len(YEARS))),
+                          index=women, columns=YEARS)
+    migration = pd.Series(rng.normal(0, 20, len(index)), index=index)
+
+    return population, mortality, births, migration
+
+
+def _simulate(memory_budget=200 * 1024, **kwargs):
+    # a budget of four draws per chunk, so ten chunks are spread over the processes
+    return np.asarray(stochastic.simulate(*_inputs(), n_draws=40, memory_budget=memory_budget, **kwargs))
+
+
+def test_draws_depend_on_the_seed_and_not_on_n_jobs():
+    serial = _simulate(n_jobs=1, seed=7)
+
+    assert serial.shape == (40, 2, 2, 9, 3)
+    np.testing.assert_array_equal(serial, _simulate(n_jobs=2, seed=7))
+    np.testing.assert_array_equal(serial, _simulate(n_jobs=1, seed=7))
+    assert not np.array_equal(serial, _simulate(n_jobs=1, seed=8))
+
+
+def test_draws_larger_than_the_budget_are_kept_on_disk():
+    draws = stochastic.simulate(*_inputs(), n_draws=40, memory_budget=10 * 1024, seed=7)
+
+    assert isinstance(draws, np.memmap)
+    assert np.isfinite(np.asarray(draws)).all()
+    np.testing.assert_array_equal(draws, stochastic.simulate(*_inputs(), n_draws=40, memory_budget=10 * 1024,
+                                                             n_jobs=2, seed=7))
+
+
+def test_bands_are_ordered_and_start_at_the_base_population():
+    population = _inputs()[0]
+
+    bands = stochastic.stochastic_projection(*_inputs(), n_draws=40, seed=7, memory_budget=200 * 1024)
+
+    assert bands.columns.tolist() == ['Média', 'P5', 'P50', 'P95']
+    assert (bands['P5'] <= bands['P50']).all() and (bands['P50'] <= bands['P95']).all()
+    base = bands.xs(2022, level='Ano')['P50']
+    assert base.to_numpy() == pytest.approx(population.sort_index().to_numpy(), rel=1e-6)
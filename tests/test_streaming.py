@@ -0,0 +1,58 @@
+import os
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from br_demography import municipality_demographic_profiling as mdp, streaming, synthetic
+
+AGE_GROUPS = os.path.join(os.path.dirname(synthetic.__file__), 'source', 'tab', 'faixas_etarias_censo_2000_2010.csv')
+
+
+def _batches(df, size):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.to_batches(max_chunksize=size)
+
+
+def test_group_counter_over_batches_equals_a_groupby_of_the_whole_frame(mun_ids):
+    df = synthetic.deaths_microdata(mun_ids=mun_ids, start_year=2020, end_year=2021, scale=0.5)
+    counter = streaming.GroupCounter(by=['mun_id', 'Ano'], value_name='Óbitos')
+
+    for batch in _batches(df, 997):
+        counter.update(batch)
+
+    expected = df.groupby(['mun_id', 'Ano']).size().rename('Óbitos').to_frame()
+    pd.testing.assert_frame_equal(counter.result(), expected, check_dtype=False)
+    assert counter.rows == len(df)
+
+
+def test_group_counter_gives_records_without_age_the_age_group_of_the_mean_age():
+    df = pd.DataFrame({'Ano': [2020] * 4, 'Idade': [5.0, 25.0, 27.0, np.nan]}) # mean age 19
+    counter = streaming.GroupCounter(by=['Ano'], age_group_csv_path=AGE_GROUPS)
+
+    for batch in _batches(df, 2):
+        counter.update(batch)
+
+    result = counter.result()['Contagem'].xs(2020, level='Ano')
+    assert result.to_dict() == {'0 a 9 anos': 1, '10 a 19 anos': 1, '20 a 29 anos': 2}
+
+
+def test_streamed_deaths_and_births_equal_the_whole_queries(duckdb_backend, mun_ids):
+    mun_ids = [str(mun_id) for mun_id in mun_ids]
+
+    deaths = mdp.stream_interest_vars(mun_ids, 'project', start_year=2015, end_year=2020, batch_size=50)
+    births = mdp.stream_births(mun_ids, 'project', start_year=2015, end_year=2020, batch_size=50)
+
+    whole = mdp.query_interest_vars(mun_ids, 'project', start_year=2015, end_year=2020)
+    expected = whole.groupby(['mun_id', 'Ano', 'Idade']).size()
+    assert deaths['Óbitos'].to_dict() == expected.to_dict()
+    assert births['Nascimentos'].sum() == len(mdp.query_births(mun_ids, 'project', start_year=2015, end_year=2020))
+
+
+def test_stream_errors_propagate(duckdb_backend, mun_ids):
+    duckdb_backend.tables['br_ms_sinasc.microdados'] = os.path.join(duckdb_backend.data_dir, 'missing.parquet')
+
+    with pytest.raises(duckdb.Error):
+        mdp.stream_births([str(mun_ids[0])], 'project', start_year=2015, end_year=2020)
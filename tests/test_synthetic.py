@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from br_demography import age_groups, municipality_births, municipality_deaths, municipality_pop_pyramid, synthetic
+
+SOURCE_TAB = os.path.join(os.path.dirname(synthetic.__file__), 'source', 'tab')
+AGE_GROUPS_2000_2010 = os.path.join(SOURCE_TAB, 'faixas_etarias_censo_2000_2010.csv')
+AGE_GROUPS_2022 = os.path.join(SOURCE_TAB, 'faixas_etarias_censo_2022.csv')
+AGE_GROUPS_MOTHERS = os.path.join(SOURCE_TAB, 'faixas_etarias_maes.csv')
+LABELS = ['0 a 9 anos', '10 a 19 anos', '20 a 29 anos', '30 a 39 anos', '40 a 49 anos', '50 a 59 anos',
+          '60 a 69 anos', '70 a 79 anos', '80 anos ou mais']
+MUN_IDS = synthetic.municipality_ids(n_municipalities=3)
+
+
+def _census(year, mun_ids=MUN_IDS[:1]):
+    df = synthetic.census_microdata(year, mun_ids=mun_ids, scale=0.05)
+    df['Sexo'] = df['Sexo'].map({'1': 'Masculino', '2': 'Feminino'})
+
+    return df
+
+
+def _expected_groups(ages, values, starts=(0, 10, 20, 30, 40, 50, 60, 70, 80)):
+    # sums of values by decade, the last one open, from the ages themselves
+    positions = np.searchsorted(starts, ages, side='right') - 1
+    return np.bincount(positions, weights=values, minlength=len(starts))
+
+
+def test_census_standard_age_groups_keep_totals_and_boundaries():
+    df = _census(2010)
+
+    result = municipality_pop_pyramid.standard_age_groups(df, AGE_GROUPS_2000_2010, 2010)
+
+    assert result.index.get_level_values('Faixa Etária').unique().astype(str).tolist() == LABELS
+    for sex, people in df.groupby('Sexo'):
+        expected = _expected_groups(people['Idade'].to_numpy(), people['Peso'].to_numpy())
+        assert result.xs(sex, level='Sexo')['Pop'].to_numpy() == pytest.approx(expected, abs=0.5)
+
+
+def test_concatenate_treated_dfs_has_one_column_per_census():
+    dfs = [municipality_pop_pyramid.standard_age_groups(_census(year), AGE_GROUPS_2000_2010, year)
+           for year in [2000, 2010]]
+
+    result = municipality_pop_pyramid.concatenate_treated_dfs(dfs)
+
+    assert result.columns.tolist() == [2000, 2010]
+    assert len(result) == 2 * len(LABELS)
+    for year, df in zip([2000, 2010], dfs):
+        assert result[year].sum() == df['Pop'].sum()
+
+
+def test_batch_tables_keep_the_population_of_every_municipality():
+    df_2010 = _census(2010, MUN_IDS).groupby(['mun_id', 'Sexo', 'Idade'], as_index=False)['Peso'].sum()
+    df_2022 = synthetic.census_2022_population(mun_ids=MUN_IDS)
+
+    result = municipality_pop_pyramid.concatenate_treated_dfs_batch([
+        municipality_pop_pyramid.standard_age_groups_batch(df_2022, AGE_GROUPS_2022, 2022),
+        municipality_pop_pyramid.standard_age_groups_batch(df_2010, AGE_GROUPS_2000_2010, 2010),
+        ])
+
+    assert result.columns.tolist() == [2010, 2022]
+    assert len(result) == len(MUN_IDS) * 2 * len(LABELS)
+    totals = result.groupby(level='mun_id').sum()
+    assert totals[2022].to_dict() == df_2022.groupby('mun_id')['Pop'].sum().to_dict()
+    assert totals[2010].to_numpy() == pytest.approx(df_2010.groupby('mun_id')['Peso'].sum().to_numpy(),
+                                                    abs=len(LABELS))
+    # the five-year 2022 labels fall into the decades of the 2000 and 2010 csv
+    under_ten = df_2022[df_2022['Idade'].isin(['0 a 4 anos', '5 a 9 anos'])]['Pop'].sum()
+    assert result.xs('0 a 9 anos', level='Faixa Etária')[2022].sum() == under_ten
+
+
+def test_deaths_standard_age_groups_count_every_death_of_known_sex():
+    df = synthetic.deaths_microdata(mun_ids=MUN_IDS[:1], start_year=2018, end_year=2020, scale=5)
+
+    result = municipality_deaths.standard_age_groups(df.drop(columns='mun_id'), AGE_GROUPS_2000_2010)
+
+    known = df[df['Sexo'].isin(['1', '2'])]
+    assert result.columns.tolist() == [2018, 2019, 2020]
+    assert result.to_numpy().sum() == len(known)
+    ages = known['Idade'].fillna(int(df['Idade'].mean())).to_numpy()
+    expected = _expected_groups(ages, np.ones(len(ages)))
+    assert result.groupby(level='Faixa Etária', observed=True).sum().sum(axis=1).to_numpy() == pytest.approx(expected)
+
+
+def test_births_standard_age_groups_leave_mothers_out_of_scope_out():
+    df = synthetic.births_microdata(mun_ids=MUN_IDS[:1], start_year=2019, end_year=2020, scale=5)
+
+    result = municipality_births.standard_age_groups(df.drop(columns='mun_id'), AGE_GROUPS_MOTHERS)
+
+    ages = df['Idade'].fillna(int(df['Idade'].mean()))
+    assert result['Nascimentos'].sum() == ((ages >= 10) & (ages <= 49)).sum()
+    assert result.index.get_level_values('Faixa Etária').unique().astype(str).tolist() == [
+        '10 a 19 anos', '20 a 29 anos', '30 a 39 anos', '40 a 49 anos']
+
+
+def test_aggregate_national_deaths_matches_a_groupby():
+    df = synthetic.deaths_microdata(mun_ids=MUN_IDS, start_year=2020, end_year=2021, scale=1)
+    scheme = age_groups.load_scheme(AGE_GROUPS_2000_2010)
+
+    (mun_ids, years, sexes), counts = age_groups.aggregate(df, scheme, by=['mun_id', 'Ano', 'Sexo'])
+
+    assert counts.sum() == df['Idade'].notna().sum()
+    first = df[(df['mun_id'] == mun_ids[0]) & (df['Ano'] == years[0]) & (df['Sexo'] == sexes[0])]
+    expected = _expected_groups(first['Idade'].dropna().to_numpy(), np.ones(first['Idade'].notna().sum()))
+    assert counts[0, 0, 0].tolist() == expected.tolist()
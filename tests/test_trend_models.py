@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from br_demography import trend_models
+
+YEARS = list(range(2000, 2021))
+
+
+def _rates():
+    x = np.arange(len(YEARS))
+    return pd.DataFrame([20 * np.exp(-0.05 * x), 3 + 0.4 * x], index=['exponencial', 'linear'], columns=YEARS)
+
+
+def test_exact_exponential_and_linear_rates_recover_their_parameters():
+    result = trend_models.fit_trend_models(_rates(), models=['Exponencial', 'Linear'])
+
+    assert result['Tipo de Modelo'].tolist() == ['Exponencial', 'Linear']
+    assert result.loc['exponencial', ['Constante', 'Coeficiente']].tolist() == pytest.approx([20, 0.05])
+    assert result.loc['linear', ['Constante', 'Coeficiente']].tolist() == pytest.approx([3, 0.4])
+    assert result['RMSE'].tolist() == pytest.approx([0, 0], abs=1e-9)
+    assert result['N'].tolist() == [len(YEARS)] * 2
+
+
+def test_projected_rates_continue_the_trend():
+    params = trend_models.fit_trend_models(_rates(), models=['Exponencial', 'Linear'])
+
+    projected = trend_models.project_rates(params, [2030, 2040])
+
+    assert projected.loc['exponencial'].tolist() == pytest.approx([20 * np.exp(-1.5), 20 * np.exp(-2)])
+    assert projected.loc['linear'].tolist() == pytest.approx([15, 19])
+
+
+def test_zeros_are_left_out_and_rows_without_points_are_not_fitted():
+    rates = _rates()
+    rates.loc['linear', [2001, 2002]] = 0
+    rates.loc['vazio'] = 0
+
+    result = trend_models.fit_trend_models(rates, models=['Exponencial', 'Linear'], criterion='aic')
+
+    assert result.loc['linear', 'N'] == len(YEARS) - 2
+    assert result.loc['linear', ['Constante', 'Coeficiente']].tolist() == pytest.approx([3, 0.4])
+    assert result.loc['vazio', 'Tipo de Modelo'] is None
+
+
+def test_unknown_model_raises():
+    with pytest.raises(ValueError):
+        trend_models.fit_trend_models(_rates(), models=['Quadrático'])